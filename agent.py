@@ -1,13 +1,39 @@
-import re
 import os
-import requests
+import time
+from collections import deque
 import json
+import requests
 from langchain_core.prompts import PromptTemplate
 from dotenv import load_dotenv
 
 load_dotenv()
 
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+import telemetry
+from lab_extractor import extract_lab_metrics
+from report_compactor import compact_report, estimate_tokens
+from report_index import index_report
+from metrics_stream import MetricsStreamParser, parse_metrics, normalize_metric
+from result_cache import ResultCache, make_cache_key, normalize_text
+from groq_client import GroqClient, GroqAPIError, parse_usage
+from llm_scheduler import LLMScheduler
+
+MODEL_NAME = "llama-3.3-70b-versatile"
+
+# "two_call" sends separate recommendations and metrics prompts (streamed);
+# "combined" makes one JSON-mode call returning both, see generate_analysis
+AGENT_MODE = os.getenv("MEDISCAN_AGENT_MODE", "two_call")
+
+# One pooled, retrying client for every call made by this module
+groq_client = GroqClient()
+
+# Shared by every Streamlit session and persisted across restarts
+result_cache = ResultCache()
+
+# Coalesces identical in-flight calls and paces all calls to the Groq quotas
+scheduler = LLMScheduler()
+
+# Most recent streamed calls: time to first token and total generation time
+call_timings = deque(maxlen=50)
 
 # Recommendation prompt template (unchanged)
 improved_prompt_template = PromptTemplate(
@@ -59,69 +85,476 @@ Respond only with the JSON object.
 """
 )
 
+# Map step for reports too long for one prompt: condense one section into findings
+findings_prompt_template = PromptTemplate(
+    input_variables=["report"],
+    template="""You are a clinical laboratory assistant. Below is one section of a longer blood test report. List every test in it as "Test: value unit (reference range) - Normal/High/Low", one per line, followed by any remarks printed in the section. Do not add advice or commentary.
+
+**Report Section:**
+{report}
+"""
+)
+
+# Single JSON-mode prompt returning both metrics and recommendations (combined mode)
+analysis_prompt_template = PromptTemplate(
+    input_variables=["report"],
+    template="""You are a compassionate, highly knowledgeable virtual health assistant with expertise in hematology and diagnostics. Analyze the blood report details below and respond with a single JSON object of this form:
+
+{{
+  "metrics": [
+    {{
+      "name": "Metric Name",
+      "value": numeric value,
+      "unit": "unit if applicable",
+      "normal_range": [min_value, max_value]
+    }}
+  ],
+  "recommendations": "markdown text"
+}}
+
+"metrics" lists every test mentioned in the report with its accurately extracted value; omit tests whose value cannot be determined.
+
+"recommendations" is a markdown string with three sections using bullet points:
+1. **Potential Health Concerns:** abnormal values and the conditions they may point to.
+2. **Medication Guidance (General Information Only):** possible treatments, clearly stated as general guidance and not a substitute for professional medical advice.
+3. **Diet and Lifestyle Recommendations:** actionable dietary and lifestyle changes.
+
+**Blood Report Details:**
+{report}
+"""
+)
+
+# Top-level keys a combined-mode response must have; see validate_analysis for the rest of its shape
+ANALYSIS_KEYS = ("metrics", "recommendations")
+
 def validate_blood_report(text: str) -> bool:
-    """Check if the text appears to be a blood report by looking for key terms."""
-    keywords = [
-        "hemoglobin", "RBC", "WBC", "platelets", "MCV", "MCH",
-        "creatinine", "bilirubin", "dengue", "IgG", "IgM", "ELISA",
-        "antibody", "infection", "glucose", "cholesterol"
-    ]
-    return any(re.search(rf"\b{keyword}\b", text, re.IGNORECASE) for keyword in keywords)
+    """Check if the text appears to be a blood report by looking for key terms (see report_index)."""
+    return index_report(text).is_blood_report
 
-def generate_recommendations(text: str) -> str:
-    """Generate structured health recommendations if the text appears to be a blood report."""
-    if not validate_blood_report(text):
-        return "⚠️ This tool is designed for analyzing blood reports only. Please upload a valid blood report."
-    
+def _llm_cache_key(text: str, template: PromptTemplate, payload: dict) -> str:
+    """Key a completion on the normalized report, the prompt template, model and sampling params."""
+    # Streaming is a transport detail; streamed and buffered completions share entries
+    params = {k: v for k, v in payload.items() if k not in ("messages", "stream", "stream_options")}
+    return make_cache_key(normalize_text(text), template.template, params)
+
+def is_error_message(text) -> bool:
+    """
+    True for the "Error: ..." text the generate_* functions return instead of
+    raising when a call fails (for generate_analysis, its "recommendations").
+    """
+    return isinstance(text, str) and text.startswith("Error:")
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters and the latency/tokens saved by the LLM result cache."""
+    return result_cache.stats()
+
+def get_scheduler_stats() -> dict:
+    """Admissions per priority, coalesced calls and current queue of the Groq call scheduler."""
+    return scheduler.stats()
+
+def _reserved_tokens(payload: dict) -> int:
+    """Tokens to charge against the per-minute quota before the call: prompt estimate plus the completion cap."""
+    prompt = "".join(message["content"] for message in payload["messages"])
+    return estimate_tokens(prompt) + payload.get("max_completion_tokens", 0)
+
+def get_call_timings() -> list:
+    """Timing records of recent streamed calls, newest last."""
+    return list(call_timings)
+
+def _record_usage(span, call: str, usage: dict):
+    """Attach Groq usage to the call's span and export token counts and queue/processing times."""
+    span.set(**usage)
+    telemetry.inc("mediscan_llm_tokens_total", usage["prompt_tokens"], call=call, kind="prompt")
+    telemetry.inc("mediscan_llm_tokens_total", usage["completion_tokens"], call=call, kind="completion")
+    telemetry.observe("mediscan_llm_queue_seconds", usage["queue_time"], call=call)
+    telemetry.observe("mediscan_llm_processing_seconds", usage["total_time"], call=call)
+
+def _recommendations_payload(text: str) -> dict:
     formatted_prompt = improved_prompt_template.format(report=text)
-    messages = [
-        {"role": "system", "content": formatted_prompt}
-    ]
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "llama-3.3-70b-versatile",
-        "messages": messages,
+    return {
+        "model": MODEL_NAME,
+        "messages": [{"role": "system", "content": formatted_prompt}],
         "temperature": 0.7,
         "max_completion_tokens": 512
     }
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    response = requests.post(url, headers=headers, json=payload)
-    
-    if response.status_code != 200:
-        return f"Error: API call failed with status code {response.status_code}. Response: {response.text}"
-    
-    result = response.json()
-    return result.get("choices", [{}])[0].get("message", {}).get("content", "No completion found.")
 
-# In agent.py, update generate_health_metrics function
-def generate_health_metrics(text: str) -> str:
-    """Generate structured health metrics analysis in JSON format based on the blood report."""
-    if not validate_blood_report(text):
-        return '{"metrics": []}'
-    
+def _health_metrics_payload(text: str) -> dict:
     formatted_prompt = health_metrics_prompt_template.format(report=text)
-    messages = [
-        {"role": "system", "content": formatted_prompt}
-    ]
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "llama-3.3-70b-versatile",
-        "messages": messages,
+    return {
+        "model": MODEL_NAME,
+        "messages": [{"role": "system", "content": formatted_prompt}],
         "temperature": 0.7,
         "max_completion_tokens": 1024  # Increased from 512
     }
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    response = requests.post(url, headers=headers, json=payload)
-    
-    if response.status_code != 200:
-        return '{"metrics": []}'
+
+def _analysis_payload(text: str) -> dict:
+    formatted_prompt = analysis_prompt_template.format(report=text)
+    return {
+        "model": MODEL_NAME,
+        "messages": [{"role": "system", "content": formatted_prompt}],
+        "temperature": 0.3,
+        "max_completion_tokens": 2048,
+        "response_format": {"type": "json_object"}
+    }
+
+def _findings_payload(text: str) -> dict:
+    formatted_prompt = findings_prompt_template.format(report=text)
+    return {
+        "model": MODEL_NAME,
+        "messages": [{"role": "system", "content": formatted_prompt}],
+        "temperature": 0.0,
+        "max_completion_tokens": 1024
+    }
+
+def _response_summary(completion: dict) -> dict:
+    """Log fields for a completion: its id, model, usage and finish reason, never the content (it holds patient data)."""
+    raw = completion["raw"]
+    choices = raw.get("choices") or [{}]
+    return {
+        "id": raw.get("id"),
+        "model": raw.get("model"),
+        "usage": completion["usage"],
+        "finish_reason": choices[0].get("finish_reason"),
+    }
+
+class InvalidCompletionError(ValueError):
+    """Raised when a completion fails its caller's validation; `content` keeps the text for partial recovery."""
+
+    def __init__(self, message: str, content: str):
+        super().__init__(message)
+        self.content = content
+
+def _validated(validate, content):
+    if validate is None:
+        return content
+    try:
+        return validate(content)
+    except ValueError as e:
+        raise InvalidCompletionError(str(e), content) from e
+
+def _cached_chat(call: str, template: PromptTemplate, report: str, payload: dict, validate=None):
+    """
+    Run one chat completion through the result cache, with a telemetry span.
+
+    With `validate`, the completion is passed through it and its return value
+    is returned. A completion it rejects with ValueError is neither cached nor
+    shared with coalesced callers; InvalidCompletionError is raised instead.
+    Raises GroqAPIError or requests.RequestException when the call fails.
+    """
+    cache_key = _llm_cache_key(report, template, payload)
+    with telemetry.span(f"llm.{call}", model=MODEL_NAME) as span:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            try:
+                result = _validated(validate, cached)
+            except InvalidCompletionError:
+                # Stored before it was validated; call again and replace it
+                cached = None
+        span.set(cache_hit=cached is not None)
+        if cached is not None:
+            return result
+
+        with scheduler.single_flight(cache_key) as (flight, leader):
+            span.set(coalesced=not leader)
+            if not leader:
+                return _validated(validate, flight.result())
+
+            with scheduler.admitted(_reserved_tokens(payload)) as admission:
+                span.set(admission_wait_s=admission["wait_seconds"])
+                try:
+                    completion = groq_client.chat(payload)
+                except GroqAPIError as e:
+                    span.set(http_status=e.status_code)
+                    raise
+                admission["total_tokens"] = completion["usage"]["total_tokens"] or admission["total_tokens"]
+
+            _record_usage(span, call, completion["usage"])
+            telemetry.event(f"llm.{call}.response", **_response_summary(completion))
+            content = completion["content"]
+            # Raising here ends the flight with the error, so a rejected completion is never cached or shared
+            result = _validated(validate, content)
+            if content:
+                result_cache.set(cache_key, content, completion["elapsed"], completion["usage"]["total_tokens"])
+                flight.append(content)
+            return result
+
+def _compact(text: str) -> dict:
+    """Compact the report for prompting and export how many prompt tokens that saved."""
+    with telemetry.span("prompt.compact") as span:
+        compacted = compact_report(text)
+        span.set(
+            original_tokens=compacted["original_tokens"],
+            compacted_tokens=compacted["compacted_tokens"],
+            chunks=len(compacted["chunks"]),
+        )
+    telemetry.inc("mediscan_prompt_tokens_saved_total", compacted["tokens_saved"])
+    return compacted
+
+def _recommendations_report(text: str) -> str:
+    """
+    The report text to embed in the recommendations prompt: the compacted
+    report, or for over-budget reports the merged findings of each chunk (map step).
+    """
+    chunks = _compact(text)["chunks"]
+    if len(chunks) == 1:
+        return chunks[0]
+    findings = [
+        _cached_chat("findings", findings_prompt_template, chunk, _findings_payload(chunk)) or ""
+        for chunk in chunks
+    ]
+    return "\n".join(finding.strip() for finding in findings if finding)
+
+def generate_recommendations(text: str) -> str:
+    """
+    Generate structured health recommendations if the text appears to be a blood report.
+    Returns "Error: ..." text when the call fails (see is_error_message).
+    """
+    if not validate_blood_report(text):
+        return "⚠️ This tool is designed for analyzing blood reports only. Please upload a valid blood report."
     
-    result = response.json()
-    print(result)  # Keep for debugging
-    return result.get("choices", [{}])[0].get("message", {}).get("content", '{"metrics": []}')
+    try:
+        report = _recommendations_report(text)
+        content = _cached_chat("recommendations", improved_prompt_template, report, _recommendations_payload(report))
+    except GroqAPIError as e:
+        return f"Error: {e}"
+    except requests.RequestException as e:
+        return f"Error: API call failed: {e}"
+    return content or "No completion found."
+
+def _stream_cached_chat(call: str, template: PromptTemplate, report: str, payload: dict):
+    """
+    Streaming counterpart of _cached_chat: yields content deltas as they arrive
+    and caches the joined completion. Cached results are yielded in one piece,
+    and a call identical to one already in flight replays that call's deltas.
+    Time to first token and total generation time are appended to `call_timings`.
+    Raises GroqAPIError or requests.RequestException when the call fails.
+    """
+    cache_key = _llm_cache_key(report, template, payload)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        call_timings.append({"call": call, "cached": True, "ttft_s": 0.0, "total_s": 0.0})
+        yield cached
+        return
+
+    with scheduler.single_flight(cache_key) as (flight, leader):
+        if leader:
+            for delta in _stream_chat(call, cache_key, payload):
+                flight.append(delta)
+                yield delta
+        else:
+            yield from flight.iter_chunks()
+
+def _stream_chat(call: str, cache_key: str, payload: dict):
+    """Leader side of _stream_cached_chat: make the admitted streaming call, record timings and cache the result."""
+    started = time.perf_counter()
+    first_token_at = None
+    parts = []
+    usage = parse_usage({})
+    with telemetry.span(f"llm.{call}", model=MODEL_NAME, cache_hit=False, stream=True) as span, \
+            scheduler.admitted(_reserved_tokens(payload)) as admission:
+        span.set(admission_wait_s=admission["wait_seconds"])
+        try:
+            for chunk in groq_client.stream_chat(payload):
+                # Groq reports usage on the final chunk under x_groq; OpenAI under usage
+                if chunk.get("usage") or chunk.get("x_groq", {}).get("usage"):
+                    usage = parse_usage(chunk)
+                for choice in chunk.get("choices", []):
+                    delta = choice.get("delta", {}).get("content")
+                    if delta:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        parts.append(delta)
+                        yield delta
+        except GroqAPIError as e:
+            span.set(http_status=e.status_code)
+            raise
+
+        finished = time.perf_counter()
+        ttft = (first_token_at or finished) - started
+        call_timings.append({
+            "call": call,
+            "cached": False,
+            "ttft_s": ttft,
+            "total_s": finished - started,
+        })
+        span.set(ttft_s=ttft)
+        telemetry.observe("mediscan_llm_ttft_seconds", ttft, call=call)
+        _record_usage(span, call, usage)
+        admission["total_tokens"] = usage["total_tokens"] or admission["total_tokens"]
+        if parts:
+            result_cache.set(cache_key, "".join(parts), finished - started, usage["total_tokens"])
+
+def stream_recommendations(text: str):
+    """Streaming variant of generate_recommendations that yields text deltas as they arrive."""
+    if not validate_blood_report(text):
+        yield "⚠️ This tool is designed for analyzing blood reports only. Please upload a valid blood report."
+        return
+
+    try:
+        report = _recommendations_report(text)
+        yield from _stream_cached_chat(
+            "recommendations", improved_prompt_template, report, _recommendations_payload(report)
+        )
+    except GroqAPIError as e:
+        yield f"Error: {e}"
+    except requests.RequestException as e:
+        yield f"Error: API call failed: {e}"
+
+def _parse_metrics_json(content: str) -> list:
+    """Parse an LLM metrics response, keeping every complete metric object even if the tail is cut off."""
+    with telemetry.span("llm.parse_metrics_json", chars=len(content)) as span:
+        metrics = parse_metrics(content)
+        span.set(parsed=len(metrics))
+        return metrics
+
+def _stream_llm_metrics(text: str):
+    """
+    Stream the LLM metrics response for `text` after compaction and yield each
+    metric as soon as its object is complete. Over-budget reports are sent
+    chunk by chunk; a failed chunk does not stop the others, and the first
+    failure is raised once every chunk has been tried.
+    """
+    failure = None
+    for chunk in _compact(text)["chunks"]:
+        parser = MetricsStreamParser()
+        try:
+            for delta in _stream_cached_chat(
+                "health_metrics", health_metrics_prompt_template, chunk, _health_metrics_payload(chunk)
+            ):
+                yield from parser.feed(delta)
+        except (GroqAPIError, requests.RequestException) as e:
+            telemetry.inc("mediscan_llm_failures_total", call="health_metrics")
+            telemetry.event("llm.health_metrics.error", error=str(e))
+            failure = failure or e
+    if failure is not None:
+        raise failure
+
+def stream_health_metrics(text: str, rows: list = None):
+    """
+    Yield metric dicts (`name`, `value`, `unit`, `normal_range`) as they become available.
+
+    Rows are parsed locally with lab_extractor first (`rows` defaults to the
+    lines of `text`) and yielded at once; the LLM only sees the rows that could
+    not be parsed, or the whole report when nothing could be parsed locally.
+    Metrics whose name was already yielded are skipped. A failed LLM call
+    raises GroqAPIError or requests.RequestException after the metrics that
+    did arrive.
+    """
+    if not validate_blood_report(text):
+        return
+
+    with telemetry.span("metrics.local_extract") as span:
+        metrics, unparsed = _local_metrics(text, rows)
+        span.set(parsed=len(metrics), unparsed=len(unparsed))
+    known = set()
+    for metric in metrics:
+        known.add(metric["name"].lower())
+        yield metric
+    if metrics and not unparsed:
+        return
+
+    for metric in _stream_llm_metrics("\n".join(unparsed) if metrics else text):
+        if metric["name"].lower() not in known:
+            known.add(metric["name"].lower())
+            yield metric
+
+def _local_metrics(text: str, rows: list = None) -> tuple:
+    """extract_lab_metrics over `rows` (default: the lines of `text`), reusing the report index."""
+    report = "\n".join(rows) if rows is not None else text
+    return extract_lab_metrics(report.split("\n"), index=index_report(report))
+
+def generate_health_metrics(text: str, rows: list = None) -> str:
+    """
+    Generate structured health metrics analysis in JSON format based on the blood report.
+
+    Returns `{"metrics": [...]}` JSON, or "Error: ..." text when the LLM call
+    fails, like the other generate_* functions (see is_error_message).
+    """
+    try:
+        metrics = list(stream_health_metrics(text, rows))
+    except GroqAPIError as e:
+        return f"Error: {e}"
+    except requests.RequestException as e:
+        return f"Error: API call failed: {e}"
+    return json.dumps({"metrics": metrics})
+
+def _merge_metrics(metrics: list, extra: list) -> list:
+    """Append metrics from `extra` whose names are not already in `metrics`."""
+    known = {metric["name"].lower() for metric in metrics}
+    for metric in extra:
+        if metric["name"].lower() not in known:
+            known.add(metric["name"].lower())
+            metrics.append(metric)
+    return metrics
+
+def validate_analysis(data) -> dict:
+    """
+    Check a combined-mode response and return it normalized.
+
+    The response must be an object with ANALYSIS_KEYS, "metrics" an array and
+    "recommendations" a string, or ValueError is raised. Metric items go
+    through normalize_metric: numeric strings are coerced, a missing or
+    malformed "normal_range" becomes [0, 0], and items without a name or a
+    numeric value are dropped, the way the streaming parser skips them.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("response is not a JSON object")
+    missing = [key for key in ANALYSIS_KEYS if key not in data]
+    if missing:
+        raise ValueError(f"response is missing {', '.join(missing)}")
+    if not isinstance(data["metrics"], list):
+        raise ValueError("metrics is not an array")
+    if not isinstance(data["recommendations"], str):
+        raise ValueError("recommendations is not a string")
+    metrics = [metric for metric in map(normalize_metric, data["metrics"]) if metric is not None]
+    return {"metrics": metrics, "recommendations": data["recommendations"]}
+
+def _parse_analysis(content: str) -> dict:
+    """validate_analysis for a raw combined-mode completion; raises ValueError when it is not valid JSON of that shape."""
+    with telemetry.span("llm.validate_analysis", chars=len(content or "")) as span:
+        try:
+            return validate_analysis(json.loads(content or ""))
+        except ValueError:
+            span.set(valid=False)
+            raise
+
+def generate_analysis(text: str, rows: list = None) -> dict:
+    """
+    Combined mode: one JSON-mode call returning `{"metrics": [...], "recommendations": markdown}`.
+
+    Locally parsed metrics (see generate_health_metrics) take precedence over
+    the LLM's. On API or validation errors the local metrics are still returned
+    and "recommendations" holds the "Error: ..." message; a reply cut off by
+    the token limit also keeps the LLM metrics that arrived intact. Invalid
+    replies are not cached, so the next call asks Groq again.
+    """
+    if not validate_blood_report(text):
+        return {
+            "metrics": [],
+            "recommendations": "⚠️ This tool is designed for analyzing blood reports only. Please upload a valid blood report.",
+        }
+
+    with telemetry.span("metrics.local_extract") as span:
+        metrics, unparsed = _local_metrics(text, rows)
+        span.set(parsed=len(metrics), unparsed=len(unparsed))
+
+    try:
+        report = _recommendations_report(text)
+        analysis = _cached_chat(
+            "analysis", analysis_prompt_template, report, _analysis_payload(report), validate=_parse_analysis
+        )
+    except InvalidCompletionError as e:
+        recovered = parse_metrics(e.content or "")
+        return {
+            "metrics": _merge_metrics(metrics, recovered),
+            "recommendations": f"Error: invalid structured response: {e}",
+        }
+    except GroqAPIError as e:
+        return {"metrics": metrics, "recommendations": f"Error: {e}"}
+    except requests.RequestException as e:
+        return {"metrics": metrics, "recommendations": f"Error: API call failed: {e}"}
+
+    return {
+        "metrics": _merge_metrics(metrics, analysis["metrics"]),
+        "recommendations": analysis["recommendations"] or "No completion found.",
+    }
@@ -1,10 +1,53 @@
-import streamlit as st
-from pdf_processor import extract_text_from_pdf
-from agent import generate_recommendations, generate_health_metrics
 import time
-import json  # Needed for parsing JSON responses
+import hashlib
+import functools
+from dotenv import load_dotenv
+
+# Load .env before the project modules read their MEDISCAN_* settings at import time
+load_dotenv()
+
+import streamlit as st
+from pdf_processor import iter_pdf_pages, get_ocr_cache_stats, PDFLimitError
+from agent import get_cache_stats, get_call_timings, get_scheduler_stats
+from pipeline import start_llm_stage, finished_llm_stage
+import service_client
+from report_compactor import compact_report
+from report_index import index_pages
+from metrics_chart import metrics_frame, range_chart, trend_frame, trend_chart
+from metrics_store import MetricsStore
+from lab_extractor import canonical_analyte
 import plotly.graph_objects as go
-import re
+import telemetry
+
+# Whole-script time of this run; fragment-only reruns are timed by timed_rerun
+run_started = time.perf_counter()
+
+# Serves /metrics when MEDISCAN_TELEMETRY and MEDISCAN_METRICS_PORT are set
+telemetry.start_metrics_server()
+
+
+def record_rerun(scope: str, started: float):
+    """Keep the last 20 run times of this session and export them as a histogram."""
+    elapsed = time.perf_counter() - started
+    timings = st.session_state.setdefault("rerun_timings", [])
+    timings.append({"scope": scope, "ms": round(elapsed * 1000, 1)})
+    del timings[:-20]
+    telemetry.observe("mediscan_ui_rerun_seconds", elapsed, scope=scope)
+
+
+def timed_rerun(scope: str):
+    """Decorator recording how long each run of a tab fragment takes."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_rerun(scope, started)
+        return wrapper
+    return decorate
+
 
 # Page configuration
 st.set_page_config(
@@ -237,6 +280,12 @@ with st.sidebar:
     4. Review recommendations
     """)
     
+    st.markdown("---")
+    st.markdown("### Patient")
+    st.text_input("Patient ID", key="patient_id",
+                  help="Metrics of reports processed under an ID are saved, and the Health Metrics tab charts their trends")
+    st.date_input("Report date", key="report_date", help="Sample date of the report being uploaded")
+    
     st.markdown("---")
     st.markdown("### About the Model")
     st.markdown("""
@@ -248,6 +297,47 @@ with st.sidebar:
     - Nutritional insights
     """)
     
+    st.markdown("---")
+    with st.expander("Cache statistics"):
+        cache_stats = get_cache_stats()
+        st.markdown(f"""
+        - **Hit rate:** {cache_stats['hit_rate']:.0%}
+        - **Hits (memory / disk):** {cache_stats['memory_hits']} / {cache_stats['disk_hits']}
+        - **Misses:** {cache_stats['misses']}
+        - **Latency saved:** {cache_stats['saved_seconds']:.1f} s
+        - **Tokens saved:** {cache_stats['saved_tokens']}
+        """)
+        ocr_cache_stats = get_ocr_cache_stats()
+        st.markdown(f"""
+        - **OCR page hit rate:** {ocr_cache_stats['hit_rate']:.0%}
+        - **OCR pages (hits / misses):** {ocr_cache_stats['memory_hits'] + ocr_cache_stats['disk_hits']} / {ocr_cache_stats['misses']}
+        - **OCR time saved:** {ocr_cache_stats['saved_seconds']:.1f} s
+        """)
+    
+    with st.expander("Groq scheduler"):
+        scheduler_stats = get_scheduler_stats()
+        st.markdown(f"""
+        - **Calls (interactive / batch):** {scheduler_stats['admitted']['interactive']} / {scheduler_stats['admitted']['batch']}
+        - **Duplicate calls coalesced:** {scheduler_stats['coalesced']}
+        - **Waiting for quota:** {scheduler_stats['waiting']}
+        - **Total quota wait:** {scheduler_stats['wait_seconds']:.1f} s
+        """)
+    
+    with st.expander("Streaming latency"):
+        recent_calls = get_call_timings()[-5:]
+        if recent_calls:
+            st.dataframe(recent_calls, width="stretch")
+        else:
+            st.caption("No streamed calls yet.")
+    
+    with st.expander("Rerun timings"):
+        # "app" is a full script run; tab names are fragment-only reruns
+        recent_runs = st.session_state.get("rerun_timings", [])[-10:]
+        if recent_runs:
+            st.dataframe(recent_runs, width="stretch")
+        else:
+            st.caption("No reruns yet.")
+    
     st.markdown("---")
     st.markdown("<div class='disclaimer'>This tool is for informational purposes only and not a substitute for professional medical advice.</div>", unsafe_allow_html=True)
 
@@ -260,11 +350,166 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Main content in tabs
-tabs = st.tabs(["📄 Upload Report", "📋 Analysis", "🔍 Recommendations", "📊 Health Metrics"])
+def render_metrics_overview(metrics: list, placeholder):
+    """Draw one range chart for all metrics into `placeholder`; clicked points get their detail gauges below."""
+    frame = metrics_frame(metrics)
+    event = placeholder.plotly_chart(
+        range_chart(frame), width="stretch",
+        key=f"metrics_chart_{st.session_state.get('report_number', 0)}", on_select="rerun", selection_mode="points",
+    )
+    outside = int(frame["status"].isin(["Below normal", "Above normal"]).sum())
+    st.caption(f"{outside} of {len(frame)} outside the normal range. Click a point to see its gauge.")
+    points = event.selection.points if event else []
+    # Ignore indices a stale selection may hold past the end of this report's metrics
+    selected = sorted({point["point_index"] for point in points if 0 <= point.get("point_index", -1) < len(metrics)})
+    for index in selected:
+        render_metric(metrics[index])
+
+def render_metric(metric: dict):
+    """Draw the gauge and summary lines for one metric."""
+    name = metric.get('name', 'Unknown')
+    value = metric.get('value', 0)
+    unit = metric.get('unit', '')
+    min_normal, max_normal = metric.get('normal_range', [0, 0])
+
+    if value < min_normal:
+        status = "Below normal"
+        color = "red"
+    elif value > max_normal:
+        status = "Above normal"
+        color = "red"
+    else:
+        status = "Normal"
+        color = "green"
+
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value,
+        domain={'x': [0, 1], 'y': [0, 1]},
+        title={'text': f"{name} ({unit})"},
+        gauge={
+            'axis': {'range': [min_normal * 0.8, max_normal * 1.2]},
+            'bar': {'color': color},
+            'steps': [
+                {'range': [min_normal, max_normal], 'color': "lightgreen"},
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': value
+            }
+        }
+    ))
+    st.plotly_chart(fig, width="stretch")
 
-# Tab 1: Upload Report
-with tabs[0]:
+    st.markdown(f"**{name}:** {value} {unit} ({status})")
+    st.markdown(f"**Normal Range:** {min_normal} - {max_normal} {unit}")
+    st.markdown("---")
+
+@st.cache_resource
+def get_metrics_store() -> MetricsStore:
+    return MetricsStore()
+
+def metrics_saver(uploaded_file):
+    """
+    Hook for the LLM stage that stores the report's metrics once they have all
+    arrived, under the sidebar's patient ID and date as they are now; None without a patient ID.
+    """
+    patient_id = st.session_state.get("patient_id", "").strip()
+    if not patient_id:
+        return None
+    # Resolved here: the hook runs on a pipeline worker thread, outside the Streamlit script
+    store = get_metrics_store()
+    report_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    report_date = st.session_state["report_date"].isoformat()
+    filename = uploaded_file.name
+
+    def save(metrics: list):
+        with telemetry.span("store.save_report", metrics=len(metrics)):
+            store.save_report(report_hash, patient_id, report_date, metrics, filename)
+
+    return save
+
+def render_trends(patient_id: str, current: list):
+    """Chart the patient's stored history; analytes of the current report are preselected."""
+    st.markdown("### Trends")
+    store = get_metrics_store()
+    with telemetry.span("store.history"):
+        frame = trend_frame(store.history(patient_id))
+    # Only analytes with a normal range and at least two reports have a line to draw
+    counts = frame.dropna(subset=["position"]).groupby("name")["date"].nunique()
+    names = sorted(counts[counts >= 2].index)
+    if not names:
+        st.info(f"No trends yet for patient {patient_id}: metrics appear here once two reports share an analyte.")
+        return
+    current_names = {canonical_analyte(str(metric.get("name", ""))) for metric in current}
+    selected = st.multiselect(
+        "Analytes", names, default=[name for name in names if name in current_names][:5] or names[:5],
+        key="trend_analytes",
+    )
+    if selected:
+        st.plotly_chart(trend_chart(frame[frame["name"].isin(selected)]), width="stretch")
+    st.caption(f"{len(store.reports(patient_id))} stored report(s) for patient {patient_id}")
+    with st.expander("Summary across reports"):
+        st.dataframe(store.aggregates(patient_id), width="stretch")
+
+def process_locally(uploaded_file) -> bool:
+    """Extract the report in this session and start the LLM stage in the background."""
+    # Progress bar driven by pages as they finish extraction/OCR
+    progress_placeholder = st.empty()
+    progress_bar = progress_placeholder.progress(0, text="Reading report...")
+    pages = []
+    try:
+        for page in iter_pdf_pages(uploaded_file):
+            pages.append(page)
+            progress_bar.progress(
+                len(pages) / page["page_count"],
+                text=f"Processed page {len(pages)} of {page['page_count']}"
+            )
+    except PDFLimitError as e:
+        progress_placeholder.error(f"Error processing report: {e}")
+        return False
+    
+    extracted_text = "\n".join(page["text"] for page in pages)
+    st.session_state["extracted_text"] = extracted_text
+    st.session_state["page_stats"] = [
+        {key: value for key, value in page.items() if key not in ("text", "rows")} for page in pages
+    ]
+    st.session_state["report_index"] = index_pages([page["text"] for page in pages]).summary()
+    # Start both LLM calls now so they run while the user reads the analysis
+    rows = [row for page in pages for row in page["rows"]]
+    compacted = compact_report("\n".join(rows))
+    st.session_state["prompt_tokens"] = {
+        key: compacted[key] for key in ("original_tokens", "compacted_tokens", "tokens_saved")
+    }
+    st.session_state["prompt_tokens"]["chunks"] = len(compacted["chunks"])
+    st.session_state["llm_futures"] = start_llm_stage(extracted_text, rows, metrics_saver(uploaded_file))
+    return True
+
+def process_with_service(uploaded_file) -> bool:
+    """Thin client: queue the report on the MediScan service and poll until its job is done."""
+    progress_bar = st.progress(0, text="Queued for processing...")
+    try:
+        job_id = service_client.submit_report(uploaded_file.name, uploaded_file.getvalue())
+        result = service_client.wait_for_job(job_id, lambda done, total: progress_bar.progress(
+            done / total, text=f"Processed page {done} of {total}"
+        ))
+    except Exception as e:
+        st.error(f"Error processing report: {e}")
+        return False
+    st.session_state["extracted_text"] = result["text"]
+    st.session_state["page_stats"] = result["pages"]
+    st.session_state["prompt_tokens"] = result["prompt_tokens"]
+    st.session_state["report_index"] = result["report_index"]
+    st.session_state["llm_futures"] = finished_llm_stage(
+        result["recommendations"], result["metrics"], result.get("metrics_error"), metrics_saver(uploaded_file)
+    )
+    return True
+
+@st.fragment
+@timed_rerun("upload_tab")
+def upload_tab():
+    """Upload and process a report; starts the LLM stage and reruns the app once done."""
     col1, col2 = st.columns([1, 1])
     
     with col1:
@@ -272,16 +517,17 @@ with tabs[0]:
         uploaded_file = st.file_uploader("Choose a PDF file", type=["pdf"], key="pdf_uploader")
         if uploaded_file is not None:
             if st.button("Process Report", key="process_button"):
-                # Animated progress bar
-                progress_placeholder = st.empty()
-                progress_bar = progress_placeholder.progress(0)
-                for percent_complete in range(0, 101, 10):
-                    time.sleep(0.1)  # Simulate processing time
-                    progress_bar.progress(percent_complete)
-                
-                # Extract text
-                extracted_text = extract_text_from_pdf(uploaded_file)
-                st.session_state["extracted_text"] = extracted_text
+                if service_client.SERVICE_URL:
+                    processed = process_with_service(uploaded_file)
+                else:
+                    processed = process_locally(uploaded_file)
+                if processed:
+                    st.session_state["processed"] = True
+                    # Widgets keyed per report start with no state left over from the previous one
+                    st.session_state["report_number"] = st.session_state.get("report_number", 0) + 1
+                    # The other tabs read the new results, so this one needs a full rerun
+                    st.rerun()
+            if st.session_state.pop("processed", False):
                 st.success("✅ Report processed successfully!")
         else:
             st.info("Please upload a PDF file to begin analysis.")
@@ -302,7 +548,7 @@ with tabs[0]:
         <div class="feature-box pulse">
             <div class="feature-icon">🔒</div>
             <div class="feature-title">Privacy Focused</div>
-            <p>Your data is processed securely and never stored on our servers.</p>
+            <p>Reports are processed on this server. Extraction and AI results are cached on its disk, and metrics are kept only for reports processed under a patient ID.</p>
         </div>
         """, unsafe_allow_html=True)
         
@@ -316,8 +562,10 @@ with tabs[0]:
         
         st.markdown('</div>', unsafe_allow_html=True)
 
-# Tab 2: Analysis
-with tabs[1]:
+@st.fragment
+@timed_rerun("analysis_tab")
+def analysis_tab():
+    """Show the extracted text, prompt size and per-page timings from session state."""
     st.markdown('<div class="card-title">Extracted Report Data</div>', unsafe_allow_html=True)
     
     if "extracted_text" in st.session_state:
@@ -327,6 +575,24 @@ with tabs[1]:
         with st.expander("View Full Extracted Text"):
             st.text_area("Complete Extracted Text", st.session_state["extracted_text"], height=300)
         
+        if "prompt_tokens" in st.session_state:
+            prompt_tokens = st.session_state["prompt_tokens"]
+            st.caption(
+                f"Prompt size: ~{prompt_tokens['original_tokens']} → ~{prompt_tokens['compacted_tokens']} tokens "
+                f"({prompt_tokens['tokens_saved']} saved, {prompt_tokens['chunks']} chunk(s))"
+            )
+        
+        if "report_index" in st.session_state:
+            report_index = st.session_state["report_index"]
+            sections = ", ".join(f"{section['title']} (p. {section['page'] + 1})" for section in report_index["sections"])
+            st.caption(
+                f"Blood report confidence: {report_index['confidence']:.0%} · "
+                f"{len(report_index['analytes'])} analytes found" + (f" · Sections: {sections}" if sections else "")
+            )
+        
+        with st.expander("Extraction timings per page"):
+            st.dataframe(st.session_state.get("page_stats", []), width="stretch")
+        
         st.markdown("### Key Health Indicators")
         
         st.markdown('<div class="metric-container fade-in">', unsafe_allow_html=True)
@@ -358,19 +624,26 @@ with tabs[1]:
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-# Tab 3: Recommendations
-with tabs[2]:
+@st.fragment
+@timed_rerun("recommendations_tab")
+def recommendations_tab():
+    """Show the recommendations buffer; its buttons rerun only this fragment."""
     st.markdown('<div class="card-title">Health Recommendations</div>', unsafe_allow_html=True)
     
-    if "extracted_text" in st.session_state:
-        with st.spinner("Generating personalized recommendations..."):
-            recommendations = generate_recommendations(st.session_state["extracted_text"])
+    if "llm_futures" in st.session_state:
+        recommendations_buffer = st.session_state["llm_futures"]["recommendations"]
+        recommendations_placeholder = st.empty()
+        if recommendations_buffer.done():
+            recommendations = recommendations_buffer.result()
+            recommendations_placeholder.markdown(recommendations)
+        else:
+            # Render deltas as they arrive instead of waiting for the full response
+            with recommendations_placeholder.container():
+                recommendations = st.write_stream(recommendations_buffer.iter_chunks())
         
         if "⚠️" in recommendations:
-            st.error(recommendations)
+            recommendations_placeholder.error(recommendations)
         else:
-            st.markdown(recommendations)
-            
             col1, col2, col3 = st.columns(3)
             with col1:
                 if st.button("📥 Download Report"):
@@ -386,104 +659,62 @@ with tabs[2]:
     
     st.markdown('</div>', unsafe_allow_html=True)
 
-# Tab 4: Health Metrics
-with tabs[3]:
+@st.fragment
+@timed_rerun("metrics_tab")
+def metrics_tab():
+    """Chart the metrics from the metrics buffer as they arrive, compactly or as one gauge each, then the patient's trends."""
     st.markdown('<div class="card-title">Health Metrics Visualization</div>', unsafe_allow_html=True)
     
-    if "extracted_text" in st.session_state:
-        with st.spinner("Generating health metrics analysis..."):
-            health_metrics_response = generate_health_metrics(st.session_state["extracted_text"])
-        
-        response_clean = re.sub(r'^```(?:json)?\s*', '', health_metrics_response)
-        response_clean = re.sub(r'\s*```$', '', response_clean).strip()
-        
-        def parse_partial_json(text):
-            try:
-                data = json.loads(text)
-                return data
-            except json.JSONDecodeError:
-                metrics = []
-                lines = text.split('\n')
-                current_metric = {}
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith('"name":'):
-                        if current_metric:
-                            metrics.append(current_metric)
-                        current_metric = {'name': line.split(':', 1)[1].strip().strip(',"')}
-                    elif line.startswith('"value":'):
-                        try:
-                            current_metric['value'] = float(line.split(':', 1)[1].strip().strip(','))
-                        except ValueError:
-                            continue
-                    elif line.startswith('"unit":'):
-                        current_metric['unit'] = line.split(':', 1)[1].strip().strip(',"')
-                    elif line.startswith('"normal_range":'):
-                        range_str = line.split(':', 1)[1].strip().strip('[]')
-                        try:
-                            min_val, max_val = map(float, range_str.split(','))
-                            current_metric['normal_range'] = [min_val, max_val]
-                        except ValueError:
-                            continue
-                if current_metric and 'value' in current_metric:
-                    metrics.append(current_metric)
-                return {"metrics": metrics}
-        
+    if "llm_futures" in st.session_state:
+        metrics_buffer = st.session_state["llm_futures"]["metrics"]
+        compact = st.toggle("Compact chart", value=True, key="compact_metrics",
+                            help="One chart for every metric instead of a gauge per metric")
+        count_placeholder = st.empty()
+        chart_placeholder = st.empty()
+        metrics = []
         try:
-            metrics_data = parse_partial_json(response_clean)
-            metrics_list = metrics_data.get("metrics", [])
-            
-            if metrics_list:
-                st.markdown(f"### {len(metrics_list)} parameter{'s' if len(metrics_list) > 1 else ''} detected")
-                
-                for metric in metrics_list:
-                    name = metric.get('name', 'Unknown')
-                    value = metric.get('value', 0)
-                    unit = metric.get('unit', '')
-                    min_normal, max_normal = metric.get('normal_range', [0, 0])
-                    
-                    if value < min_normal:
-                        status = "Below normal"
-                        color = "red"
-                    elif value > max_normal:
-                        status = "Above normal"
-                        color = "red"
-                    else:
-                        status = "Normal"
-                        color = "green"
-                    
-                    fig = go.Figure(go.Indicator(
-                        mode="gauge+number",
-                        value=value,
-                        domain={'x': [0, 1], 'y': [0, 1]},
-                        title={'text': f"{name} ({unit})"},
-                        gauge={
-                            'axis': {'range': [min_normal * 0.8, max_normal * 1.2]},
-                            'bar': {'color': color},
-                            'steps': [
-                                {'range': [min_normal, max_normal], 'color': "lightgreen"},
-                            ],
-                            'threshold': {
-                                'line': {'color': "red", 'width': 4},
-                                'thickness': 0.75,
-                                'value': value
-                            }
-                        }
-                    ))
-                    st.plotly_chart(fig, use_container_width=True)
-                    
-                    st.markdown(f"**{name}:** {value} {unit} ({status})")
-                    st.markdown(f"**Normal Range:** {min_normal} - {max_normal} {unit}")
-                    st.markdown("---")
-            else:
-                st.warning("No metrics data extracted from the report.")
+            with telemetry.span("ui.render_charts", compact=compact) as span:
+                if not metrics_buffer.done():
+                    count_placeholder.info("Generating health metrics analysis...")
+                last_drawn = 0.0
+                # Each metric is drawn as soon as its metric object has arrived
+                for metric in metrics_buffer.iter_chunks():
+                    metrics.append(metric)
+                    metrics_count = len(metrics)
+                    count_placeholder.markdown(f"### {metrics_count} parameter{'s' if metrics_count > 1 else ''} detected")
+                    if not compact:
+                        render_metric(metric)
+                    elif time.perf_counter() - last_drawn > 0.5:
+                        # Redraw the single chart while metrics stream in, at most twice a second
+                        chart_placeholder.plotly_chart(range_chart(metrics_frame(metrics)), width="stretch")
+                        last_drawn = time.perf_counter()
+                if compact and metrics:
+                    render_metrics_overview(metrics, chart_placeholder)
+                span.set(charts=1 if compact else len(metrics), metrics=len(metrics))
+            if not metrics:
+                count_placeholder.warning("No metrics data extracted from the report.")
         except Exception as e:
             st.error("Error processing health metrics: " + str(e))
     else:
         st.info("No metrics available yet. Please upload and process a report first.")
     
+    patient_id = st.session_state.get("patient_id", "").strip()
+    if patient_id:
+        render_trends(patient_id, metrics if "llm_futures" in st.session_state else [])
+    
     st.markdown('</div>', unsafe_allow_html=True)
 
+# Main content in tabs; only the open tab runs (lazy tabs), and each is a
+# fragment so widgets inside it rerun just that tab
+tabs = st.tabs(
+    ["📄 Upload Report", "📋 Analysis", "🔍 Recommendations", "📊 Health Metrics"],
+    key="main_tabs", on_change="rerun",
+)
+for tab, render_tab in zip(tabs, [upload_tab, analysis_tab, recommendations_tab, metrics_tab]):
+    if tab.open:
+        with tab:
+            render_tab()
+
 # Footer
 st.markdown("""
 <div class="footer fade-in">
@@ -491,3 +722,5 @@ st.markdown("""
     <p>Not a substitute for professional medical advice. Always consult with healthcare professionals.</p>
 </div>
 """, unsafe_allow_html=True)
+
+record_rerun("app", run_started)
@@ -0,0 +1,255 @@
+"""
+Headless batch mode: process directories of report PDFs and write one JSON result per line.
+
+    python batch.py archive/ "scans/**/*.pdf" --output results.jsonl --cpu-workers 8 --net-workers 4
+
+Re-running with the same --output resumes: files already recorded there
+(same path and content hash) are skipped.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from dotenv import load_dotenv
+
+# Load .env before the project modules read their MEDISCAN_* settings at import time
+load_dotenv()
+
+from pdf_processor import iter_pdf_pages
+import agent
+import llm_scheduler
+from pipeline import llm_report
+from metrics_store import MetricsStore
+from agent import validate_blood_report, generate_health_metrics, generate_recommendations, generate_analysis
+
+
+def find_pdfs(inputs: list) -> list:
+    """Expand directories (recursively) and glob patterns into a sorted list of PDF paths."""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.update(os.path.abspath(path) for path in matches if path.lower().endswith(".pdf"))
+    return sorted(paths)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_checkpoint(output_path: str) -> set:
+    """Return the (file, sha256) pairs already written to `output_path`."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Partial last line from an interrupted run
+            if record.get("status") == "ok":
+                done.add((record["file"], record["sha256"]))
+    return done
+
+
+def _extract(path: str, sha256: str) -> dict:
+    """CPU stage, run in a worker process: extract (and OCR) one PDF."""
+    started = time.perf_counter()
+    texts, rows, ocr_pages, peak_rss = [], [], 0, 0
+    # Parallelism comes from the batch pool; keep OCR serial inside each worker.
+    # Opening by path lets MuPDF read the file lazily instead of loading it whole.
+    for page in iter_pdf_pages(path, ocr_workers=1):
+        texts.append(page["text"])
+        rows.extend(page["rows"])
+        ocr_pages += page["ocr"]
+        peak_rss = max(peak_rss, page["peak_rss_bytes"])
+    return {
+        "file": path,
+        "sha256": sha256,
+        "text": "\n".join(texts),
+        "rows": rows,
+        "pages": len(texts),
+        "ocr_pages": ocr_pages,
+        "peak_rss_bytes": peak_rss,
+        "extract_s": time.perf_counter() - started,
+    }
+
+
+def _analyze(extracted: dict, metrics: bool, recommendations: bool) -> dict:
+    """
+    Network stage, run on a thread: call Groq for one extracted report at batch
+    priority. Raises when a call failed, so the file is not checkpointed as done.
+    """
+    started = time.perf_counter()
+    record = {key: value for key, value in extracted.items() if key not in ("text", "rows")}
+    # The same prompt text as the app, so batch runs warm the cache for interactive users
+    report = llm_report(extracted["text"], extracted["rows"])
+    record["is_blood_report"] = validate_blood_report(report)
+    # Interactive sessions sharing the Groq quota go first
+    with llm_scheduler.priority(llm_scheduler.BATCH):
+        if record["is_blood_report"] and metrics and recommendations and agent.AGENT_MODE == "combined":
+            record.update(generate_analysis(report, extracted["rows"]))
+        elif record["is_blood_report"]:
+            if metrics:
+                content = generate_health_metrics(report, extracted["rows"])
+                if agent.is_error_message(content):
+                    raise RuntimeError(content)
+                record["metrics"] = json.loads(content)["metrics"]
+            if recommendations:
+                record["recommendations"] = generate_recommendations(report)
+    # Failed calls come back as "Error: ..." text; raising records the file as failed so a rerun retries it
+    if agent.is_error_message(record.get("recommendations")):
+        raise RuntimeError(record["recommendations"])
+    record["llm_s"] = time.perf_counter() - started
+    record["status"] = "ok"
+    return record
+
+
+def _percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def _report_date(path: str, report_date: str = None) -> str:
+    """`report_date` if given, else the file's modification date."""
+    return report_date or datetime.date.fromtimestamp(os.path.getmtime(path)).isoformat()
+
+
+def run_batch(paths: list, output_path: str, cpu_workers: int, net_workers: int,
+              metrics: bool = True, recommendations: bool = True, resume: bool = True,
+              patient_id: str = None, report_date: str = None) -> dict:
+    """
+    Push `paths` through extraction (process pool) and Groq analysis (thread pool),
+    appending one JSON line per file to `output_path`. Returns the run summary.
+    With `patient_id`, every report's metrics are also saved to the metrics
+    store, dated `report_date` or by the file's modification date.
+    """
+    metrics_store = MetricsStore() if patient_id and metrics else None
+    done = load_checkpoint(output_path) if resume else set()
+    summary = {"files": len(paths), "ok": 0, "failed": 0, "skipped": 0, "pages": 0}
+    extract_latencies, llm_latencies, total_latencies = [], [], []
+    submitted_at = {}
+    queue = iter(paths)
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=net_workers) as net_pool, \
+            open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+        extracting, analyzing = {}, {}
+
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        def fill():
+            # Bound both stages so a slow Groq stage does not pile up extracted text in memory
+            while len(extracting) < cpu_workers * 2 and len(analyzing) < net_workers * 2:
+                path = next(queue, None)
+                if path is None:
+                    return
+                sha256 = file_sha256(path)
+                if (path, sha256) in done:
+                    summary["skipped"] += 1
+                    continue
+                submitted_at[path] = time.perf_counter()
+                extracting[cpu_pool.submit(_extract, path, sha256)] = path
+
+        fill()
+        while extracting or analyzing:
+            finished, _ = wait(list(extracting) + list(analyzing), return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in extracting:
+                    path = extracting.pop(future)
+                    try:
+                        extracted = future.result()
+                    except Exception as e:
+                        summary["failed"] += 1
+                        write({"file": path, "status": "error", "stage": "extract", "error": str(e)})
+                        continue
+                    extract_latencies.append(extracted["extract_s"])
+                    summary["pages"] += extracted["pages"]
+                    analyzing[net_pool.submit(_analyze, extracted, metrics, recommendations)] = path
+                else:
+                    path = analyzing.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        summary["failed"] += 1
+                        write({"file": path, "status": "error", "stage": "analyze", "error": str(e)})
+                        continue
+                    if metrics_store is not None and record.get("metrics"):
+                        try:
+                            metrics_store.save_report(
+                                record["sha256"], patient_id, _report_date(path, report_date), record["metrics"],
+                                os.path.basename(path),
+                            )
+                        except sqlite3.Error as e:
+                            print(f"Storing metrics for {path} failed: {e}", file=sys.stderr)
+                    llm_latencies.append(record["llm_s"])
+                    total_latencies.append(time.perf_counter() - submitted_at.pop(path))
+                    summary["ok"] += 1
+                    write(record)
+            fill()
+
+    elapsed = time.perf_counter() - started
+    summary.update({
+        "elapsed_s": elapsed,
+        "files_per_s": summary["ok"] / elapsed if elapsed else 0.0,
+        "pages_per_s": summary["pages"] / elapsed if elapsed else 0.0,
+        "extract_p50_s": _percentile(extract_latencies, 0.5),
+        "extract_p95_s": _percentile(extract_latencies, 0.95),
+        "llm_p50_s": _percentile(llm_latencies, 0.5),
+        "llm_p95_s": _percentile(llm_latencies, 0.95),
+        "total_p50_s": _percentile(total_latencies, 0.5),
+        "total_p95_s": _percentile(total_latencies, 0.95),
+    })
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-process blood report PDFs into JSONL.")
+    parser.add_argument("inputs", nargs="+", help="Directories or glob patterns of PDF files")
+    parser.add_argument("--output", "-o", default="results.jsonl", help="JSONL output file (also the resume checkpoint)")
+    parser.add_argument("--cpu-workers", type=int, default=os.cpu_count() or 1, help="Processes for extraction/OCR")
+    parser.add_argument("--net-workers", type=int, default=4, help="Concurrent Groq requests")
+    parser.add_argument("--no-metrics", action="store_true", help="Skip the health metrics call")
+    parser.add_argument("--no-recommendations", action="store_true", help="Skip the recommendations call")
+    parser.add_argument("--no-resume", action="store_true", help="Overwrite --output instead of resuming")
+    parser.add_argument("--patient-id", help="Save every report's metrics to the metrics store under this patient")
+    parser.add_argument("--report-date", type=datetime.date.fromisoformat,
+                        help="Report date (YYYY-MM-DD) for --patient-id; default: each file's modification date")
+    args = parser.parse_args(argv)
+
+    paths = find_pdfs(args.inputs)
+    if not paths:
+        print("No PDF files found.", file=sys.stderr)
+        return 1
+
+    summary = run_batch(
+        paths, args.output, args.cpu_workers, args.net_workers,
+        metrics=not args.no_metrics, recommendations=not args.no_recommendations,
+        resume=not args.no_resume, patient_id=args.patient_id,
+        report_date=args.report_date.isoformat() if args.report_date else None,
+    )
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+    return 0 if summary["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Local stand-in for Groq's /openai/v1/chat/completions endpoint with tunable latency.
+
+    python -m benchmarks.mock_groq --port 8800 --ttft 0.3 --tokens-per-s 250
+    GROQ_API_URL=http://127.0.0.1:8800/openai/v1/chat/completions streamlit run app.py
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+
+_METRICS_REPLY = json.dumps({"metrics": [
+    {"name": "Hemoglobin", "value": 13.2, "unit": "g/dL", "normal_range": [13.0, 17.0]},
+    {"name": "Total Cholesterol", "value": 212, "unit": "mg/dL", "normal_range": [0, 200]},
+]}, indent=2)
+_ANALYSIS_REPLY = json.dumps({
+    "metrics": json.loads(_METRICS_REPLY)["metrics"],
+    "recommendations": "**Potential Health Concerns:**\n- Cholesterol is slightly above the reference range.\n\n"
+                       "**Diet and Lifestyle Recommendations:**\n- Increase fiber and exercise regularly.",
+}, indent=2)
+_RECOMMENDATIONS_WORDS = (
+    "**Potential Health Concerns:** Cholesterol is slightly above the reference range. "
+    "**Diet and Lifestyle Recommendations:** Increase fiber, reduce saturated fat and exercise regularly. "
+).split(" ")
+
+
+class MockGroqServer:
+    """
+    Threaded HTTP server that answers chat completions after `ttft` seconds and
+    then emits `completion_tokens` tokens at `tokens_per_s`. JSON-mode requests
+    (`response_format`) get a combined metrics + recommendations object, other
+    metrics prompts a metrics JSON body and the rest markdown; `stream: true`
+    is served as SSE.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ttft: float = 0.2,
+                 tokens_per_s: float = 250.0, completion_tokens: int = 200):
+        self.ttft = ttft
+        self.tokens_per_s = tokens_per_s
+        self.completion_tokens = completion_tokens
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{COMPLETIONS_PATH}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if self.path != COMPLETIONS_PATH:
+                    self.send_error(404)
+                    return
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                server.requests += 1
+                prompt = "".join(message.get("content", "") for message in payload.get("messages", []))
+                tokens = server._reply_tokens(prompt, payload)
+                usage = {
+                    "prompt_tokens": len(prompt) // 4,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": len(prompt) // 4 + len(tokens),
+                    "queue_time": 0.0,
+                    "prompt_time": 0.0,
+                    "completion_time": len(tokens) / server.tokens_per_s,
+                    "total_time": server.ttft + len(tokens) / server.tokens_per_s,
+                }
+                time.sleep(server.ttft)
+                if payload.get("stream"):
+                    self._stream(tokens, usage)
+                else:
+                    time.sleep(len(tokens) / server.tokens_per_s)
+                    body = json.dumps({
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}}],
+                        "usage": usage,
+                    }).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def _stream(self, tokens, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for token in tokens:
+                    chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(1 / server.tokens_per_s)
+                final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+
+        return Handler
+
+    def _reply_tokens(self, prompt: str, payload: dict) -> list:
+        limit = min(self.completion_tokens, payload.get("max_completion_tokens") or self.completion_tokens)
+        if payload.get("response_format", {}).get("type") == "json_object":
+            return [_ANALYSIS_REPLY[i:i + 4] for i in range(0, len(_ANALYSIS_REPLY), 4)]
+        if "JSON" in prompt:
+            # Roughly four characters per token
+            return [_METRICS_REPLY[i:i + 4] for i in range(0, len(_METRICS_REPLY), 4)]
+        return [_RECOMMENDATIONS_WORDS[i % len(_RECOMMENDATIONS_WORDS)] + " " for i in range(limit)]
+
+    def start(self) -> "MockGroqServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a mock Groq chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-s", type=float, default=250.0, help="Generation speed")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Tokens per markdown reply")
+    args = parser.parse_args(argv)
+    server = MockGroqServer(args.host, args.port, args.ttft, args.tokens_per_s, args.completion_tokens)
+    print(f"Mock Groq endpoint at {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Reproducible pipeline benchmark against synthetic reports and a local mock Groq server.
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --output new.json --compare bench.json
+
+Each case times extraction, OCR, validation, local metric parsing, the two LLM
+round trips, the single combined-mode round trip and JSON parsing separately and reports the median over --repeat runs.
+Run once with and once without --preprocess and compare the two files to weigh
+the OCR time saved by OpenCV preprocessing against the change in metric recall.
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.synth import make_report
+from benchmarks.mock_groq import MockGroqServer
+
+import agent
+import pdf_processor
+from pdf_processor import extract_pages
+from lab_extractor import extract_lab_metrics
+from report_compactor import compact_report
+
+KINDS = ["text", "scanned", "photo", "mixed", "hybrid"]
+PAGE_COUNTS = [1, 5, 20, 50]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def run_case(pdf_bytes: bytes, truth: list, ocr_workers: int) -> dict:
+    """Time every stage of one report once; all durations are in milliseconds."""
+    pages, total_extract_ms = _timed(extract_pages, io.BytesIO(pdf_bytes), ocr_workers)
+    text = "\n".join(page["text"] for page in pages)
+    rows = [row for page in pages for row in page["rows"]]
+
+    is_blood_report, validate_ms = _timed(agent.validate_blood_report, text)
+    (metrics, unparsed), local_parse_ms = _timed(extract_lab_metrics, rows)
+    compacted, compact_ms = _timed(compact_report, "\n".join(rows))
+
+    # Go straight to the client so the result cache never short-circuits a round trip
+    recommendations, recommendations_ms = _timed(agent.groq_client.chat, agent._recommendations_payload(text))
+    metrics_reply, metrics_llm_ms = _timed(agent.groq_client.chat, agent._health_metrics_payload(text))
+    _, json_parse_ms = _timed(agent._parse_metrics_json, metrics_reply["content"])
+    # Combined mode: one JSON-mode call standing in for the two above
+    analysis_reply, analysis_llm_ms = _timed(agent.groq_client.chat, agent._analysis_payload(text))
+    _, analysis_validate_ms = _timed(lambda content: agent.validate_analysis(json.loads(content)), analysis_reply["content"])
+
+    # Reports may repeat an analyte; like the app, score the first occurrence only
+    first_truth = {}
+    for metric in truth:
+        first_truth.setdefault(metric["name"], metric)
+    found = {(metric["name"], metric["value"]) for metric in metrics}
+    expected = {(metric["name"], metric["value"]) for metric in first_truth.values()}
+    return {
+        "pages": len(pages),
+        "ocr_pages": sum(page["ocr"] for page in pages),
+        "ocr_cached_pages": sum(page["ocr_cached"] for page in pages),
+        "ocr_pixels": sum(page["ocr_pixels"] for page in pages),
+        "peak_rss_mb": max(page["peak_rss_bytes"] for page in pages) / 2 ** 20,
+        "extract_total_ms": total_extract_ms,
+        "text_extract_ms": sum(page["extract_ms"] for page in pages),
+        "ocr_render_ms": sum(page["render_ms"] for page in pages),
+        "ocr_preprocess_ms": sum(page["preprocess_ms"] for page in pages),
+        "ocr_ms": sum(page["ocr_ms"] for page in pages),
+        "ocr_ms_per_page": (
+            sum(page["preprocess_ms"] + page["ocr_ms"] for page in pages if page["ocr"] and not page["ocr_cached"])
+            / max(sum(page["ocr"] and not page["ocr_cached"] for page in pages), 1)
+        ),
+        "validate_ms": validate_ms,
+        "local_parse_ms": local_parse_ms,
+        "compact_ms": compact_ms,
+        "prompt_tokens_saved": compacted["tokens_saved"],
+        "llm_recommendations_ms": recommendations_ms,
+        "llm_metrics_ms": metrics_llm_ms,
+        "json_parse_ms": json_parse_ms,
+        "prompt_tokens": recommendations["usage"]["prompt_tokens"] + metrics_reply["usage"]["prompt_tokens"],
+        "llm_combined_ms": analysis_llm_ms,
+        "analysis_validate_ms": analysis_validate_ms,
+        "combined_prompt_tokens": analysis_reply["usage"]["prompt_tokens"],
+        "is_blood_report": is_blood_report,
+        "local_metric_recall": len(found & expected) / len(expected) if expected else 1.0,
+        "unparsed_rows": len(unparsed),
+    }
+
+
+def _median_case(runs: list) -> dict:
+    summary = {}
+    for key, value in runs[0].items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            summary[key] = value
+        else:
+            summary[key] = statistics.median(run[key] for run in runs)
+    return summary
+
+
+def run_suite(kinds: list, page_counts: list, repeat: int, ocr_workers: int, server: MockGroqServer) -> dict:
+    agent.groq_client.url = server.url
+    cases = []
+    for kind in kinds:
+        for page_count in page_counts:
+            pdf_bytes, truth = make_report(page_count, kind, seed=page_count)
+            runs = [run_case(pdf_bytes, truth, ocr_workers) for _ in range(repeat)]
+            case = {"kind": kind, "pages_requested": page_count, "pdf_bytes": len(pdf_bytes)}
+            case.update(_median_case(runs))
+            cases.append(case)
+            print(f"{kind:>8} {page_count:>3}p  extract {case['extract_total_ms']:9.1f} ms  "
+                  f"ocr {case['ocr_ms']:9.1f} ms  llm {case['llm_recommendations_ms'] + case['llm_metrics_ms']:8.1f} ms",
+                  file=sys.stderr)
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "repeat": repeat,
+            "ocr_workers": ocr_workers,
+            "ocr_cache": pdf_processor.ocr_cache is not None,
+            "ocr_preprocess": pdf_processor.OCR_PREPROCESS,
+            "mock_ttft_s": server.ttft,
+            "mock_tokens_per_s": server.tokens_per_s,
+        },
+        "cases": cases,
+    }
+
+
+def compare(current: dict, baseline: dict):
+    """Print per-case ratios current/baseline for the headline timings."""
+    keys = ["extract_total_ms", "ocr_ms_per_page", "local_metric_recall", "ocr_pixels", "peak_rss_mb", "validate_ms", "local_parse_ms", "llm_metrics_ms", "json_parse_ms"]
+    previous = {(case["kind"], case["pages_requested"]): case for case in baseline["cases"]}
+    print(f"{'case':>14} " + " ".join(f"{key:>18}" for key in keys))
+    for case in current["cases"]:
+        old = previous.get((case["kind"], case["pages_requested"]))
+        if old is None:
+            continue
+        ratios = [case[key] / old[key] if old.get(key) else float("nan") for key in keys]
+        print(f"{case['kind']:>8} {case['pages_requested']:>3}p " + " ".join(f"{ratio:>17.2f}x" for ratio in ratios))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the report pipeline.")
+    parser.add_argument("--kinds", nargs="+", default=KINDS, choices=KINDS)
+    parser.add_argument("--pages", nargs="+", type=int, default=PAGE_COUNTS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--ocr-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--ttft", type=float, default=0.2, help="Mock Groq seconds before first token")
+    parser.add_argument("--tokens-per-s", type=float, default=250.0, help="Mock Groq generation speed")
+    parser.add_argument("--preprocess", action="store_true",
+                        help="Clean up pages with OpenCV before OCR (MEDISCAN_OCR_PREPROCESS)")
+    parser.add_argument("--ocr-cache", action="store_true",
+                        help="Keep the OCR page cache on (off by default so repeats measure real OCR)")
+    parser.add_argument("--output", "-o", help="Write results JSON here (default stdout)")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    args = parser.parse_args(argv)
+    if not args.ocr_cache:
+        pdf_processor.ocr_cache = None
+    pdf_processor.OCR_PREPROCESS = args.preprocess
+
+    server = MockGroqServer(ttft=args.ttft, tokens_per_s=args.tokens_per_s).start()
+    try:
+        results = run_suite(args.kinds, args.pages, args.repeat, args.ocr_workers, server)
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Synthetic blood report PDFs: born-digital, rasterized ("scanned"), photographed, mixed and hybrid documents."""
+import io
+import random
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageChops
+
+from lab_extractor import ANALYTES
+
+LETTERHEAD = [
+    "CITY DIAGNOSTIC LABORATORIES",
+    "12 Hospital Road, Sector 5, Springfield - 400001 | Tel 022-5550199",
+    "NABL Accredited Laboratory",
+]
+DISCLAIMER = (
+    "This report is for the use of the referring physician only. Results relate only to the "
+    "sample tested. Page {page} of {pages}"
+)
+ROWS_PER_PAGE = 24
+TABLE_RECT = fitz.Rect(40, 112, 555, 780)  # Column headers and result rows drawn by _draw_text_page
+
+
+def _page_rows(rng: random.Random, count: int) -> list:
+    """Random analyte rows with values around each analyte's reference range."""
+    rows = []
+    names = list(ANALYTES)
+    for _ in range(count):
+        name = rng.choice(names)
+        low, high = ANALYTES[name]["range"]
+        span = (high - low) or 1.0
+        value = round(max(0.0, rng.uniform(low - 0.2 * span, high + 0.2 * span)), 1)
+        rows.append({
+            "name": name,
+            "value": value,
+            "unit": ANALYTES[name]["unit"],
+            "normal_range": [low, high],
+        })
+    return rows
+
+
+def _draw_text_page(doc: fitz.Document, rows: list, page_num: int, page_count: int):
+    page = doc.new_page(width=595, height=842)  # A4
+    y = 50
+    for line in LETTERHEAD:
+        page.insert_text((50, y), line, fontsize=12 if y == 50 else 8)
+        y += 14
+    y += 10
+    page.insert_text((50, y), "Patient: Jane Doe   Age: 42 Y   Sex: F   Date: 01-02-2024", fontsize=9)
+    y += 24
+    for x, header in [(50, "Test"), (250, "Result"), (330, "Unit"), (430, "Reference Range")]:
+        page.insert_text((x, y), header, fontsize=10)
+    y += 18
+    for row in rows:
+        low, high = row["normal_range"]
+        for x, cell in [(50, row["name"]), (250, f"{row['value']}"), (330, row["unit"]), (430, f"{low} - {high}")]:
+            page.insert_text((x, y), cell, fontsize=10)
+        y += 24
+    page.insert_textbox(fitz.Rect(50, 790, 545, 830), DISCLAIMER.format(page=page_num + 1, pages=page_count), fontsize=7)
+
+
+def _rasterize_last_page(doc: fitz.Document, dpi: int):
+    """Replace the last page with a bitmap of itself, like a scanner would produce."""
+    page = doc[-1]
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    rect = page.rect
+    doc.delete_page(-1)
+    scanned = doc.new_page(width=rect.width, height=rect.height)
+    scanned.insert_image(scanned.rect, pixmap=pix)
+
+
+def _rasterize_table(doc: fitz.Document, dpi: int):
+    """Replace the results table of the last page with a bitmap, keeping the typed letterhead and footer."""
+    page = doc[-1]
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, clip=TABLE_RECT)
+    page.add_redact_annot(TABLE_RECT)
+    page.apply_redactions()
+    page.insert_image(TABLE_RECT, pixmap=pix)
+
+
+def _photograph_last_page(doc: fitz.Document, dpi: int, rng: random.Random):
+    """Replace the last page with a skewed, noisy capture on a dark background, like a phone photo."""
+    page = doc[-1]
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    img = img.rotate(rng.uniform(-4, 4), resample=Image.BILINEAR, expand=True, fillcolor=40)
+    img = ImageChops.add(img, Image.effect_noise(img.size, 18), offset=-128)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    rect = page.rect
+    doc.delete_page(-1)
+    photo = doc.new_page(width=rect.width, height=rect.height)
+    photo.insert_image(photo.rect, stream=buffer.getvalue())
+
+
+def make_report(pages: int, kind: str = "text", seed: int = 0, scan_dpi: int = 200) -> tuple:
+    """
+    Build a synthetic blood report and return `(pdf_bytes, metrics)`.
+
+    `kind` is "text" (born-digital), "scanned" (every page rasterized),
+    "photo" (every page a skewed, noisy photo), "mixed" (every other page
+    rasterized) or "hybrid" (typed letterhead with a scanned results table on
+    every other page). `metrics` is the ground truth in the
+    `{"metrics": [...]}` item schema.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    truth = []
+    for page_num in range(pages):
+        rows = _page_rows(rng, ROWS_PER_PAGE)
+        truth.extend(rows)
+        _draw_text_page(doc, rows, page_num, pages)
+        if kind == "scanned" or (kind == "mixed" and page_num % 2 == 1):
+            _rasterize_last_page(doc, scan_dpi)
+        elif kind == "photo":
+            _photograph_last_page(doc, scan_dpi, rng)
+        elif kind == "hybrid" and page_num % 2 == 1:
+            _rasterize_table(doc, scan_dpi)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data, truth
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx  # Optional, only needed by AsyncGroqClient
+except ImportError:
+    httpx = None
+
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "3"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+POOL_SIZE = 16
+
+# Rate limiting and transient server errors are worth retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GroqAPIError(Exception):
+    """Raised when the Groq API answers with a non-200 status after all retries."""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"API call failed with status code {status_code}. Response: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+def parse_usage(result: dict) -> dict:
+    """
+    Normalize the `usage` block of a completion (or the `x_groq.usage` block of a
+    final stream chunk) into token counts and Groq's queue/processing times.
+    """
+    usage = result.get("usage") or result.get("x_groq", {}).get("usage") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": usage.get("completion_tokens", 0) or 0,
+        "total_tokens": usage.get("total_tokens", 0) or 0,
+        "queue_time": usage.get("queue_time", 0.0) or 0.0,
+        "prompt_time": usage.get("prompt_time", 0.0) or 0.0,
+        "completion_time": usage.get("completion_time", 0.0) or 0.0,
+        "total_time": usage.get("total_time", 0.0) or 0.0,
+    }
+
+
+def _retry_delay(attempt: int, retry_after: str = None) -> float:
+    """
+    Seconds to wait before retry `attempt`: Retry-After (seconds or an HTTP
+    date) plus a little jitter when given, else full-jitter backoff. Never more
+    than BACKOFF_MAX, so a server asking for minutes cannot stall the caller.
+    """
+    jitter = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return jitter
+        return min(BACKOFF_MAX, max(0.0, delay) + jitter / 10)
+    return jitter
+
+
+def _completion_content(result: dict, default: str = None) -> str:
+    choices = result.get("choices") or [{}]
+    return (choices[0].get("message") or {}).get("content", default)
+
+
+class GroqClient:
+    """
+    Synchronous Groq chat completions client shared by the agent functions.
+
+    Owns a pooled keep-alive session, applies connect/read timeouts and retries
+    429/5xx responses and connection errors with jittered backoff.
+    """
+
+    def __init__(self, api_key: str = None, url: str = GROQ_API_URL,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 max_retries: int = MAX_RETRIES, pool_size: int = POOL_SIZE):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key if api_key is not None else os.getenv('GROQ_API_KEY')}",
+            "Content-Type": "application/json"
+        })
+
+    def _post(self, payload: dict, stream: bool = False) -> requests.Response:
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(_retry_delay(attempt))
+                attempt += 1
+                continue
+            if response.status_code == 200:
+                return response
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = _retry_delay(attempt, response.headers.get("Retry-After"))
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            raise GroqAPIError(response.status_code, response.text)
+
+    def chat(self, payload: dict) -> dict:
+        """
+        Send a chat completion request and return a dict with the message
+        `content`, the parsed `usage`, the `raw` response body and `elapsed` seconds.
+        """
+        started = time.perf_counter()
+        result = self._post(payload).json()
+        return {
+            "content": _completion_content(result),
+            "usage": parse_usage(result),
+            "raw": result,
+            "elapsed": time.perf_counter() - started,
+        }
+
+    def stream_chat(self, payload: dict):
+        """Send a streaming chat completion request and yield each decoded SSE chunk."""
+        with self._post(dict(payload, stream=True), stream=True) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                yield json.loads(data)
+
+
+class AsyncGroqClient:
+    """asyncio counterpart of GroqClient built on a pooled httpx.AsyncClient."""
+
+    def __init__(self, api_key: str = None, url: str = GROQ_API_URL,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 max_retries: int = MAX_RETRIES, pool_size: int = POOL_SIZE):
+        if httpx is None:
+            raise ImportError("AsyncGroqClient requires httpx (pip install httpx)")
+        self.url = url
+        self.max_retries = max_retries
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={
+                "Authorization": f"Bearer {api_key if api_key is not None else os.getenv('GROQ_API_KEY')}",
+                "Content-Type": "application/json"
+            },
+        )
+
+    async def chat(self, payload: dict) -> dict:
+        """Async version of GroqClient.chat with the same retry policy and result layout."""
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.post(self.url, json=payload)
+            except (httpx.ConnectError, httpx.TimeoutException):
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(_retry_delay(attempt))
+                attempt += 1
+                continue
+            if response.status_code == 200:
+                break
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                await asyncio.sleep(_retry_delay(attempt, response.headers.get("Retry-After")))
+                attempt += 1
+                continue
+            raise GroqAPIError(response.status_code, response.text)
+        result = response.json()
+        return {
+            "content": _completion_content(result),
+            "usage": parse_usage(result),
+            "raw": result,
+            "elapsed": time.perf_counter() - started,
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,246 @@
+import re
+
+# Curated analyte dictionary: canonical name -> synonyms as printed by labs, the
+# usual reporting unit and a typical adult reference range. Unit and range are
+# for reference only: labs differ in both, so parsed rows must print their own.
+ANALYTES = {
+    "Hemoglobin": {"synonyms": ["hemoglobin", "haemoglobin", "hb", "hgb"], "unit": "g/dL", "range": [12.0, 17.0]},
+    "RBC Count": {"synonyms": ["rbc count", "rbc", "red blood cell count", "red blood cells", "total rbc count", "erythrocyte count"], "unit": "million/µL", "range": [4.0, 6.0]},
+    "WBC Count": {"synonyms": ["wbc count", "wbc", "total wbc count", "total leucocyte count", "total leukocyte count", "tlc", "white blood cell count", "white blood cells"], "unit": "cells/µL", "range": [4000, 11000]},
+    "Platelet Count": {"synonyms": ["platelet count", "platelets", "plt"], "unit": "lakhs/µL", "range": [1.5, 4.5]},
+    "Hematocrit": {"synonyms": ["hematocrit", "haematocrit", "hct", "pcv", "packed cell volume"], "unit": "%", "range": [36.0, 50.0]},
+    "MCV": {"synonyms": ["mcv", "mean corpuscular volume", "mean cell volume"], "unit": "fL", "range": [80.0, 100.0]},
+    "MCH": {"synonyms": ["mch", "mean corpuscular hemoglobin", "mean cell hemoglobin"], "unit": "pg", "range": [27.0, 33.0]},
+    "MCHC": {"synonyms": ["mchc", "mean corpuscular hemoglobin concentration"], "unit": "g/dL", "range": [32.0, 36.0]},
+    "RDW": {"synonyms": ["rdw", "rdw-cv", "red cell distribution width"], "unit": "%", "range": [11.5, 14.5]},
+    "Neutrophils": {"synonyms": ["neutrophils", "neutrophil", "polymorphs"], "unit": "%", "range": [40.0, 75.0]},
+    "Lymphocytes": {"synonyms": ["lymphocytes", "lymphocyte"], "unit": "%", "range": [20.0, 45.0]},
+    "Monocytes": {"synonyms": ["monocytes", "monocyte"], "unit": "%", "range": [2.0, 10.0]},
+    "Eosinophils": {"synonyms": ["eosinophils", "eosinophil"], "unit": "%", "range": [1.0, 6.0]},
+    "Basophils": {"synonyms": ["basophils", "basophil"], "unit": "%", "range": [0.0, 2.0]},
+    "ESR": {"synonyms": ["esr", "erythrocyte sedimentation rate"], "unit": "mm/hr", "range": [0.0, 20.0]},
+    "Fasting Glucose": {"synonyms": ["fasting blood sugar", "fasting glucose", "fasting plasma glucose", "fbs", "glucose fasting", "blood sugar fasting"], "unit": "mg/dL", "range": [70.0, 100.0]},
+    "Postprandial Glucose": {"synonyms": ["post prandial blood sugar", "postprandial glucose", "ppbs", "glucose pp", "blood sugar pp"], "unit": "mg/dL", "range": [70.0, 140.0]},
+    "Random Glucose": {"synonyms": ["random blood sugar", "random glucose", "rbs", "glucose random"], "unit": "mg/dL", "range": [70.0, 140.0]},
+    "HbA1c": {"synonyms": ["hba1c", "glycated hemoglobin", "glycosylated hemoglobin"], "unit": "%", "range": [4.0, 5.6]},
+    "Total Cholesterol": {"synonyms": ["total cholesterol", "cholesterol total", "serum cholesterol", "cholesterol"], "unit": "mg/dL", "range": [0.0, 200.0]},
+    "HDL Cholesterol": {"synonyms": ["hdl cholesterol", "hdl-c", "hdl"], "unit": "mg/dL", "range": [40.0, 60.0]},
+    "LDL Cholesterol": {"synonyms": ["ldl cholesterol", "ldl-c", "ldl"], "unit": "mg/dL", "range": [0.0, 100.0]},
+    "VLDL Cholesterol": {"synonyms": ["vldl cholesterol", "vldl"], "unit": "mg/dL", "range": [5.0, 40.0]},
+    "Triglycerides": {"synonyms": ["triglycerides", "triglyceride", "tg"], "unit": "mg/dL", "range": [0.0, 150.0]},
+    "Urea": {"synonyms": ["blood urea", "serum urea", "urea"], "unit": "mg/dL", "range": [15.0, 40.0]},
+    "BUN": {"synonyms": ["blood urea nitrogen", "bun"], "unit": "mg/dL", "range": [7.0, 20.0]},
+    "Creatinine": {"synonyms": ["serum creatinine", "creatinine"], "unit": "mg/dL", "range": [0.6, 1.3]},
+    "Uric Acid": {"synonyms": ["serum uric acid", "uric acid"], "unit": "mg/dL", "range": [3.5, 7.2]},
+    "Sodium": {"synonyms": ["serum sodium", "sodium", "na+"], "unit": "mEq/L", "range": [135.0, 145.0]},
+    "Potassium": {"synonyms": ["serum potassium", "potassium", "k+"], "unit": "mEq/L", "range": [3.5, 5.1]},
+    "Chloride": {"synonyms": ["serum chloride", "chloride", "cl-"], "unit": "mEq/L", "range": [98.0, 107.0]},
+    "Calcium": {"synonyms": ["serum calcium", "calcium"], "unit": "mg/dL", "range": [8.5, 10.5]},
+    "Total Bilirubin": {"synonyms": ["total bilirubin", "bilirubin total", "serum bilirubin", "bilirubin"], "unit": "mg/dL", "range": [0.2, 1.2]},
+    "Direct Bilirubin": {"synonyms": ["direct bilirubin", "bilirubin direct", "conjugated bilirubin"], "unit": "mg/dL", "range": [0.0, 0.3]},
+    "Indirect Bilirubin": {"synonyms": ["indirect bilirubin", "bilirubin indirect", "unconjugated bilirubin"], "unit": "mg/dL", "range": [0.2, 0.9]},
+    "SGOT (AST)": {"synonyms": ["sgot", "ast", "aspartate aminotransferase", "sgot/ast", "ast/sgot"], "unit": "U/L", "range": [5.0, 40.0]},
+    "SGPT (ALT)": {"synonyms": ["sgpt", "alt", "alanine aminotransferase", "sgpt/alt", "alt/sgpt"], "unit": "U/L", "range": [7.0, 56.0]},
+    "Alkaline Phosphatase": {"synonyms": ["alkaline phosphatase", "alp"], "unit": "U/L", "range": [44.0, 147.0]},
+    "GGT": {"synonyms": ["gamma glutamyl transferase", "gamma gt", "ggt"], "unit": "U/L", "range": [9.0, 48.0]},
+    "Total Protein": {"synonyms": ["total protein", "serum protein", "protein total"], "unit": "g/dL", "range": [6.0, 8.3]},
+    "Albumin": {"synonyms": ["serum albumin", "albumin"], "unit": "g/dL", "range": [3.5, 5.5]},
+    "Globulin": {"synonyms": ["globulin"], "unit": "g/dL", "range": [2.0, 3.5]},
+    "TSH": {"synonyms": ["tsh", "thyroid stimulating hormone"], "unit": "µIU/mL", "range": [0.4, 4.0]},
+    "T3": {"synonyms": ["total t3", "t3"], "unit": "ng/dL", "range": [80.0, 200.0]},
+    "T4": {"synonyms": ["total t4", "t4"], "unit": "µg/dL", "range": [5.0, 12.0]},
+    "Vitamin D": {"synonyms": ["vitamin d", "25-oh vitamin d", "25 hydroxy vitamin d"], "unit": "ng/mL", "range": [30.0, 100.0]},
+    "Vitamin B12": {"synonyms": ["vitamin b12", "cobalamin"], "unit": "pg/mL", "range": [200.0, 900.0]},
+    "Iron": {"synonyms": ["serum iron", "iron"], "unit": "µg/dL", "range": [60.0, 170.0]},
+    "Ferritin": {"synonyms": ["serum ferritin", "ferritin"], "unit": "ng/mL", "range": [20.0, 250.0]},
+    "CRP": {"synonyms": ["c-reactive protein", "c reactive protein", "crp"], "unit": "mg/L", "range": [0.0, 6.0]},
+}
+
+_SYNONYM_TO_ANALYTE = {
+    synonym: name for name, info in ANALYTES.items() for synonym in info["synonyms"]
+}
+_CANONICAL_NAMES = {name.lower(): name for name in ANALYTES}
+
+# Longest synonyms first so "mchc" wins over "mch" and "hdl cholesterol" over "cholesterol"
+_ANALYTE_RE = re.compile(
+    r"(?<![\w])(" + "|".join(
+        re.escape(synonym) for synonym in sorted(_SYNONYM_TO_ANALYTE, key=len, reverse=True)
+    ) + r")(?![\w])",
+    re.IGNORECASE,
+)
+_NUMBER = r"\d+(?:,\d{3})*(?:\.\d+)?"
+_NUMBER_RE = re.compile(_NUMBER)
+_RANGE_RE = re.compile(rf"({_NUMBER})\s*(?:-|–|—|to)\s*({_NUMBER})")
+_BOUND_RE = re.compile(rf"(?:<|>|≤|≥|upto|up to|less than|more than)\s*({_NUMBER})", re.IGNORECASE)
+_GENERIC_NAME_RE = re.compile(r"^\s*([A-Za-z][A-Za-z0-9 .,()/+\-]{2,40}?)\s*[:\-]?\s+(?=[<>]?\d)")
+_UNIT_RE = re.compile(r"^(?:[a-zA-Zµμ%][\w/µμ%^.\-]*|10\^\d+/\S+|x\s?10\^?\d+/\S+)$")
+_FLAG_RE = re.compile(r"^(?:h|l|high|low|\*|↑|↓|\(h\)|\(l\))$", re.IGNORECASE)
+
+# Rows starting with these are headers, demographics or metadata, never analytes
+_NON_ANALYTE_PREFIXES = (
+    "age", "date", "page", "phone", "tel", "mob", "ref", "sample", "patient", "reg",
+    "collected", "received", "reported", "printed", "lab", "id", "uhid", "pin", "dob",
+)
+
+
+def _to_float(number: str) -> float:
+    return float(number.replace(",", ""))
+
+
+def _find_analyte(row: str):
+    """The first analyte named in `row` as `(canonical name, start offset, end offset)`, or None."""
+    analyte_match = _ANALYTE_RE.search(row)
+    if analyte_match is None:
+        return None
+    return _SYNONYM_TO_ANALYTE[analyte_match.group(1).lower()], analyte_match.start(), analyte_match.end()
+
+
+def canonical_analyte(name: str) -> str:
+    """The ANALYTES name for a metric name printed as any known synonym ("Haemoglobin" -> "Hemoglobin"), else the name itself."""
+    name = " ".join(name.split())
+    return _CANONICAL_NAMES.get(name.lower()) or _SYNONYM_TO_ANALYTE.get(name.lower(), name)
+
+
+def _parse_row(row: str, mention=None):
+    """
+    Parse one report row into a metric dict, or None if the row does not fit the layout.
+    `mention` is the row's first analyte as found by _find_analyte (None for rows naming no known analyte).
+    Rows without a printed range or a recognizable unit are left to the LLM.
+    """
+    # A qualifier before the analyte ("Absolute Neutrophil Count") makes it a different test
+    if mention is not None and not any(ch.isalpha() for ch in row[:mention[1]]):
+        name, _, end = mention
+        rest = row[end:]
+    else:
+        generic = _GENERIC_NAME_RE.match(row)
+        if not generic or generic.group(1).lower().startswith(_NON_ANALYTE_PREFIXES):
+            return None
+        name = generic.group(1).strip(" .:-")
+        rest = row[generic.end():]
+
+    range_match = _RANGE_RE.search(rest)
+    if not range_match:
+        # No printed range, or a one-sided limit ("< 200") that does not fit the [min, max] schema
+        return None
+    normal_range = [_to_float(range_match.group(1)), _to_float(range_match.group(2))]
+    rest_without_range = rest[:range_match.start()] + " " + rest[range_match.end():]
+
+    value_match = _NUMBER_RE.search(rest_without_range)
+    if not value_match:
+        return None
+    value = _to_float(value_match.group(0))
+
+    unit = None
+    for token in rest_without_range[value_match.end():].split():
+        if _FLAG_RE.match(token):
+            continue
+        if _UNIT_RE.match(token):
+            unit = token
+        break
+
+    if unit is None or normal_range[0] > normal_range[1]:
+        return None
+
+    return {"name": name, "value": value, "unit": unit, "normal_range": normal_range}
+
+
+def is_lab_row(row: str) -> bool:
+    """True for rows that mention an analyte or a reference range next to a value."""
+    if not any(ch.isdigit() for ch in row):
+        return False
+    return bool(_ANALYTE_RE.search(row)) or is_generic_lab_row(row)
+
+
+def is_generic_lab_row(row: str) -> bool:
+    """True for rows naming no known analyte that still read "name value ... range"."""
+    generic = _GENERIC_NAME_RE.match(row)
+    return bool(generic) and not generic.group(1).lower().startswith(_NON_ANALYTE_PREFIXES) and bool(
+        _RANGE_RE.search(row) or _BOUND_RE.search(row)
+    )
+
+
+def _scanned_rows(rows: list):
+    """Yield `(row, mention)` for the rows that look like lab results, normalized, with their first analyte."""
+    for row in rows:
+        row = " ".join(row.split())
+        if not any(ch.isdigit() for ch in row):
+            continue
+        mention = _find_analyte(row)
+        if mention is not None or is_generic_lab_row(row):
+            yield row, mention
+
+
+def _indexed_rows(index):
+    """Yield `(row, mention)` for the lab rows of a ReportIndex, using the analyte mentions it already found."""
+    for line_number, line in enumerate(index.lines):
+        if not index.is_lab_line(line_number):
+            continue
+        mention = index.first_mention(line_number)
+        if mention is not None:
+            # Offsets refer to the raw line; the parser does not mind extra whitespace
+            line_start = index.line_starts[line_number]
+            yield line, (mention["analyte"], mention["start"] - line_start, mention["end"] - line_start)
+        else:
+            yield " ".join(line.split()), None
+
+
+def extract_lab_metrics(rows: list, index=None) -> tuple:
+    """
+    Parse report rows ("Hemoglobin 13.2 g/dL 13.0-17.0") into metrics without calling the LLM.
+
+    Returns `(metrics, unparsed_rows)`: metrics follow the `{"metrics": [...]}`
+    item schema used by the Health Metrics tab, and `unparsed_rows` are rows
+    that look like lab results but did not fit, for the LLM to handle.
+    Pass the ReportIndex of `"\n".join(rows)` as `index` to reuse its analyte
+    mentions instead of scanning every row again.
+    """
+    metrics = []
+    unparsed = []
+    seen = set()
+    for row, mention in _indexed_rows(index) if index is not None else _scanned_rows(rows):
+        metric = _parse_row(row, mention)
+        if metric is None:
+            unparsed.append(" ".join(row.split()))
+        elif metric["name"].lower() not in seen:
+            seen.add(metric["name"].lower())
+            metrics.append(metric)
+    return metrics, unparsed
+
+
+def positioned_rows(page, y_tolerance: float = None, exclude: list = ()) -> list:
+    """
+    Like rows_from_page, but return `(y_center, x0, text)` tuples so rows can be
+    merged with text from elsewhere. Words centered inside any of the `exclude`
+    rectangles (x0, y0, x1, y1) are left out.
+    """
+    words = [
+        w for w in page.get_text("words")
+        if not any(r[0] <= (w[0] + w[2]) / 2 <= r[2] and r[1] <= (w[1] + w[3]) / 2 <= r[3] for r in exclude)
+    ]
+    if not words:
+        return []
+    heights = sorted(w[3] - w[1] for w in words)
+    tolerance = y_tolerance if y_tolerance is not None else max(heights[len(heights) // 2] * 0.5, 1.0)
+
+    rows = []
+    for word in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        center = (word[1] + word[3]) / 2
+        if rows and abs(center - rows[-1]["center"]) <= tolerance:
+            rows[-1]["words"].append(word)
+        else:
+            rows.append({"center": center, "words": [word]})
+    result = []
+    for row in rows:
+        row_words = sorted(row["words"], key=lambda w: w[0])
+        result.append((row["center"], row_words[0][0], " ".join(w[4] for w in row_words)))
+    return result
+
+
+def rows_from_page(page, y_tolerance: float = None) -> list:
+    """
+    Rebuild visual table rows from PyMuPDF word coordinates.
+
+    `page.get_text("text")` often emits each table cell on its own line; grouping
+    words whose vertical centers line up restores "name value unit range" rows.
+    """
+    return [text for _, _, text in positioned_rows(page, y_tolerance)]
@@ -0,0 +1,167 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import telemetry
+from stream_buffer import StreamBuffer
+
+# Groq quotas for the account; 0 turns that limit off
+GROQ_RPM = int(os.getenv("MEDISCAN_GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("MEDISCAN_GROQ_TPM", "12000"))
+
+# Lower values are admitted first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+_priority = contextvars.ContextVar("mediscan_llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level: int):
+    """Run the LLM calls made inside this block, on this thread, at `level` (INTERACTIVE or BATCH)."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Refills at `per_minute` units per minute and holds at most one minute's
+    worth. Not thread-safe on its own; LLMScheduler guards it with its lock.
+    """
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available; an amount over capacity only needs a full bucket."""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) * 60 / self.per_minute)
+
+    def adjust(self, amount: float):
+        """Take (negative `amount`) or give back units; the level may go below zero."""
+        if self.per_minute:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class LLMScheduler:
+    """
+    Process-wide admission control for Groq calls, shared by every session,
+    pipeline thread and batch worker.
+
+    Identical requests in flight at the same time are coalesced: the first
+    caller (the leader) makes the call and the others replay its chunks.
+    Calls are admitted against requests-per-minute and tokens-per-minute
+    buckets, strictly in priority order, so queued interactive calls always
+    go ahead of batch calls.
+    """
+
+    def __init__(self, rpm: int = GROQ_RPM, tpm: int = GROQ_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._condition = threading.Condition()
+        self._waiting = []   # Heap of (priority, sequence) for callers waiting to be admitted
+        self._sequence = itertools.count()
+        self._flights = {}
+        self._stats = {"admitted": {name: 0 for name in PRIORITY_NAMES.values()}, "coalesced": 0, "wait_seconds": 0.0}
+
+    @contextmanager
+    def single_flight(self, key: str):
+        """
+        Yield `(buffer, leader)`. The leader must append the call's chunks to
+        `buffer`; other callers with the same key read them from it, errors included.
+        """
+        with self._condition:
+            buffer = self._flights.get(key)
+            leader = buffer is None
+            if leader:
+                buffer = self._flights[key] = StreamBuffer()
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            telemetry.inc("mediscan_llm_coalesced_total")
+            yield buffer, False
+            return
+
+        error = None
+        try:
+            yield buffer, True
+        except BaseException as e:
+            # A consumer dropping a stream is not an error the followers can handle
+            error = e if isinstance(e, Exception) else RuntimeError("coalesced call was abandoned")
+            raise
+        finally:
+            with self._condition:
+                self._flights.pop(key, None)
+            buffer.finish(error)
+
+    @contextmanager
+    def admitted(self, tokens: int):
+        """
+        Block until the call may go out under the rate limits and the current
+        priority (see `priority`), charging `tokens` up front. Yields a dict;
+        set its "total_tokens" to the call's actual usage to settle the difference.
+        """
+        level = _priority.get()
+        entry = (level, next(self._sequence))
+        started = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    if self._waiting[0] != entry:
+                        self._condition.wait()
+                        continue
+                    now = time.monotonic()
+                    delay = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+            self.requests.adjust(-1)
+            self.tokens.adjust(-tokens)
+            waited = time.monotonic() - started
+            self._stats["admitted"][PRIORITY_NAMES.get(level, str(level))] += 1
+            self._stats["wait_seconds"] += waited
+        telemetry.observe("mediscan_llm_admission_wait_seconds", waited, priority=PRIORITY_NAMES.get(level, level))
+
+        usage = {"total_tokens": tokens, "wait_seconds": waited}
+        try:
+            yield usage
+        finally:
+            # Failed calls keep the full reservation
+            with self._condition:
+                self.tokens.adjust(tokens - usage["total_tokens"])
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            now = time.monotonic()
+            return {
+                "admitted": dict(self._stats["admitted"]),
+                "coalesced": self._stats["coalesced"],
+                "wait_seconds": self._stats["wait_seconds"],
+                "waiting": len(self._waiting),
+                "in_flight": len(self._flights),
+                "request_wait_s": self.requests.wait_time(1, now),
+                "tokens_available": self.tokens.level if self.tokens.per_minute else None,
+            }
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# How far outside the normal range (in range widths) a marker is drawn before it is pinned to the edge
+RANGE_OVERSHOOT = 1.0
+
+STATUS_COLORS = {"Below normal": "red", "Normal": "green", "Above normal": "red", "No range": "gray"}
+
+
+def metrics_frame(metrics: list) -> pd.DataFrame:
+    """
+    Tabulate metric dicts and compute every metric's status and its position
+    within the normal range in one vectorized pass.
+
+    `position` is 0 at the lower bound and 1 at the upper bound of the normal
+    range; metrics without a usable range get status "No range".
+    """
+    frame = pd.DataFrame(
+        {
+            "name": [metric.get("name", "Unknown") for metric in metrics],
+            "value": [metric.get("value", 0) for metric in metrics],
+            "unit": [metric.get("unit", "") for metric in metrics],
+        }
+    )
+    ranges = np.array([metric.get("normal_range", [0, 0]) for metric in metrics], dtype=float).reshape(-1, 2)
+    frame["low"] = ranges[:, 0]
+    frame["high"] = ranges[:, 1]
+
+    value = frame["value"].to_numpy(dtype=float)
+    low = frame["low"].to_numpy()
+    high = frame["high"].to_numpy()
+    width = high - low
+    has_range = width > 0
+    frame["position"] = np.where(has_range, (value - low) / np.where(has_range, width, 1), np.nan)
+    frame["status"] = np.select(
+        [~has_range, value < low, value > high],
+        ["No range", "Below normal", "Above normal"],
+        default="Normal",
+    )
+    return frame
+
+
+def range_chart(frame: pd.DataFrame) -> go.Figure:
+    """
+    One figure for all metrics: each metric is a row, the shaded band is its
+    normal range scaled to 0-1, and the marker shows where the value falls.
+    """
+    position = frame["position"].fillna(0.5).clip(-RANGE_OVERSHOOT, 1 + RANGE_OVERSHOOT)
+    labels = frame["name"] + " (" + frame["unit"] + ")"
+    hover = (
+        frame["name"] + ": " + frame["value"].astype(str) + " " + frame["unit"]
+        + "<br>Normal range: " + frame["low"].astype(str) + " - " + frame["high"].astype(str)
+        + "<br>" + frame["status"]
+    )
+
+    fig = go.Figure(go.Scatter(
+        x=position,
+        y=labels,
+        mode="markers+text",
+        marker={"size": 14, "color": frame["status"].map(STATUS_COLORS), "line": {"width": 1, "color": "white"}},
+        text=frame["value"].astype(str),
+        textposition="middle right",
+        hovertext=hover,
+        hoverinfo="text",
+    ))
+    fig.add_vrect(x0=0, x1=1, fillcolor="lightgreen", opacity=0.35, line_width=0, layer="below")
+    fig.update_layout(
+        height=80 + 32 * len(frame),
+        margin={"l": 10, "r": 10, "t": 30, "b": 30},
+        showlegend=False,
+        xaxis={
+            "range": [-RANGE_OVERSHOOT - 0.1, 1 + RANGE_OVERSHOOT + 0.3],
+            "tickvals": [0, 1],
+            "ticktext": ["Low limit", "High limit"],
+            "zeroline": False,
+        },
+        yaxis={"autorange": "reversed"},
+        clickmode="event+select",
+    )
+    return fig
+
+
+def trend_frame(history: list) -> pd.DataFrame:
+    """
+    Tabulate stored metric values (MetricsStore.history) with each value's
+    position within its own normal range, so analytes in different units
+    can share one axis.
+    """
+    frame = pd.DataFrame(history, columns=["analyte", "name", "date", "value", "unit", "normal_range", "report_hash"])
+    ranges = np.array(
+        [normal_range if normal_range else [np.nan, np.nan] for normal_range in frame["normal_range"]], dtype=float
+    ).reshape(-1, 2)
+    frame["date"] = pd.to_datetime(frame["date"])
+    frame["low"] = ranges[:, 0]
+    frame["high"] = ranges[:, 1]
+    frame["position"] = (frame["value"].astype(float) - frame["low"]) / (frame["high"] - frame["low"])
+    return frame
+
+
+def trend_chart(frame: pd.DataFrame) -> go.Figure:
+    """
+    One line per analyte over report dates. Values are drawn at their
+    position in the normal range (0 = low limit, 1 = high limit, shaded);
+    hovering shows the reported value.
+    """
+    fig = go.Figure()
+    for name, series in frame.groupby("name", sort=True):
+        fig.add_trace(go.Scatter(
+            x=series["date"],
+            y=series["position"].clip(-RANGE_OVERSHOOT, 1 + RANGE_OVERSHOOT),
+            mode="lines+markers",
+            name=name,
+            hovertext=name + ": " + series["value"].astype(str) + " " + series["unit"],
+            hoverinfo="text+x",
+        ))
+    fig.add_hrect(y0=0, y1=1, fillcolor="lightgreen", opacity=0.35, line_width=0, layer="below")
+    fig.update_layout(
+        height=420,
+        margin={"l": 10, "r": 10, "t": 30, "b": 30},
+        yaxis={
+            "range": [-RANGE_OVERSHOOT - 0.1, 1 + RANGE_OVERSHOOT + 0.1],
+            "tickvals": [0, 1],
+            "ticktext": ["Low limit", "High limit"],
+            "zeroline": False,
+        },
+        legend={"orientation": "h"},
+    )
+    return fig
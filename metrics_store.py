@@ -0,0 +1,263 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from lab_extractor import canonical_analyte
+
+METRICS_DB_PATH = os.getenv("MEDISCAN_METRICS_DB", os.path.join(".cache", "mediscan_metrics.sqlite3"))
+
+_AGGREGATE_COLUMNS = ("analyte", "name", "unit", "n", "total", "total_sq", "min_value", "max_value",
+                      "abnormal", "first_date", "last_date", "last_value")
+
+
+def _to_float(value):
+    try:
+        return float(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+def _metric_row(metric: dict):
+    """`(analyte, name, value, unit, low, high, abnormal)` for one metric dict, or None if its value is not a number."""
+    value = _to_float(metric.get("value"))
+    name = str(metric.get("name") or "").strip()
+    if value is None or not name:
+        return None
+    normal_range = metric.get("normal_range") or [None, None]
+    low, high = (_to_float(bound) for bound in (list(normal_range) + [None, None])[:2])
+    if low is None or high is None or low >= high:
+        low = high = None
+        abnormal = 0
+    else:
+        abnormal = int(value < low or value > high)
+    return canonical_analyte(name).lower(), canonical_analyte(name), value, metric.get("unit") or "", low, high, abnormal
+
+
+class MetricsStore:
+    """
+    Parsed metrics of every analyzed report, kept in SQLite so later visits can
+    chart trends without reprocessing old PDFs.
+
+    `metric_values` holds one narrow row per report and analyte, indexed by
+    (patient, analyte, date), so one analyte's history is a single index range
+    scan. `metric_aggregates` keeps running count/sum/min/max/latest per
+    patient and analyte, updated as each report is saved rather than
+    recomputed from the history. Analytes are keyed by their lab_extractor
+    canonical name, so "Haemoglobin" and "Hb" share one series.
+    """
+
+    def __init__(self, path=METRICS_DB_PATH):
+        self.path = path
+        # A ":memory:" database only lives as long as its connection, so it keeps one
+        self._memory_conn = sqlite3.connect(path, check_same_thread=False) if path == ":memory:" else None
+        self._memory_lock = threading.RLock()
+        self._lock = threading.Lock()
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        """A connection inside a transaction, committed (or rolled back) and then closed."""
+        if self._memory_conn is not None:
+            # One connection serves every thread, so transactions must not interleave
+            with self._memory_lock, self._memory_conn:
+                yield self._memory_conn
+            return
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        if self.path != ":memory:":
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS reports (
+                    report_hash TEXT PRIMARY KEY,
+                    patient_id TEXT NOT NULL,
+                    report_date TEXT NOT NULL,
+                    filename TEXT,
+                    metric_count INTEGER NOT NULL,
+                    stored_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_patient ON reports (patient_id, report_date)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS metric_values (
+                    report_hash TEXT NOT NULL,
+                    patient_id TEXT NOT NULL,
+                    analyte TEXT NOT NULL,
+                    report_date TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    unit TEXT NOT NULL,
+                    low REAL,
+                    high REAL,
+                    abnormal INTEGER NOT NULL,
+                    PRIMARY KEY (report_hash, analyte)
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_metric_values_series "
+                "ON metric_values (patient_id, analyte, report_date, value)"
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS metric_aggregates (
+                    patient_id TEXT NOT NULL,
+                    analyte TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    n INTEGER NOT NULL,
+                    total REAL NOT NULL,
+                    total_sq REAL NOT NULL,
+                    min_value REAL NOT NULL,
+                    max_value REAL NOT NULL,
+                    abnormal INTEGER NOT NULL,
+                    first_date TEXT NOT NULL,
+                    last_date TEXT NOT NULL,
+                    last_value REAL NOT NULL,
+                    PRIMARY KEY (patient_id, analyte)
+                )"""
+            )
+
+    def has_report(self, report_hash: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM reports WHERE report_hash = ?", (report_hash,)).fetchone() is not None
+
+    def save_report(self, report_hash: str, patient_id: str, report_date: str, metrics: list, filename: str = None) -> int:
+        """
+        Store one report's metrics (the `{"metrics": [...]}` items) under its
+        hash and return how many were stored. `report_date` is an ISO date.
+        Saving a report again replaces its earlier values.
+        """
+        rows = {}
+        for metric in metrics:
+            row = _metric_row(metric)
+            # A report listing an analyte twice keeps the first value, as the parsers do
+            if row is not None and row[0] not in rows:
+                rows[row[0]] = row
+
+        with self._lock, self._connect() as conn:
+            replaced = conn.execute(
+                "SELECT patient_id, analyte FROM metric_values WHERE report_hash = ?", (report_hash,)
+            ).fetchall()
+            if replaced:
+                conn.execute("DELETE FROM metric_values WHERE report_hash = ?", (report_hash,))
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (report_hash, patient_id, report_date, filename, metric_count, stored_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (report_hash, patient_id, report_date, filename, len(rows), time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO metric_values "
+                "(report_hash, patient_id, analyte, report_date, name, value, unit, low, high, abnormal) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(report_hash, patient_id, analyte, report_date, name, value, unit, low, high, abnormal)
+                 for analyte, name, value, unit, low, high, abnormal in rows.values()],
+            )
+            if replaced:
+                # Min/max cannot be backed out, so series touched by a replaced report are recomputed
+                self._rebuild_aggregates(conn, set(replaced) | {(patient_id, analyte) for analyte in rows})
+            else:
+                self._add_to_aggregates(conn, patient_id, report_date, rows.values())
+        return len(rows)
+
+    def _add_to_aggregates(self, conn, patient_id: str, report_date: str, rows):
+        conn.executemany(
+            """INSERT INTO metric_aggregates
+                   (patient_id, analyte, name, unit, n, total, total_sq, min_value, max_value,
+                    abnormal, first_date, last_date, last_value)
+               VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (patient_id, analyte) DO UPDATE SET
+                   n = n + 1,
+                   total = total + excluded.total,
+                   total_sq = total_sq + excluded.total_sq,
+                   min_value = MIN(min_value, excluded.min_value),
+                   max_value = MAX(max_value, excluded.max_value),
+                   abnormal = abnormal + excluded.abnormal,
+                   first_date = MIN(first_date, excluded.first_date),
+                   name = CASE WHEN excluded.last_date >= last_date THEN excluded.name ELSE name END,
+                   unit = CASE WHEN excluded.last_date >= last_date THEN excluded.unit ELSE unit END,
+                   last_value = CASE WHEN excluded.last_date >= last_date THEN excluded.last_value ELSE last_value END,
+                   last_date = MAX(last_date, excluded.last_date)""",
+            [(patient_id, analyte, name, unit, value, value * value, value, value, abnormal,
+              report_date, report_date, value)
+             for analyte, name, value, unit, low, high, abnormal in rows],
+        )
+
+    def _rebuild_aggregates(self, conn, series: set):
+        for patient_id, analyte in series:
+            conn.execute("DELETE FROM metric_aggregates WHERE patient_id = ? AND analyte = ?", (patient_id, analyte))
+            conn.execute(
+                """INSERT INTO metric_aggregates
+                       (patient_id, analyte, name, unit, n, total, total_sq, min_value, max_value,
+                        abnormal, first_date, last_date, last_value)
+                   SELECT series.patient_id, series.analyte, latest.name, latest.unit, COUNT(*),
+                          SUM(series.value), SUM(series.value * series.value), MIN(series.value), MAX(series.value),
+                          SUM(series.abnormal), MIN(series.report_date), latest.report_date, latest.value
+                   FROM metric_values AS series,
+                        (SELECT name, unit, report_date, value FROM metric_values
+                         WHERE patient_id = :patient AND analyte = :analyte
+                         ORDER BY report_date DESC LIMIT 1) AS latest
+                   WHERE series.patient_id = :patient AND series.analyte = :analyte
+                   GROUP BY series.patient_id, series.analyte""",
+                {"patient": patient_id, "analyte": analyte},
+            )
+
+    def history(self, patient_id: str, analytes: list = None) -> list:
+        """
+        Stored values for a patient, oldest first, as dicts with `analyte`,
+        `name`, `date`, `value`, `unit`, `normal_range` and `report_hash`;
+        `analytes` (any synonym) limits the result to those series.
+        """
+        query = (
+            "SELECT analyte, name, report_date, value, unit, low, high, report_hash "
+            "FROM metric_values WHERE patient_id = ?"
+        )
+        params = [patient_id]
+        if analytes:
+            keys = sorted({canonical_analyte(analyte).lower() for analyte in analytes})
+            query += f" AND analyte IN ({', '.join('?' * len(keys))})"
+            params += keys
+        query += " ORDER BY analyte, report_date"
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [
+            {"analyte": analyte, "name": name, "date": report_date, "value": value, "unit": unit,
+             "normal_range": [low, high] if low is not None else None, "report_hash": report_hash}
+            for analyte, name, report_date, value, unit, low, high, report_hash in rows
+        ]
+
+    def aggregates(self, patient_id: str) -> list:
+        """Per-analyte summary for a patient: count, mean, standard deviation, min/max, abnormal count and latest value."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_AGGREGATE_COLUMNS)} FROM metric_aggregates WHERE patient_id = ? ORDER BY name",
+                (patient_id,),
+            ).fetchall()
+        summaries = []
+        for row in rows:
+            summary = dict(zip(_AGGREGATE_COLUMNS, row))
+            n, total, total_sq = summary.pop("n"), summary.pop("total"), summary.pop("total_sq")
+            summary["count"] = n
+            summary["mean"] = total / n
+            summary["std"] = max(0.0, total_sq / n - (total / n) ** 2) ** 0.5
+            summaries.append(summary)
+        return summaries
+
+    def reports(self, patient_id: str) -> list:
+        """A patient's stored reports, newest first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT report_hash, report_date, filename, metric_count FROM reports "
+                "WHERE patient_id = ? ORDER BY report_date DESC",
+                (patient_id,),
+            ).fetchall()
+        return [dict(zip(("report_hash", "date", "filename", "metric_count"), row)) for row in rows]
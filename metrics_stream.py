@@ -0,0 +1,93 @@
+import json
+
+
+def _to_float(value) -> float:
+    # Thousands separators ("7,500") are stripped, as lab_extractor and metrics_store do
+    return float(str(value).replace(",", ""))
+
+
+def normalize_metric(obj):
+    """
+    Coerce one parsed metric object into the `{"name", "value", "unit",
+    "normal_range"}` shape the Health Metrics tab expects, or None if unusable.
+    """
+    if not isinstance(obj, dict) or "name" not in obj:
+        return None
+    try:
+        value = _to_float(obj.get("value"))
+    except (TypeError, ValueError):
+        return None
+    normal_range = obj.get("normal_range")
+    try:
+        low, high = (_to_float(bound) for bound in normal_range)
+    except (TypeError, ValueError):
+        low, high = 0.0, 0.0
+    return {
+        "name": str(obj["name"]),
+        "value": value,
+        "unit": str(obj.get("unit") or ""),
+        "normal_range": [low, high],
+    }
+
+
+class MetricsStreamParser:
+    """
+    Incremental parser for `{"metrics": [{...}, {...}]}` responses.
+
+    Feed it text deltas as they arrive; each call returns the metric objects
+    whose closing brace arrived in that delta. Leading prose or ``` fences
+    are skipped, formatting inside objects does not matter, and an object cut
+    off by a token limit is never emitted.
+    """
+
+    def __init__(self):
+        self._stack = []          # Open containers: "{" or "["
+        self._in_string = False
+        self._escaped = False
+        self._item_depth = None   # Stack depth at which metric objects open
+        self._buffer = []         # Characters of the metric object being read
+
+    def feed(self, chunk: str) -> list:
+        completed = []
+        for ch in chunk:
+            capturing = bool(self._buffer)
+            if capturing:
+                self._buffer.append(ch)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                if self._stack:
+                    self._in_string = True
+            elif ch in "{[":
+                # Metric objects are the elements of the first array we meet
+                if ch == "{" and self._stack and self._stack[-1] == "[" and not capturing:
+                    if self._item_depth is None:
+                        self._item_depth = len(self._stack)
+                    if len(self._stack) == self._item_depth:
+                        self._buffer = [ch]
+                self._stack.append(ch)
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if ch == "}" and capturing and len(self._stack) == self._item_depth:
+                    try:
+                        metric = normalize_metric(json.loads("".join(self._buffer)))
+                    except json.JSONDecodeError:
+                        metric = None
+                    if metric is not None:
+                        completed.append(metric)
+                    self._buffer = []
+        return completed
+
+
+def parse_metrics(text: str) -> list:
+    """Parse a complete (or truncated) metrics response in one go."""
+    return MetricsStreamParser().feed(text)
@@ -1,43 +1,784 @@
-import io
+import os
 import re
+import sys
+import time
+import queue
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
 import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
 
-import pytesseract
+import telemetry
+from lab_extractor import rows_from_page, positioned_rows
+from result_cache import ResultCache, make_cache_key
+
+try:
+    import tesserocr  # Optional in-process binding to libtesseract
+except (ImportError, ValueError):
+    # ValueError: its cysignals dependency installs signal handlers, which only
+    # works on the main thread, and Streamlit runs the app script on another one
+    tesserocr = None
+
+try:
+    import cv2  # Optional image cleanup before OCR
+    import numpy as np
+except ImportError:
+    cv2 = None
+
+try:
+    import resource  # Peak RSS fallback where /proc is unavailable; not on Windows
+except ImportError:
+    resource = None
+
+# Locate the Tesseract executable through the environment or PATH
+TESSERACT_CMD = os.getenv("TESSERACT_CMD") or shutil.which("tesseract")
+if TESSERACT_CMD:
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+# OCR engine settings: "auto" prefers the in-process tesserocr engine when available
+OCR_BACKEND = os.getenv("MEDISCAN_OCR_BACKEND", "auto")
+OCR_LANG = os.getenv("MEDISCAN_OCR_LANG", "eng")
+OCR_PSM = int(os.getenv("MEDISCAN_OCR_PSM", "3"))
+OCR_OEM = int(os.getenv("MEDISCAN_OCR_OEM", "3"))
+OCR_ENGINE_POOL_SIZE = int(os.getenv("MEDISCAN_OCR_ENGINE_POOL_SIZE", str(os.cpu_count() or 1)))
+TESSDATA_PREFIX = os.getenv("TESSDATA_PREFIX")
+
+# Number of processes used to OCR scanned pages; 1 keeps everything in-process
+OCR_WORKERS = int(os.getenv("MEDISCAN_OCR_WORKERS", str(os.cpu_count() or 1)))
+
+# Render resolution bounds for OCR; see choose_ocr_dpi
+OCR_DEFAULT_DPI = 300
+OCR_MIN_DPI = 150
+OCR_MAX_DPI = 400
+OCR_TARGET_GLYPH_PX = 32
+OCR_MAX_PIXELS = 12_000_000
+
+# Optional OpenCV cleanup of rendered pages before OCR; see preprocess_for_ocr
+OCR_PREPROCESS = os.getenv("MEDISCAN_OCR_PREPROCESS", "0").lower() in ("1", "true", "yes")
+OCR_TARGET_XHEIGHT_PX = int(os.getenv("MEDISCAN_OCR_TARGET_XHEIGHT", "22"))
+OCR_MAX_DESKEW_DEGREES = 10.0
 
-# Set the path to the Tesseract executable
-pytesseract.pytesseract.tesseract_cmd = r'C:\\Users\\skintern\\AppData\\Local\\Programs\\Tesseract-OCR\\tesseract.exe'
+# Region-targeted OCR; see find_ocr_regions
+OCR_MIN_REGION_FRACTION = float(os.getenv("MEDISCAN_OCR_MIN_REGION_FRACTION", "0.05"))
+OCR_REGION_MIN_CHARS = 50
+OCR_REGION_PADDING = 4  # Points added around each region so edge glyphs are not clipped
 
+# Page-level OCR result cache; repeat pages skip rendering and Tesseract entirely
+OCR_CACHE_ENABLED = os.getenv("MEDISCAN_OCR_CACHE", "1").lower() in ("1", "true", "yes")
+OCR_CACHE_MAX_BYTES = int(os.getenv("MEDISCAN_OCR_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+OCR_CACHE_TTL_SECONDS = float(os.getenv("MEDISCAN_OCR_CACHE_TTL_SECONDS", str(90 * 24 * 3600)))
 
-def extract_text_from_pdf(file) -> str:
+# Limits that keep huge or hostile PDFs from exhausting memory or time
+PDF_SPOOL_BYTES = int(os.getenv("MEDISCAN_PDF_SPOOL_BYTES", str(8 * 1024 * 1024)))  # Larger uploads go to a temp file
+PDF_MAX_PAGES = int(os.getenv("MEDISCAN_PDF_MAX_PAGES", "500"))
+PDF_MAX_SECONDS = float(os.getenv("MEDISCAN_PDF_MAX_SECONDS", "600"))  # Checked between pages, not within one
+OCR_MAX_DOCUMENT_PIXELS = int(os.getenv("MEDISCAN_OCR_MAX_DOCUMENT_PIXELS", str(4_000_000_000)))  # Counted at OCR_MAX_DPI
+PDF_LOOKAHEAD_PER_WORKER = 2  # Pages read ahead of the consumer per OCR worker
+
+ocr_cache = ResultCache(
+    namespace="ocr", max_bytes=OCR_CACHE_MAX_BYTES, ttl_seconds=OCR_CACHE_TTL_SECONDS
+) if OCR_CACHE_ENABLED else None
+
+_ocr_pool = None
+_ocr_pool_workers = 0
+_ocr_pool_lock = threading.Lock()
+
+_ocr_backends = {}
+_ocr_backends_lock = threading.Lock()
+
+
+class PDFLimitError(ValueError):
+    """Raised when a PDF has too many pages or takes too long to extract."""
+
+
+def reset_peak_rss():
     """
-    Extract text from a PDF file robustly.
-    
-    Uses PyMuPDF to extract embedded text; if the extracted text from a page 
-    is very short (suggesting a scanned page or poor quality text), it falls back 
-    to OCR using Tesseract.
-    """
-    pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-    all_text = []
-
-    for page_num in range(pdf_document.page_count):
-        page = pdf_document.load_page(page_num)
-        # First try to extract text directly
-        text = page.get_text("text")
-        # If text is very short, assume OCR might be needed
-        if len(text.strip()) < 50:
+    Restart this process's peak RSS counter (Linux only; elsewhere the peak
+    counts from process start). The counter is process-wide: documents
+    extracted concurrently in one process reset and share the same peak.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process: VmHWM from /proc, else ru_maxrss, else 0."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _needs_ocr(text: str) -> bool:
+    # If text is very short, assume OCR might be needed
+    return len(text.strip()) < 50
+
+
+class PytesseractBackend:
+    """Runs the tesseract binary once per image through pytesseract."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang: str, psm: int, oem: int):
+        self.lang = lang
+        self.config = f"--psm {psm} --oem {oem}"
+
+    def image_to_string(self, img: Image.Image) -> str:
+        return pytesseract.image_to_string(img, lang=self.lang, config=self.config)
+
+
+class TesserocrBackend:
+    """
+    Keeps up to `pool_size` initialized libtesseract engines warm and lends
+    them out one image at a time, so no process is spawned per page.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, lang: str, psm: int, oem: int, pool_size: int = OCR_ENGINE_POOL_SIZE):
+        self.lang = lang
+        self.psm = psm
+        self.oem = oem
+        self.pool_size = max(1, pool_size)
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # Fail fast (missing language data, broken install) so the caller can fall back
+        self._idle.put(self._new_engine())
+
+    def _new_engine(self):
+        kwargs = {"lang": self.lang, "psm": self.psm, "oem": self.oem}
+        if TESSDATA_PREFIX:
+            kwargs["path"] = TESSDATA_PREFIX
+        engine = tesserocr.PyTessBaseAPI(**kwargs)
+        self._created += 1
+        return engine
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                return self._new_engine()
+        return self._idle.get()
+
+    def image_to_string(self, img: Image.Image) -> str:
+        engine = self._acquire()
+        try:
+            engine.SetImage(img)
+            return engine.GetUTF8Text()
+        finally:
+            engine.Clear()
+            self._idle.put(engine)
+
+
+def _ocr_settings(lang: str = None, psm: int = None, oem: int = None) -> tuple:
+    """Resolve OCR options against the MEDISCAN_OCR_* defaults as `(lang, psm, oem)`."""
+    return (lang or OCR_LANG, OCR_PSM if psm is None else psm, OCR_OEM if oem is None else oem)
+
+
+def _split_ocr_options(ocr_options: dict = None) -> tuple:
+    """Split `ocr_options` into the engine settings for get_ocr_backend and the preprocess flag."""
+    options = dict(ocr_options or {})
+    preprocess = options.pop("preprocess", OCR_PREPROCESS) and cv2 is not None
+    return options, bool(preprocess)
+
+
+def get_ocr_backend(lang: str = None, psm: int = None, oem: int = None):
+    """
+    Return a shared OCR backend for the given settings, creating it on first use.
+
+    The in-process tesserocr engine is used when it is installed and can load
+    the requested language; otherwise pytesseract is the fallback.
+    """
+    settings = _ocr_settings(lang, psm, oem)
+    with _ocr_backends_lock:
+        backend = _ocr_backends.get(settings)
+        if backend is None:
+            if OCR_BACKEND in ("auto", "tesserocr") and tesserocr is not None:
+                try:
+                    backend = TesserocrBackend(*settings)
+                except Exception as e:
+                    print(f"tesserocr unavailable, falling back to pytesseract: {e}")
+            if backend is None:
+                backend = PytesseractBackend(*settings)
+            _ocr_backends[settings] = backend
+        return backend
+
+
+def find_ocr_regions(page) -> list:
+    """
+    Return the page areas that need OCR as `(x0, y0, x1, y1)` tuples.
+
+    Images covering at least OCR_MIN_REGION_FRACTION of the page and carrying
+    fewer than OCR_REGION_MIN_CHARS characters of embedded text (a scanned
+    table under a typed header, a photographed page) are OCR candidates;
+    overlapping candidates are merged. Small images such as logos and
+    signatures are ignored. A page with almost no embedded text and no such
+    image (e.g. text drawn as vector paths) is OCR'd whole, as before.
+    """
+    page_rect = page.rect
+    min_area = abs(page_rect) * OCR_MIN_REGION_FRACTION
+    blocks = [block for block in page.get_text("blocks") if block[6] == 0]
+
+    candidates = []
+    for info in page.get_image_info():
+        rect = fitz.Rect(info["bbox"]) & page_rect
+        if rect.is_empty or abs(rect) < min_area:
+            continue
+        embedded_chars = sum(
+            len(block[4].strip()) for block in blocks
+            if rect.contains(fitz.Point((block[0] + block[2]) / 2, (block[1] + block[3]) / 2))
+        )
+        if embedded_chars < OCR_REGION_MIN_CHARS:
+            candidates.append(rect)
+
+    regions = []
+    for rect in candidates:
+        rect = fitz.Rect(rect)
+        # Fold in every region this one touches, repeating until nothing overlaps
+        merged = True
+        while merged:
+            merged = False
+            for other in regions:
+                if rect.intersects(other):
+                    rect |= other
+                    regions.remove(other)
+                    merged = True
+                    break
+        regions.append(rect)
+
+    if not regions and _needs_ocr(page.get_text("text")):
+        return [tuple(page_rect)]
+    padded = (rect + (-OCR_REGION_PADDING, -OCR_REGION_PADDING, OCR_REGION_PADDING, OCR_REGION_PADDING) for rect in regions)
+    return sorted((tuple(rect & page_rect) for rect in padded), key=lambda r: (r[1], r[0]))
+
+
+def _page_layout(page, regions: list) -> dict:
+    """Embedded text blocks and table rows lying outside the OCR regions, with their positions."""
+    def outside(x, y):
+        return not any(r[0] <= x <= r[2] and r[1] <= y <= r[3] for r in regions)
+
+    return {
+        "blocks": [
+            (block[1], block[0], block[4].strip())
+            for block in page.get_text("blocks")
+            if block[6] == 0 and block[4].strip() and outside((block[0] + block[2]) / 2, (block[1] + block[3]) / 2)
+        ],
+        "rows": positioned_rows(page, exclude=regions),
+    }
+
+
+def page_fingerprint(page) -> str:
+    """
+    Hash everything that decides what a page looks like: its geometry, its
+    content streams and the raw streams of the images and form XObjects it
+    draws. Pixel-identical letterheads and re-uploads hash the same.
+    """
+    document = page.parent
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(page.rect), page.rotation)).encode())
+    digest.update(page.read_contents())
+    xrefs = {xobject[0] for xobject in page.get_xobjects()}
+    for image in page.get_images(full=True):
+        xrefs.add(image[0])
+        if image[1]:  # Soft mask
+            xrefs.add(image[1])
+    for xref in sorted(xrefs):
+        digest.update(document.xref_stream_raw(xref) or b"")
+    return digest.hexdigest()
+
+
+def _ocr_cache_key(page, ocr_options: dict = None) -> str:
+    """Key an OCR result on the page content and every setting that changes the OCR output."""
+    engine_options, preprocess = _split_ocr_options(ocr_options)
+    return make_cache_key(
+        page_fingerprint(page), _ocr_settings(**engine_options), OCR_BACKEND, preprocess, OCR_TARGET_XHEIGHT_PX,
+        OCR_DEFAULT_DPI, OCR_MIN_DPI, OCR_MAX_DPI, OCR_TARGET_GLYPH_PX, OCR_MAX_PIXELS,
+        "regions", OCR_MIN_REGION_FRACTION, OCR_REGION_MIN_CHARS, OCR_REGION_PADDING,
+    )
+
+
+def get_ocr_cache_stats() -> dict:
+    """Hit/miss counters and OCR time saved by the page cache (all zero when it is disabled)."""
+    if ocr_cache is None:
+        return {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                "saved_seconds": 0.0, "saved_tokens": 0, "hit_rate": 0.0}
+    return ocr_cache.stats()
+
+
+def choose_ocr_dpi(page, clip=None) -> int:
+    """
+    Pick a render resolution for OCR from the page itself instead of a fixed 300 dpi.
+
+    Scanned pages are never rendered above the resolution of their embedded
+    images, pages with some embedded text are sized so the median glyph lands
+    near OCR_TARGET_GLYPH_PX, and the total pixel count is capped for huge pages.
+    With a `clip` rectangle only the text spans and images under it and its
+    area count. Without text to measure, the native image resolution is used,
+    or OCR_DEFAULT_DPI when there is no image either.
+    """
+    clip = fitz.Rect(clip) if clip is not None else page.rect
+    sizes = sorted(
+        span["size"]
+        for block in page.get_text("dict", clip=clip).get("blocks", [])
+        for line in block.get("lines", [])
+        for span in line["spans"]
+        if span["text"].strip() and fitz.Rect(span["bbox"]).intersects(clip)
+    )
+    native = [
+        info["width"] * 72 / max(fitz.Rect(info["bbox"]).width, 1)
+        for info in page.get_image_info()
+        if fitz.Rect(info["bbox"]).intersects(clip)
+    ]
+    if sizes:
+        dpi = OCR_TARGET_GLYPH_PX * 72 / sizes[len(sizes) // 2]
+        if native:
+            dpi = min(dpi, max(native))
+    else:
+        dpi = max(native) if native else OCR_DEFAULT_DPI
+
+    area_points = clip.width * clip.height
+    if area_points:
+        dpi = min(dpi, 72 * (OCR_MAX_PIXELS / area_points) ** 0.5)
+    return int(max(OCR_MIN_DPI, min(OCR_MAX_DPI, dpi)))
+
+
+def render_page_for_ocr(page, dpi: int, clip=None) -> Image.Image:
+    """Render `page` (or just `clip`) in grayscale and wrap the pixmap samples as a PIL image without copying."""
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False, clip=clip)
+    # The image shares pix's buffer; keep a reference so it outlives this frame
+    img = Image.frombuffer("L", (pix.width, pix.height), pix.samples_mv, "raw", "L", pix.stride, 1)
+    img.info["pixmap"] = pix
+    return img
+
+
+def pixmap_to_array(pix) -> "np.ndarray":
+    """
+    View a grayscale pixmap's samples as a (height, width) uint8 array without
+    copying. The view does not keep `pix` alive; hold on to the pixmap while using it.
+    """
+    return np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+
+def _remove_dark_areas(gray: "np.ndarray", binary: "np.ndarray") -> "np.ndarray":
+    """Whiten solid dark areas (scanner borders, the background around a photographed page) in `binary`."""
+    dark = (gray < 80).astype(np.uint8)
+    # Text strokes are far thinner than the kernel, so opening keeps only large dark blobs
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 25))
+    solid = cv2.dilate(cv2.morphologyEx(dark, cv2.MORPH_OPEN, kernel), kernel)
+    binary[solid > 0] = 255
+    return binary
+
+
+def _skew_angle(points: "np.ndarray", line_height: float) -> float:
+    """
+    Estimate text skew in degrees from glyph centers: the rotation whose
+    horizontal projection of the centers is sharpest lines the text rows up.
+    Scattered noise adds a flat background and does not move the peak.
+    """
+    if len(points) < 20:
+        return 0.0
+    x = points[:, 0] - points[:, 0].mean()
+    y = points[:, 1]
+    bin_size = max(line_height / 2, 1.0)
+
+    def sharpness(angle):
+        theta = np.deg2rad(angle)
+        rotated = y * np.cos(theta) - x * np.sin(theta)
+        counts = np.bincount(((rotated - rotated.min()) / bin_size).astype(np.int64))
+        return float(np.dot(counts, counts))
+
+    best = max(np.arange(-OCR_MAX_DESKEW_DEGREES, OCR_MAX_DESKEW_DEGREES + 0.01, 0.5), key=sharpness)
+    return float(max(np.arange(best - 0.5, best + 0.51, 0.1), key=sharpness))
+
+
+def preprocess_for_ocr(gray: "np.ndarray") -> "np.ndarray":
+    """
+    Clean up a rendered page for Tesseract: binarize with an adaptive
+    threshold, drop speckle noise and dark borders, crop to the text,
+    straighten small skews and downscale so glyphs sit near
+    OCR_TARGET_XHEIGHT_PX. Works on and returns uint8 grayscale arrays.
+    """
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY)
+    gray = cv2.medianBlur(gray, 3)
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+    binary = _remove_dark_areas(gray, binary)
+
+    # One connected-component pass yields the speckles, the glyphs and their geometry
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(255 - binary, connectivity=8)
+    heights = stats[:, cv2.CC_STAT_HEIGHT]
+    widths = stats[:, cv2.CC_STAT_WIDTH]
+    areas = stats[:, cv2.CC_STAT_AREA]
+    speckle = areas < 12
+    speckle[0] = False  # Background
+    glyph = ~speckle & (heights >= 4) & (heights <= binary.shape[0] // 20) & (widths <= heights * 3)
+    glyph[0] = False
+    if speckle.any():
+        binary[speckle[labels]] = 255
+    if not glyph.any():
+        return binary
+
+    left = stats[glyph, cv2.CC_STAT_LEFT]
+    top = stats[glyph, cv2.CC_STAT_TOP]
+    margin = 8
+    y0, y1 = max(top.min() - margin, 0), min((top + heights[glyph]).max() + margin, binary.shape[0])
+    x0, x1 = max(left.min() - margin, 0), min((left + widths[glyph]).max() + margin, binary.shape[1])
+    binary = binary[y0:y1, x0:x1]
+
+    xheight = float(np.median(heights[glyph]))
+    angle = _skew_angle(centroids[glyph], xheight)
+    if abs(angle) >= 0.3:
+        height, width = binary.shape
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        binary = cv2.warpAffine(binary, matrix, (width, height), flags=cv2.INTER_NEAREST, borderValue=255)
+
+    if xheight > OCR_TARGET_XHEIGHT_PX * 1.2:
+        scale = OCR_TARGET_XHEIGHT_PX / xheight
+        binary = cv2.resize(binary, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return binary
+
+
+def _ocr_page(page, page_num: int, ocr_options: dict = None, regions: list = None) -> dict:
+    """
+    OCR the given regions of one page (default: the whole page) and return
+    `{"rect", "text"}` per region (None on failure) with render/preprocess/OCR
+    timings and the number of pixels sent to Tesseract.
+    """
+    result = {"regions": None, "dpi": None, "pixels": 0, "render_ms": 0.0, "preprocess_ms": 0.0, "ocr_ms": 0.0,
+              "peak_rss_bytes": 0}
+    try:
+        engine_options, preprocess = _split_ocr_options(ocr_options)
+        backend = get_ocr_backend(**engine_options)
+        texts = []
+        for rect in regions or [tuple(page.rect)]:
+            started = time.perf_counter()
+            dpi = choose_ocr_dpi(page, rect)
+            img = render_page_for_ocr(page, dpi, fitz.Rect(rect))
+            rendered = time.perf_counter()
+            if preprocess:
+                img = Image.fromarray(preprocess_for_ocr(pixmap_to_array(img.info["pixmap"])))
+            preprocessed = time.perf_counter()
+            # Use Tesseract to extract text from the image
+            texts.append({"rect": list(rect), "text": backend.image_to_string(img)})
+            result["dpi"] = max(result["dpi"] or 0, dpi)
+            result["pixels"] += img.width * img.height
+            result["render_ms"] += (rendered - started) * 1000
+            result["preprocess_ms"] += (preprocessed - rendered) * 1000
+            result["ocr_ms"] += (time.perf_counter() - preprocessed) * 1000
+            # Free this region's pixmap before rendering the next one
+            del img
+        result["regions"] = texts
+    except Exception as e:
+        print(f"OCR failed on page {page_num}: {e}")
+    # Drop MuPDF's cached decoded images too; pages rarely share them
+    fitz.TOOLS.store_shrink(100)
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    return result
+
+
+def _ocr_page_in_worker(source: dict, page_num: int, ocr_options: dict = None, regions: list = None) -> dict:
+    """
+    Process pool entry point: open the document, OCR one page and close it
+    again. `source` names either a file path or a shared memory block and its
+    size. Nothing is kept between tasks, so a worker never holds a finished
+    document's spooled file or its copy of the shared bytes; opening is cheap
+    next to rendering and OCR'ing the page.
+    """
+    if "path" in source:
+        document = fitz.open(source["path"])
+    else:
+        shm = shared_memory.SharedMemory(name=source["shm"])
+        try:
+            document = fitz.open(stream=bytes(shm.buf[:source["size"]]), filetype="pdf")
+        finally:
+            shm.close()
+    try:
+        reset_peak_rss()
+        return _ocr_page(document.load_page(page_num), page_num, ocr_options, regions)
+    finally:
+        document.close()
+
+
+def _get_ocr_pool(workers: int) -> ProcessPoolExecutor:
+    """Return the shared OCR process pool, resizing it if a different worker count is requested."""
+    global _ocr_pool, _ocr_pool_workers
+    with _ocr_pool_lock:
+        if _ocr_pool is None or _ocr_pool_workers != workers:
+            if _ocr_pool is not None:
+                _ocr_pool.shutdown(wait=False)
+            _ocr_pool = ProcessPoolExecutor(max_workers=workers)
+            _ocr_pool_workers = workers
+        return _ocr_pool
+
+
+def _share_bytes(pdf_bytes: bytes) -> shared_memory.SharedMemory:
+    """Copy the PDF into a shared memory block the OCR workers can open by name."""
+    shm = shared_memory.SharedMemory(create=True, size=len(pdf_bytes))
+    shm.buf[:len(pdf_bytes)] = pdf_bytes
+    return shm
+
+
+def _open_pdf(file) -> tuple:
+    """
+    Open `file`, a path or a binary file object, as `(document, path, pdf_bytes)`.
+
+    Paths are opened directly and read lazily by MuPDF. File objects up to
+    PDF_SPOOL_BYTES are read into memory; larger ones are copied block by
+    block to a temporary file, whose `path` the caller must delete.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        return fitz.open(os.fspath(file), filetype="pdf"), None, None
+    head = file.read(PDF_SPOOL_BYTES + 1)
+    if len(head) <= PDF_SPOOL_BYTES:
+        return fitz.open(stream=head, filetype="pdf"), None, head
+    fd, path = tempfile.mkstemp(prefix="mediscan-", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            spool.write(head)
+            del head
+            shutil.copyfileobj(file, spool, 1 << 20)
+        return fitz.open(path, filetype="pdf"), path, None
+    except Exception:
+        os.unlink(path)
+        raise
+
+
+def _ocr_pixel_estimate(regions: list) -> int:
+    """Upper bound on the pixels OCR of `regions` will render (see choose_ocr_dpi)."""
+    scale = (OCR_MAX_DPI / 72) ** 2
+    return int(sum(min(OCR_MAX_PIXELS, fitz.Rect(rect).width * fitz.Rect(rect).height * scale) for rect in regions))
+
+
+def _merge_ocr_regions(record: dict, regions: list, layout: dict) -> dict:
+    """Replace the record's text and rows with the embedded content outside the OCR regions plus the OCR text, in reading order."""
+    blocks = list(layout["blocks"])
+    rows = list(layout["rows"])
+    for region in regions:
+        x0, y0 = region["rect"][0], region["rect"][1]
+        blocks.append((y0, x0, region["text"].strip()))
+        rows.extend((y0, x0, line) for line in region["text"].splitlines() if line.strip())
+    # Sorting is stable, so lines within one region keep their order
+    record.update(
+        text="\n".join(text for _, _, text in sorted(blocks, key=lambda item: item[:2]) if text),
+        rows=[text for _, _, text in sorted(rows, key=lambda item: item[:2])],
+        ocr=True,
+    )
+    return record
+
+
+def _apply_ocr_result(record: dict, result: dict, layout: dict, cache_key: str = None) -> dict:
+    record.update(
+        dpi=result["dpi"], render_ms=result["render_ms"], preprocess_ms=result["preprocess_ms"],
+        ocr_ms=result["ocr_ms"], ocr_pixels=result["pixels"],
+    )
+    # Keep the embedded text when OCR failed, as before
+    if result["regions"] is not None:
+        _merge_ocr_regions(record, result["regions"], layout)
+        if cache_key is not None:
+            cost_ms = result["render_ms"] + result["preprocess_ms"] + result["ocr_ms"]
+            ocr_cache.set(cache_key, result["regions"], cost_ms / 1000)
+    else:
+        telemetry.inc("mediscan_ocr_failures_total")
+    return record
+
+
+def _cached_ocr_regions(page, ocr_options: dict = None) -> tuple:
+    """Look the page up in the OCR cache; returns `(region texts or None, key to store the result under)`."""
+    if ocr_cache is None:
+        return None, None
+    cache_key = _ocr_cache_key(page, ocr_options)
+    regions = ocr_cache.get(cache_key)
+    telemetry.inc("mediscan_ocr_cache_total", result="miss" if regions is None else "hit")
+    return regions, cache_key
+
+
+def _page_done(record: dict) -> dict:
+    """Export a finished page's timings; OCR may have run in another process, so record them here."""
+    if telemetry.TELEMETRY_ENABLED:
+        telemetry.observe("mediscan_pdf_text_extract_seconds", record["extract_ms"] / 1000)
+        if record["ocr"]:
+            telemetry.observe("mediscan_ocr_render_seconds", record["render_ms"] / 1000)
+            telemetry.observe("mediscan_ocr_preprocess_seconds", record["preprocess_ms"] / 1000)
+            telemetry.observe("mediscan_ocr_seconds", record["ocr_ms"] / 1000)
+            telemetry.inc("mediscan_ocr_pixels_total", record["ocr_pixels"])
+        telemetry.inc("mediscan_pdf_pages_total", ocr=record["ocr"])
+        telemetry.event(
+            "pdf.page", page=record["page"], ocr=record["ocr"], ocr_cached=record["ocr_cached"],
+            ocr_regions=record["ocr_regions"], ocr_pixels=record["ocr_pixels"], dpi=record["dpi"],
+            extract_ms=record["extract_ms"], render_ms=record["render_ms"],
+            preprocess_ms=record["preprocess_ms"], ocr_ms=record["ocr_ms"],
+        )
+    return record
+
+
+def iter_pdf_pages(file, ocr_workers: int = None, ocr_options: dict = None):
+    """
+    Extract a PDF page by page, yielding one record per page in page order as soon as it is ready.
+
+    `file` is a path or a binary file object; large uploads are spooled to a
+    temporary file rather than held in memory (see _open_pdf). Each record
+    holds the page number, the document's page count, its text, its table
+    rows (see lab_extractor.rows_from_page), whether OCR was used, whether the
+    OCR text came from the page cache, whether OCR was skipped because the
+    document's pixel budget ran out, how many regions and pixels were OCR'd,
+    the OCR render DPI, the extract/render/preprocess/OCR timings in
+    milliseconds and the peak RSS of the extraction so far. Only the regions found by
+    find_ocr_regions are OCR'd, and their text is merged with the embedded
+    text in reading order. Pages needing OCR are spread over `ocr_workers`
+    processes (default MEDISCAN_OCR_WORKERS) while later pages are still being
+    read, at most a few pages ahead of the consumer; one-page documents stay
+    serial. `ocr_options` may override the OCR "lang", "psm" and "oem", and
+    turn OpenCV "preprocess"ing on or off (default MEDISCAN_OCR_PREPROCESS).
+
+    Raises PDFLimitError when the document has more than PDF_MAX_PAGES pages
+    or extraction runs past PDF_MAX_SECONDS. The time limit is checked between
+    pages and while waiting for OCR workers, so a page being extracted or
+    OCR'd in this process is finished before the error is raised. The peak
+    RSS counter is process-wide, so documents extracted concurrently in one
+    process share it (see reset_peak_rss).
+    """
+    # Resolve the preprocess default here so OCR worker processes follow this process's setting
+    ocr_options = dict(ocr_options or {})
+    ocr_options.setdefault("preprocess", OCR_PREPROCESS)
+    document_started = time.perf_counter()
+    reset_peak_rss()
+    pdf_document, spool_path, pdf_bytes = _open_pdf(file)
+    page_count = pdf_document.page_count
+    workers = OCR_WORKERS if ocr_workers is None else ocr_workers
+    parallel = workers > 1 and page_count > 1
+    lookahead = max(1, workers * PDF_LOOKAHEAD_PER_WORKER)
+    source = None
+    shm = None
+    pending = deque()
+    ocr_pixels_left = OCR_MAX_DOCUMENT_PIXELS
+
+    def time_left() -> float:
+        remaining = PDF_MAX_SECONDS - (time.perf_counter() - document_started)
+        if remaining <= 0:
+            raise PDFLimitError(f"PDF extraction took longer than {PDF_MAX_SECONDS:g} s")
+        return remaining
+
+    def finish(record, future, layout, cache_key):
+        if future is not None:
             try:
-                # Render page as an image at a higher resolution (300 dpi)
-                pix = page.get_pixmap(dpi=300)
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
-                # Use Tesseract to extract text from the image
-                text = pytesseract.image_to_string(img)
-            except Exception as e:
-                print(f"OCR failed on page {page_num}: {e}")
-        all_text.append(text)
-    
-    pdf_document.close()
-    return "\n".join(all_text)
+                result = future.result(timeout=time_left())
+            except FutureTimeoutError:
+                raise PDFLimitError(f"PDF extraction took longer than {PDF_MAX_SECONDS:g} s") from None
+            _apply_ocr_result(record, result, layout, cache_key)
+            record["peak_rss_bytes"] = max(record["peak_rss_bytes"], result["peak_rss_bytes"])
+        record["peak_rss_bytes"] = max(record["peak_rss_bytes"], peak_rss_bytes())
+        return _page_done(record)
+
+    try:
+        if page_count > PDF_MAX_PAGES:
+            raise PDFLimitError(f"PDF has {page_count} pages; the limit is {PDF_MAX_PAGES}")
+        for page_num in range(page_count):
+            time_left()
+            started = time.perf_counter()
+            page = pdf_document.load_page(page_num)
+            # First try to extract text directly
+            text = page.get_text("text")
+            record = {
+                "page": page_num,
+                "page_count": page_count,
+                "text": text,
+                # Table rows rebuilt from word positions, for the local lab value extractor
+                "rows": rows_from_page(page),
+                "ocr": False,
+                "ocr_cached": False,
+                "ocr_skipped": False,
+                "ocr_regions": 0,
+                "ocr_pixels": 0,
+                "dpi": None,
+                "extract_ms": 0.0,
+                "render_ms": 0.0,
+                "preprocess_ms": 0.0,
+                "ocr_ms": 0.0,
+                "peak_rss_bytes": 0,
+            }
+            regions = find_ocr_regions(page)
+            record["extract_ms"] = (time.perf_counter() - started) * 1000
+            future = layout = cache_key = None
+            if regions:
+                record["ocr_regions"] = len(regions)
+                layout = _page_layout(page, regions)
+                cached_regions, cache_key = _cached_ocr_regions(page, ocr_options)
+                if cached_regions is not None:
+                    _merge_ocr_regions(record, cached_regions, layout)
+                    record["ocr_cached"] = True
+                elif _ocr_pixel_estimate(regions) > ocr_pixels_left:
+                    # Out of pixel budget: keep the embedded text only
+                    record["ocr_skipped"] = True
+                    telemetry.inc("mediscan_ocr_skipped_total")
+                else:
+                    ocr_pixels_left -= _ocr_pixel_estimate(regions)
+                    if parallel:
+                        if source is None:
+                            if spool_path or isinstance(file, (str, os.PathLike)):
+                                source = {"path": spool_path or os.fspath(file)}
+                            else:
+                                shm = _share_bytes(pdf_bytes)
+                                source = {"shm": shm.name, "size": len(pdf_bytes)}
+                        future = _get_ocr_pool(workers).submit(
+                            _ocr_page_in_worker, source, page_num, ocr_options, regions
+                        )
+                    else:
+                        result = _ocr_page(page, page_num, ocr_options, regions)
+                        _apply_ocr_result(record, result, layout, cache_key)
+            del page
+            pending.append((record, future, layout, cache_key))
+
+            # Release every leading page that is already complete, and wait for
+            # the oldest one when too many pages are read ahead of the consumer
+            while pending and (pending[0][1] is None or pending[0][1].done() or len(pending) > lookahead):
+                yield finish(*pending.popleft())
 
+        while pending:
+            yield finish(*pending.popleft())
+    finally:
+        for _, future, _, _ in pending:
+            if future is not None:
+                future.cancel()
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        pdf_document.close()
+        if spool_path is not None:
+            os.unlink(spool_path)
+
+
+def extract_pages(file, ocr_workers: int = None, ocr_options: dict = None) -> list:
+    """Extract every page of a PDF at once; see iter_pdf_pages for the record layout."""
+    return list(iter_pdf_pages(file, ocr_workers, ocr_options))
+
+
+def extract_text_from_pdf(file, ocr_workers: int = None, ocr_options: dict = None) -> str:
+    """
+    Extract text from a PDF file robustly.
+
+    Uses PyMuPDF to extract embedded text; if the extracted text from a page
+    is very short (suggesting a scanned page or poor quality text), it falls back
+    to OCR using Tesseract. See iter_pdf_pages for per-page records and timings.
+    """
+    # Keep only each page's text, not its whole record
+    return "\n".join(page["text"] for page in iter_pdf_pages(file, ocr_workers, ocr_options))
@@ -0,0 +1,112 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+import agent
+from stream_buffer import StreamBuffer
+from agent import stream_recommendations, stream_health_metrics, generate_analysis
+
+# Both Groq calls are network bound, so a small thread pool shared by all
+# sessions is enough to overlap them.
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mediscan-llm")
+
+
+def _queued(stage: str, fn, *args):
+    """Submit `fn` to the LLM pool, exporting how long it waited for a free worker."""
+    submitted = time.perf_counter()
+
+    def run():
+        telemetry.observe("mediscan_queue_seconds", time.perf_counter() - submitted, stage=stage)
+        return fn(*args)
+
+    return _executor.submit(run)
+
+
+def _notify(on_metrics, metrics: list):
+    """Hand a finished report's metrics to the `on_metrics` hook; a failing hook must not break the stage."""
+    if on_metrics is None:
+        return
+    try:
+        on_metrics(metrics)
+    except Exception as e:
+        print(f"Storing metrics failed: {e}")
+
+
+def _fill_buffer(buffer: StreamBuffer, chunks, on_finished=None):
+    collected = []
+    try:
+        for chunk in chunks:
+            buffer.append(chunk)
+            if on_finished is not None:
+                collected.append(chunk)
+    except Exception as e:
+        buffer.finish(e)
+    else:
+        # Before finish(), so a reader that sees the buffer done also sees what the hook stored
+        _notify(on_finished, collected)
+        buffer.finish()
+
+
+def _fill_from_analysis(recommendations: StreamBuffer, metrics: StreamBuffer, report: str, rows: list,
+                        on_metrics=None):
+    """Combined mode: run the single structured call and feed both buffers from its result."""
+    try:
+        analysis = generate_analysis(report, rows)
+    except Exception as e:
+        recommendations.finish(e)
+        metrics.finish(e)
+        return
+    for metric in analysis["metrics"]:
+        metrics.append(metric)
+    # On a failed call only the locally parsed metrics are there; do not store a partial report
+    if not agent.is_error_message(analysis["recommendations"]):
+        _notify(on_metrics, analysis["metrics"])
+    metrics.finish()
+    recommendations.append(analysis["recommendations"])
+    recommendations.finish()
+
+
+def llm_report(text: str, rows: list = None) -> str:
+    """The report text the LLM calls are made with; batch.py uses it too, so both share cache entries."""
+    # Rows keep table cells of one result together, which reads better in a prompt
+    return "\n".join(rows) if rows else text
+
+
+def start_llm_stage(text: str, rows: list = None, on_metrics=None) -> dict:
+    """
+    Kick off the recommendations and health metrics calls in parallel.
+
+    Returns a dict of StreamBuffers: recommendation text deltas under
+    "recommendations" and metric dicts, in arrival order, under "metrics".
+    `rows` are the page table rows used for local metric extraction. In
+    "combined" agent mode one structured call fills both buffers.
+    `on_metrics(metrics)` is called on the worker thread once every metric
+    has arrived, whether or not anyone is reading the buffer; it is not
+    called when the metrics call fails.
+    """
+    report = llm_report(text, rows)
+    recommendations = StreamBuffer()
+    metrics = StreamBuffer()
+    if agent.AGENT_MODE == "combined":
+        _queued("analysis", _fill_from_analysis, recommendations, metrics, report, rows, on_metrics)
+        return {"recommendations": recommendations, "metrics": metrics}
+    _queued("recommendations", _fill_buffer, recommendations, stream_recommendations(report))
+    _queued("health_metrics", _fill_buffer, metrics, stream_health_metrics(report, rows), on_metrics)
+    return {"recommendations": recommendations, "metrics": metrics}
+
+
+def finished_llm_stage(recommendations: str, metrics: list, metrics_error: str = None, on_metrics=None) -> dict:
+    """
+    Wrap results computed elsewhere (e.g. by the MediScan service) in finished
+    StreamBuffers; `metrics_error` makes the metrics buffer raise after its
+    metrics. `on_metrics` is called right away unless there was an error, as in start_llm_stage.
+    """
+    buffers = {"recommendations": StreamBuffer(), "metrics": StreamBuffer()}
+    buffers["recommendations"].append(recommendations)
+    for metric in metrics:
+        buffers["metrics"].append(metric)
+    buffers["recommendations"].finish()
+    buffers["metrics"].finish(RuntimeError(metrics_error) if metrics_error else None)
+    if not metrics_error:
+        _notify(on_metrics, metrics)
+    return buffers
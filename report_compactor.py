@@ -0,0 +1,103 @@
+import os
+import re
+from collections import Counter
+
+from report_index import index_report
+
+# Prompt budget for the report part of a prompt, in estimated tokens
+PROMPT_TOKEN_BUDGET = int(os.getenv("MEDISCAN_PROMPT_TOKEN_BUDGET", "3000"))
+CHARS_PER_TOKEN = 4
+
+# Lines that carry no clinical information: pagination, contact details, legal text
+_BOILERPLATE_RE = re.compile(
+    r"(?:^page\s*\d+(?:\s*(?:of|/)\s*\d+)?$"
+    r"|\bpage\s*\d+\s*(?:of|/)\s*\d+\b"
+    r"|end of (?:the )?report"
+    r"|\b(?:tel|phone|ph|fax|mob(?:ile)?|email|e-mail|website)\b\s*[:.]?"
+    r"|www\.|https?://|@\w+\.\w+"
+    r"|not valid for medico|medico[- ]legal"
+    r"|please correlate clinically|clinical correlation"
+    r"|this report is (?:for|not|electronically)|results relate only"
+    r"|electronically (?:signed|verified)|authori[sz]ed signatory"
+    r"|nabl|iso \d{4,5}|accredited"
+    r"|terms and conditions|disclaimer)",
+    re.IGNORECASE,
+)
+_WORD_RE = re.compile(r"[A-Za-z]{2,}")
+_DEMOGRAPHIC_RE = re.compile(r"\b(?:age|sex|gender)\b", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token for English lab text)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _chunk_lines(lines: list, budget: int) -> list:
+    chunks, current, used = [], [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if current and used + cost > budget:
+            chunks.append("\n".join(current))
+            current, used = [], 0
+        current.append(line)
+        used += cost
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def compact_report(text: str, token_budget: int = PROMPT_TOKEN_BUDGET) -> dict:
+    """
+    Shrink extracted report text before it is embedded in a prompt.
+
+    Whitespace is normalized, boilerplate (pagination, contact details,
+    disclaimers) is dropped and lines repeated across pages, such as
+    letterheads, are kept once. If that is still over `token_budget`, only
+    analyte rows, section headings and demographics are kept. Anything still
+    over budget is split into chunks of at most `token_budget` tokens for
+    map-reduce prompting.
+
+    Returns a dict with "text", "chunks", "original_tokens",
+    "compacted_tokens" and "tokens_saved".
+    """
+    # Lab rows and section headings come from the shared report index, not a rescan per line
+    index = index_report(text)
+    lines = [(number, " ".join(line.split())) for number, line in enumerate(index.lines)]
+    lines = [(number, line) for number, line in lines if line]
+    # Page headers/footers repeat with different page numbers; compare them digit-blind
+    shapes = Counter(re.sub(r"\d+", "#", line.lower()) for _, line in lines)
+
+    kept, seen = [], set()
+    for number, line in lines:
+        if _BOILERPLATE_RE.search(line) and not index.is_lab_line(number):
+            continue
+        shape = re.sub(r"\d+", "#", line.lower())
+        # Short cells (units, bare values, ranges) legitimately repeat; only dedupe prose-like lines
+        if shapes[shape] > 1 and len(_WORD_RE.findall(line)) >= 3 and not index.is_lab_line(number):
+            if shape in seen:
+                continue
+            seen.add(shape)
+        kept.append((number, line))
+
+    compacted = "\n".join(line for _, line in kept)
+    if estimate_tokens(compacted) > token_budget:
+        relevant = [
+            (number, line) for number, line in kept
+            if index.is_lab_line(number) or index.is_section_heading(number) or _DEMOGRAPHIC_RE.search(line)
+        ]
+        # Text with one table cell per line has no recognizable rows; chunk it unfiltered
+        if any(index.is_lab_line(number) for number, _ in relevant):
+            kept = relevant
+            compacted = "\n".join(line for _, line in kept)
+
+    kept = [line for _, line in kept]
+    chunks = [compacted] if estimate_tokens(compacted) <= token_budget else _chunk_lines(kept, token_budget)
+    original_tokens = estimate_tokens(text)
+    compacted_tokens = estimate_tokens(compacted)
+    return {
+        "text": compacted,
+        "chunks": chunks,
+        "original_tokens": original_tokens,
+        "compacted_tokens": compacted_tokens,
+        "tokens_saved": max(0, original_tokens - compacted_tokens),
+    }
@@ -0,0 +1,219 @@
+import re
+import bisect
+import functools
+
+from lab_extractor import ANALYTES, is_generic_lab_row
+
+# Any of these marks text as a blood report (validate_blood_report's original keyword list)
+BLOOD_REPORT_KEYWORDS = [
+    "hemoglobin", "RBC", "WBC", "platelets", "MCV", "MCH",
+    "creatinine", "bilirubin", "dengue", "IgG", "IgM", "ELISA",
+    "antibody", "infection", "glucose", "cholesterol",
+]
+
+# An upper-case line containing one of these words is a panel/section heading
+SECTION_WORDS = [
+    "count", "profile", "panel", "function", "test", "tests", "hemogram", "haemogram", "lipid", "thyroid",
+    "serology", "biochemistry", "hematology", "haematology", "electrolytes", "urine", "sugar",
+]
+SECTION_HEADING_MAX_CHARS = 60
+
+
+def _build_terms() -> dict:
+    """Every term the index looks for, lower-cased, with what a match of it tells us."""
+    keyword_res = {keyword.lower(): re.compile(rf"\b{re.escape(keyword.lower())}\b") for keyword in BLOOD_REPORT_KEYWORDS}
+    section_re = re.compile(r"\b(?:" + "|".join(SECTION_WORDS) + r")\b")
+    terms = {synonym: name for name, info in ANALYTES.items() for synonym in info["synonyms"]}
+    for word in list(keyword_res) + SECTION_WORDS:
+        terms.setdefault(word, None)
+    # A longer term hides the shorter ones inside it ("fasting glucose" holds "glucose"), so note them
+    return {
+        term: {
+            "analyte": analyte,
+            "keywords": frozenset(keyword for keyword, keyword_re in keyword_res.items() if keyword_re.search(term)),
+            "section": bool(section_re.search(term)),
+        }
+        for term, analyte in terms.items()
+    }
+
+
+_TERMS = _build_terms()
+
+
+
+def _trie_pattern(terms) -> str:
+    """
+    Regex matching any of `terms`, factored by common prefix ("mc(?:hc|h|v)")
+    so the engine tries one branch per character instead of every term in turn.
+    Longer continuations come first so "mchc" wins over "mch"; spaces match runs of blanks.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in " ".join(term.split()):
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def pattern(node):
+        branches = [
+            (r"[ \t]+" if ch == " " else re.escape(ch)) + pattern(child)
+            for ch, child in sorted(node.items(), key=lambda item: -_depth(item[1])) if ch
+        ]
+        if "" in node:
+            branches.append("")
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return pattern(trie)
+
+
+def _depth(node) -> int:
+    return max((1 + _depth(child) for ch, child in node.items() if ch), default=0)
+
+
+# Every term plus newlines (to keep track of lines), so the whole report is indexed in one scan
+_INDEX_RE = re.compile(r"(?<!\w)(" + _trie_pattern(_TERMS) + r")(?!\w)|(\n)", re.IGNORECASE)
+
+
+def _is_heading_shape(line: str) -> bool:
+    letters = [ch for ch in line if ch.isalpha()]
+    return (
+        len(line) <= SECTION_HEADING_MAX_CHARS and bool(letters)
+        and sum(ch.isupper() for ch in letters) / len(letters) > 0.7
+    )
+
+
+class ReportIndex:
+    """
+    Where the analytes and panels of one report's text are, found in a single
+    regex pass and shared by validation, prompt compaction and local metric parsing.
+
+    `mentions` lists every analyte mention as `{"analyte", "match", "start",
+    "end", "line", "page", "section"}` with character offsets into `text`.
+    `sections` lists panel headings as `{"title", "line", "start", "end",
+    "page"}`; a section runs until the next heading. Page numbers (0-based)
+    are only known when the index was built with `page_starts`.
+    """
+
+    def __init__(self, text: str, page_starts: list = None):
+        self.text = text
+        self.lines = text.split("\n")
+        self.line_starts = [0]
+        self.page_starts = page_starts
+        self.mentions = []
+        self.sections = []
+        self.keywords = set()
+        self._first_mention = {}
+        self._heading_lines = set()
+        self._digit_lines = {}
+        self._scan()
+
+    def _page(self, offset: int):
+        if self.page_starts is None:
+            return None
+        return bisect.bisect_right(self.page_starts, offset) - 1
+
+    def _end_line(self, line_number: int, line_mentions: list, section_word: bool):
+        start = self.line_starts[line_number]
+        if section_word:
+            title = " ".join(self.lines[line_number].split())
+            if _is_heading_shape(title):
+                if self.sections:
+                    self.sections[-1]["end"] = start
+                self._heading_lines.add(line_number)
+                self.sections.append({
+                    "title": title, "line": line_number, "start": start, "end": len(self.text), "page": self._page(start),
+                })
+        for mention in line_mentions:
+            mention["section"] = len(self.sections) - 1 if self.sections else None
+
+    def _scan(self):
+        line_number = 0
+        line_mentions = []
+        section_word = False
+        for match in _INDEX_RE.finditer(self.text):
+            term = match.group(1)
+            if term is None:
+                self._end_line(line_number, line_mentions, section_word)
+                line_number += 1
+                self.line_starts.append(match.end())
+                line_mentions = []
+                section_word = False
+                continue
+            info = _TERMS[" ".join(term.lower().split())]
+            self.keywords.update(info["keywords"])
+            section_word = section_word or info["section"]
+            if info["analyte"] is not None:
+                mention = {
+                    "analyte": info["analyte"], "match": term, "start": match.start(), "end": match.end(),
+                    "line": line_number, "page": self._page(match.start()), "section": None,
+                }
+                self.mentions.append(mention)
+                line_mentions.append(mention)
+                self._first_mention.setdefault(line_number, mention)
+        self._end_line(line_number, line_mentions, section_word)
+
+    def first_mention(self, line_number: int):
+        """The first analyte mention on a line, or None."""
+        return self._first_mention.get(line_number)
+
+    def has_digit(self, line_number: int) -> bool:
+        found = self._digit_lines.get(line_number)
+        if found is None:
+            found = self._digit_lines[line_number] = any(ch.isdigit() for ch in self.lines[line_number])
+        return found
+
+    def is_lab_line(self, line_number: int) -> bool:
+        """Same answer as lab_extractor.is_lab_row for the line, without searching it for analytes again."""
+        if not self.has_digit(line_number):
+            return False
+        return line_number in self._first_mention or is_generic_lab_row(" ".join(self.lines[line_number].split()))
+
+    def is_section_heading(self, line_number: int) -> bool:
+        return line_number in self._heading_lines
+
+    @property
+    def is_blood_report(self) -> bool:
+        """True when any of BLOOD_REPORT_KEYWORDS appears as a whole word."""
+        return bool(self.keywords)
+
+    @property
+    def confidence(self) -> float:
+        """
+        Heuristic 0-1 score that the text is a blood report: each distinct
+        analyte reported next to a number counts fully, each keyword and panel
+        heading (up to four) counts half, and the score is 1 - 0.5 ** evidence.
+        """
+        valued = {mention["analyte"] for mention in self.mentions if self.has_digit(mention["line"])}
+        evidence = len(valued) + 0.5 * len(self.keywords) + 0.5 * min(len(self.sections), 4)
+        return round(1 - 0.5 ** evidence, 3)
+
+    def summary(self) -> dict:
+        """JSON-friendly overview for display and API results."""
+        return {
+            "is_blood_report": self.is_blood_report,
+            "confidence": self.confidence,
+            "analytes": sorted({mention["analyte"] for mention in self.mentions}),
+            "mentions": len(self.mentions),
+            "sections": [{"title": section["title"], "page": section["page"]} for section in self.sections],
+        }
+
+
+@functools.lru_cache(maxsize=32)
+def index_report(text: str) -> ReportIndex:
+    """
+    Index `text`, reusing the index when the same text was indexed recently;
+    validation, compaction and metric parsing of one report share one scan.
+    The returned index is shared, so treat it as read-only.
+    """
+    return ReportIndex(text)
+
+
+def index_pages(page_texts: list) -> ReportIndex:
+    """Index the pages of a document joined by newlines, recording which page each mention is on."""
+    page_starts, offset = [], 0
+    for page_text in page_texts:
+        page_starts.append(offset)
+        offset += len(page_text) + 1
+    return ReportIndex("\n".join(page_texts), page_starts)
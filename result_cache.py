@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Defaults can be overridden through the environment; the entry points (app.py, batch.py,
+# service.py) load .env before importing this module
+DEFAULT_CACHE_PATH = os.getenv("MEDISCAN_CACHE_PATH", os.path.join(".cache", "mediscan_cache.sqlite3"))
+DEFAULT_MEMORY_ENTRIES = int(os.getenv("MEDISCAN_CACHE_MEMORY_ENTRIES", "128"))
+DEFAULT_MAX_BYTES = int(os.getenv("MEDISCAN_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_TTL_SECONDS = float(os.getenv("MEDISCAN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so cosmetic differences in extraction map to the same key."""
+    return " ".join(text.split())
+
+
+def make_cache_key(*parts) -> str:
+    """Build a content-addressed key from any JSON-serializable parts."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache for expensive results.
+
+    Lookups go to an in-memory LRU first and then to a SQLite file shared by
+    every session and process on the machine. Disk entries expire after
+    `ttl_seconds` and the least recently used ones are evicted once the table
+    grows past `max_bytes`.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, namespace="llm",
+                 memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.namespace = namespace
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # A ":memory:" database only lives as long as its connection, so it keeps one
+        self._memory_conn = sqlite3.connect(path, check_same_thread=False) if path == ":memory:" else None
+        self._memory_lock = threading.RLock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "saved_seconds": 0.0,
+            "saved_tokens": 0,
+        }
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        """A connection inside a transaction, committed (or rolled back) and then closed."""
+        if self._memory_conn is not None:
+            # One connection serves every thread, so transactions must not interleave
+            with self._memory_lock, self._memory_conn:
+                yield self._memory_conn
+            return
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        if self.path != ":memory:":
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    cost_seconds REAL NOT NULL DEFAULT 0,
+                    cost_tokens INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (namespace, accessed_at)"
+            )
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry["created_at"] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._count_hit("memory_hits", entry)
+                return entry["value"]
+            self._memory.pop(key, None)
+
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value, cost_seconds, cost_tokens, created_at FROM cache_entries "
+                    "WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row is not None and now - row[3] > self.ttl_seconds:
+                    conn.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                        (self.namespace, key),
+                    )
+                    row = None
+                if row is not None:
+                    conn.execute(
+                        "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                        (now, self.namespace, key),
+                    )
+        except sqlite3.Error as e:
+            print(f"Cache read failed: {e}")
+            row = None
+
+        with self._lock:
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            entry = {
+                "value": json.loads(row[0]),
+                "cost_seconds": row[1],
+                "cost_tokens": row[2],
+                "created_at": row[3],
+            }
+            self._remember(key, entry)
+            self._count_hit("disk_hits", entry)
+            return entry["value"]
+
+    def _count_hit(self, counter, entry):
+        self._stats[counter] += 1
+        self._stats["saved_seconds"] += entry["cost_seconds"]
+        self._stats["saved_tokens"] += entry["cost_tokens"]
+
+    def set(self, key, value, cost_seconds=0.0, cost_tokens=0):
+        """
+        Store `value` under `key`. `cost_seconds` and `cost_tokens` describe what it
+        took to produce the value and are credited to the savings counters on each hit.
+        """
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        entry = {
+            "value": value,
+            "cost_seconds": cost_seconds,
+            "cost_tokens": cost_tokens,
+            "created_at": now,
+        }
+        with self._lock:
+            self._remember(key, entry)
+            self._stats["stores"] += 1
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries "
+                    "(namespace, key, value, size, cost_seconds, cost_tokens, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (self.namespace, key, serialized, len(serialized), cost_seconds,
+                     cost_tokens, now, now),
+                )
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"Cache write failed: {e}")
+
+    def _evict(self, conn, now):
+        expired = conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND created_at < ?",
+            (self.namespace, now - self.ttl_seconds),
+        ).rowcount
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+            (self.namespace,),
+        ).fetchone()[0]
+        evicted = 0
+        if total > self.max_bytes:
+            rows = conn.execute(
+                "SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY accessed_at",
+                (self.namespace,),
+            ).fetchall()
+            stale = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                stale.append((self.namespace, key))
+                total -= size
+            conn.executemany("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", stale)
+            evicted = len(stale)
+            with self._lock:
+                for _, key in stale:
+                    self._memory.pop(key, None)
+        with self._lock:
+            self._stats["evictions"] += expired + evicted
+
+    def clear(self):
+        """Drop every entry in this namespace from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def stats(self) -> dict:
+        """Return hit/miss counters plus the latency and tokens saved by hits."""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,402 @@
+"""
+HTTP API for the report pipeline, for integrations that cannot drive the Streamlit app.
+
+    uvicorn service:app --port 8000
+
+POST a PDF to /jobs to queue it; the 202 response carries a job ID to poll at
+/jobs/{job_id} until its status is "done" (the result is included) or
+"failed". Jobs live in a SQLite table, so queued work survives a restart.
+When MEDISCAN_SERVICE_MAX_PENDING jobs are already queued or running, new
+uploads get 429 with Retry-After. Queue depth is served at /metrics.
+Jobs uploaded with a `patient_id` form field (and optionally `report_date`)
+have their metrics saved to the metrics store for trend queries.
+"""
+import io
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+from fastapi import FastAPI, File, Form, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from dotenv import load_dotenv
+
+# Load .env before the project modules read their MEDISCAN_* settings at import time
+load_dotenv()
+
+import telemetry
+from metrics_store import MetricsStore
+from pdf_processor import iter_pdf_pages
+from pipeline import start_llm_stage
+from report_compactor import compact_report
+from report_index import index_pages
+
+SERVICE_DB_PATH = os.getenv("MEDISCAN_SERVICE_DB", os.path.join(".cache", "mediscan_jobs.sqlite3"))
+SERVICE_WORKERS = int(os.getenv("MEDISCAN_SERVICE_WORKERS", "2"))
+# Queued plus running jobs; uploads beyond this are refused with 429
+SERVICE_MAX_PENDING = int(os.getenv("MEDISCAN_SERVICE_MAX_PENDING", "16"))
+SERVICE_MAX_UPLOAD_BYTES = int(os.getenv("MEDISCAN_SERVICE_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+SERVICE_JOB_TTL_SECONDS = float(os.getenv("MEDISCAN_SERVICE_JOB_TTL_SECONDS", str(24 * 3600)))
+SERVICE_RETRY_AFTER_SECONDS = 5
+
+
+def process_report(pdf_bytes: bytes, on_page=None, on_metrics=None) -> dict:
+    """
+    Run the whole pipeline on one PDF, as the app does: extraction/OCR, then
+    the recommendations and health metrics calls. `on_page(done, total)` is
+    called after every extracted page and `on_metrics` as in start_llm_stage.
+    """
+    pages = []
+    for page in iter_pdf_pages(io.BytesIO(pdf_bytes)):
+        pages.append(page)
+        if on_page is not None:
+            on_page(len(pages), page["page_count"])
+    text = "\n".join(page["text"] for page in pages)
+    rows = [row for page in pages for row in page["rows"]]
+    index = index_pages([page["text"] for page in pages])
+    compacted = compact_report("\n".join(rows))
+    llm = start_llm_stage(text, rows, on_metrics)
+    recommendations = llm["recommendations"].result()
+    metrics, metrics_error = [], None
+    try:
+        for metric in llm["metrics"].iter_chunks():
+            metrics.append(metric)
+    except Exception as e:
+        # Keep the metrics that did arrive; the client re-raises the error in its metrics view
+        metrics_error = f"{type(e).__name__}: {e}"
+    return {
+        "text": text,
+        "pages": [{key: value for key, value in page.items() if key not in ("text", "rows")} for page in pages],
+        "prompt_tokens": {
+            "original_tokens": compacted["original_tokens"],
+            "compacted_tokens": compacted["compacted_tokens"],
+            "tokens_saved": compacted["tokens_saved"],
+            "chunks": len(compacted["chunks"]),
+        },
+        "is_blood_report": index.is_blood_report,
+        "report_index": index.summary(),
+        "recommendations": recommendations,
+        "metrics": metrics,
+        "metrics_error": metrics_error,
+    }
+
+
+class JobStore:
+    """SQLite table of jobs; the uploaded PDF is kept until its job finishes."""
+
+    def __init__(self, path=SERVICE_DB_PATH):
+        self.path = path
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        """A connection inside a transaction, committed (or rolled back) and then closed."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    filename TEXT,
+                    pdf BLOB,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    page_count INTEGER,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    patient_id TEXT,
+                    report_date TEXT
+                )"""
+            )
+            # Tables created before jobs carried a patient
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("patient_id", "report_date"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    def create(self, filename: str, pdf_bytes: bytes, patient_id: str = None, report_date: str = None) -> str:
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, filename, pdf, created_at, patient_id, report_date) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, filename, pdf_bytes, time.time(), patient_id, report_date),
+            )
+        return job_id
+
+    def start(self, job_id: str) -> dict:
+        """Mark the job running and return its PDF, filename, patient ID and report date."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+            row = conn.execute(
+                "SELECT pdf, filename, patient_id, report_date FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return dict(zip(("pdf", "filename", "patient_id", "report_date"), row))
+
+    def progress(self, job_id: str, pages_done: int, page_count: int):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET pages_done = ?, page_count = ? WHERE id = ?", (pages_done, page_count, job_id)
+            )
+
+    def finish(self, job_id: str, result: dict = None, error: str = None):
+        status = "failed" if error is not None else "done"
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, pdf = NULL, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+
+    def get(self, job_id: str) -> dict:
+        """Return the job as a dict (with its parsed result once done), or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, status, filename, pages_done, page_count, result, error, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "status", "filename", "pages_done", "page_count", "result", "error",
+                "created_at", "started_at", "finished_at")
+        job = dict(zip(keys, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def requeue_unfinished(self) -> list:
+        """After a restart, put interrupted jobs back in the queue; returns every queued job ID, oldest first."""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+            return [row[0] for row in conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at")]
+
+    def prune(self, ttl_seconds: float = SERVICE_JOB_TTL_SECONDS) -> int:
+        """Delete finished jobs older than `ttl_seconds`."""
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - ttl_seconds,),
+            ).rowcount
+
+
+class JobQueue:
+    """
+    Bounded worker pool over a JobStore. At most `workers` jobs run at once
+    and at most `max_pending` are admitted (queued or running); `submit`
+    returns None instead of queueing more. Metrics of jobs with a patient ID
+    are saved to `metrics_store`.
+    """
+
+    def __init__(self, store: JobStore, workers: int = SERVICE_WORKERS, max_pending: int = SERVICE_MAX_PENDING,
+                 metrics_store: MetricsStore = None):
+        self.store = store
+        self.metrics_store = metrics_store
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mediscan-job")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._rejected = 0
+        self._enqueued_at = {}
+
+    def resume(self):
+        """Requeue jobs left over from a previous run; these are admitted even past the limit."""
+        for job_id in self.store.requeue_unfinished():
+            self._enqueue(job_id)
+
+    def submit(self, filename: str, pdf_bytes: bytes, patient_id: str = None, report_date: str = None) -> str:
+        with self._lock:
+            if self._queued + self._running >= self.max_pending:
+                self._rejected += 1
+                return None
+            # Reserve the slot before the insert so concurrent uploads cannot overshoot
+            self._queued += 1
+        try:
+            job_id = self.store.create(filename, pdf_bytes, patient_id, report_date)
+        except Exception:
+            with self._lock:
+                self._queued -= 1
+            raise
+        self._enqueue(job_id, reserved=True)
+        return job_id
+
+    def _enqueue(self, job_id: str, reserved: bool = False):
+        with self._lock:
+            if not reserved:
+                self._queued += 1
+            self._enqueued_at[job_id] = time.perf_counter()
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id: str):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            waited = time.perf_counter() - self._enqueued_at.pop(job_id)
+        telemetry.observe("mediscan_job_wait_seconds", waited)
+        started = time.perf_counter()
+        error = None
+        try:
+            with telemetry.span("service.job", job_id=job_id):
+                job = self.store.start(job_id)
+                result = process_report(
+                    job["pdf"], lambda done, total: self.store.progress(job_id, done, total), self._metrics_saver(job)
+                )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            try:
+                self.store.finish(job_id, result=result)
+            except Exception as e:
+                error = f"Storing the result failed: {type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self._running -= 1
+        if error is not None:
+            self._record_failure(job_id, error)
+        telemetry.observe("mediscan_job_seconds", time.perf_counter() - started)
+        telemetry.inc("mediscan_jobs_total", status="failed" if error else "done")
+
+    def _record_failure(self, job_id: str, error: str, attempts: int = 3):
+        """Mark the job failed, retrying briefly so it is not left "running" when the database is busy."""
+        for attempt in range(attempts):
+            try:
+                self.store.finish(job_id, error=error)
+                return
+            except sqlite3.Error as e:
+                if attempt == attempts - 1:
+                    # The job stays "running" and is requeued when the service restarts
+                    print(f"Could not mark job {job_id} as failed: {e}")
+                else:
+                    time.sleep(0.5 * 2 ** attempt)
+
+    def _metrics_saver(self, job: dict):
+        if self.metrics_store is None or not job["patient_id"]:
+            return None
+        report_hash = hashlib.sha256(job["pdf"]).hexdigest()
+        return lambda metrics: self.metrics_store.save_report(
+            report_hash, job["patient_id"], job["report_date"], metrics, job["filename"]
+        )
+
+    def depth(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "running": self._running,
+                "rejected": self._rejected,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+            }
+
+    def shutdown(self):
+        # Queued jobs stay in the table and are picked up again by resume()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+jobs = None
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    global jobs
+    store = JobStore()
+    store.prune()
+    jobs = JobQueue(store, metrics_store=MetricsStore())
+    jobs.resume()
+    try:
+        yield
+    finally:
+        jobs.shutdown()
+
+
+app = FastAPI(title="MediScan API", lifespan=lifespan)
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...), patient_id: str = Form(None), report_date: str = Form(None)):
+    """Queue a report PDF for processing; with `patient_id` its metrics are stored under `report_date` (default today)."""
+    pdf_bytes = await file.read(SERVICE_MAX_UPLOAD_BYTES + 1)
+    if len(pdf_bytes) > SERVICE_MAX_UPLOAD_BYTES:
+        raise HTTPException(413, f"Upload exceeds {SERVICE_MAX_UPLOAD_BYTES} bytes")
+    if not pdf_bytes.startswith(b"%PDF-"):
+        raise HTTPException(415, "Upload is not a PDF")
+    patient_id = (patient_id or "").strip() or None
+    if patient_id is not None:
+        try:
+            report_date = datetime.date.fromisoformat(report_date).isoformat() if report_date else datetime.date.today().isoformat()
+        except ValueError:
+            raise HTTPException(422, "report_date must be an ISO date (YYYY-MM-DD)")
+    job_id = await run_in_threadpool(jobs.submit, file.filename, pdf_bytes, patient_id, report_date)
+    if job_id is None:
+        raise HTTPException(
+            429, "Too many jobs queued, retry later",
+            headers={"Retry-After": str(SERVICE_RETRY_AFTER_SECONDS)},
+        )
+    return {"job_id": job_id, "status": "queued", "queue": jobs.depth()}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status and page progress; includes the result once the job is done."""
+    job = await run_in_threadpool(jobs.store.get, job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job")
+    return job
+
+
+@app.get("/patients/{patient_id}/metrics")
+async def patient_metrics(patient_id: str, analyte: list[str] = Query(None)):
+    """Stored metric history of a patient, oldest first (optionally only some analytes), with per-analyte aggregates."""
+    history = await run_in_threadpool(jobs.metrics_store.history, patient_id, analyte)
+    aggregates = await run_in_threadpool(jobs.metrics_store.aggregates, patient_id)
+    return {"patient_id": patient_id, "history": history, "aggregates": aggregates}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "queue": jobs.depth()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: job queue gauges always, pipeline metrics when MEDISCAN_TELEMETRY is on."""
+    depth = jobs.depth()
+    lines = [
+        "# TYPE mediscan_jobs_queued gauge",
+        f"mediscan_jobs_queued {depth['queued']}",
+        "# TYPE mediscan_jobs_running gauge",
+        f"mediscan_jobs_running {depth['running']}",
+        "# TYPE mediscan_job_workers gauge",
+        f"mediscan_job_workers {depth['workers']}",
+        "# TYPE mediscan_job_max_pending gauge",
+        f"mediscan_job_max_pending {depth['max_pending']}",
+        "# TYPE mediscan_jobs_rejected_total counter",
+        f"mediscan_jobs_rejected_total {depth['rejected']}",
+    ]
+    return "\n".join(lines) + "\n" + (telemetry.export_prometheus() if telemetry.TELEMETRY_ENABLED else "")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("MEDISCAN_SERVICE_PORT", "8000")))
@@ -0,0 +1,53 @@
+import os
+import time
+
+import requests
+
+SERVICE_URL = os.getenv("MEDISCAN_SERVICE_URL", "").rstrip("/")
+SERVICE_POLL_SECONDS = float(os.getenv("MEDISCAN_SERVICE_POLL_SECONDS", "0.5"))
+SERVICE_TIMEOUT = (5, 30)
+SERVICE_WAIT_SECONDS = float(os.getenv("MEDISCAN_SERVICE_WAIT_SECONDS", "900"))
+
+
+class ServiceBusyError(Exception):
+    """Raised when the service refuses a job because its queue is full."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"The analysis service is busy, please retry in {retry_after:.0f} seconds.")
+        self.retry_after = retry_after
+
+
+def submit_report(filename: str, pdf_bytes: bytes, url: str = SERVICE_URL) -> str:
+    """Upload a PDF to the MediScan service and return its job ID."""
+    response = requests.post(
+        f"{url}/jobs", files={"file": (filename, pdf_bytes, "application/pdf")}, timeout=SERVICE_TIMEOUT
+    )
+    if response.status_code == 429:
+        raise ServiceBusyError(float(response.headers.get("Retry-After", 5)))
+    response.raise_for_status()
+    return response.json()["job_id"]
+
+
+def wait_for_job(job_id: str, on_progress=None, url: str = SERVICE_URL, timeout: float = SERVICE_WAIT_SECONDS) -> dict:
+    """
+    Poll a job until it finishes and return its result. `on_progress(done, total)`
+    is called whenever the page count moves; a failed job raises RuntimeError,
+    and one still unfinished after `timeout` seconds raises TimeoutError.
+    """
+    last_done = None
+    deadline = time.monotonic() + timeout
+    with requests.Session() as session:
+        while True:
+            response = session.get(f"{url}/jobs/{job_id}", timeout=SERVICE_TIMEOUT)
+            response.raise_for_status()
+            job = response.json()
+            if on_progress is not None and job["page_count"] and job["pages_done"] != last_done:
+                last_done = job["pages_done"]
+                on_progress(job["pages_done"], job["page_count"])
+            if job["status"] == "done":
+                return job["result"]
+            if job["status"] == "failed":
+                raise RuntimeError(job["error"])
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {job_id} did not finish within {timeout:g} seconds")
+            time.sleep(min(SERVICE_POLL_SECONDS, max(0.0, deadline - time.monotonic())))
@@ -0,0 +1,54 @@
+import threading
+
+
+class StreamBuffer:
+    """
+    Collects chunks (text deltas or metric dicts) produced on a worker thread so
+    any number of readers can replay them, live or after the fact. `result()`
+    blocks like a future and joins text chunks.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._condition = threading.Condition()
+
+    def append(self, chunk):
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, error: BaseException = None):
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._condition.notify_all()
+
+    def done(self) -> bool:
+        with self._condition:
+            return self._done
+
+    def iter_chunks(self):
+        """Yield every chunk from the start, waiting for new ones until the producer finishes."""
+        index = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._done or len(self._chunks) > index)
+                chunks = self._chunks[index:]
+                finished = self._done
+                error = self._error
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if finished and index == len(self._chunks):
+                if error is not None:
+                    raise error
+                return
+
+    def result(self) -> str:
+        return "".join(self.iter_chunks())
+
+    def items(self) -> list:
+        """Block until the producer finishes and return every chunk."""
+        return list(self.iter_chunks())
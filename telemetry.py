@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Off by default; when disabled every helper below returns immediately
+TELEMETRY_ENABLED = os.getenv("MEDISCAN_TELEMETRY", "0").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.getenv("MEDISCAN_METRICS_PORT", "0"))
+LOG_PATH = os.getenv("MEDISCAN_TELEMETRY_LOG")
+
+# Histogram buckets in seconds, from sub-millisecond parsing up to slow OCR/LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger("mediscan.telemetry")
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_metrics_server = None
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Add `value` to the counter `name` with the given labels."""
+    if not TELEMETRY_ENABLED:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """Record `value` (usually seconds) in the histogram `name` with the given labels."""
+    if not TELEMETRY_ENABLED:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(DEFAULT_BUCKETS), "sum": 0.0, "count": 0}
+        index = bisect.bisect_left(DEFAULT_BUCKETS, value)
+        if index < len(DEFAULT_BUCKETS):
+            histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def event(name: str, **fields):
+    """Emit one structured JSON log line."""
+    if not TELEMETRY_ENABLED:
+        return
+    record = {"ts": time.time(), "event": name}
+    record.update(fields)
+    logger.info(json.dumps(record, default=str))
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    Times a pipeline stage. On exit the duration lands in the
+    `mediscan_stage_seconds{stage=...}` histogram, a status counter is bumped
+    and a JSON log line carries the span's attributes.
+    """
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        status = "error" if exc_type else "ok"
+        observe("mediscan_stage_seconds", duration, stage=self.name)
+        inc("mediscan_stage_total", stage=self.name, status=status)
+        fields = dict(self.attrs, duration_s=duration, status=status)
+        if exc is not None:
+            fields["error"] = repr(exc)
+        event(self.name, **fields)
+        return False
+
+
+def span(name: str, **attrs):
+    """Context manager timing a stage; a shared no-op object when telemetry is disabled."""
+    if not TELEMETRY_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def export_prometheus() -> str:
+    """Render all counters and histograms in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]}
+                      for key, h in _histograms.items()}
+    lines = []
+    for metric in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {metric} counter")
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    for metric in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {metric} histogram")
+        for (name, labels), histogram in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(DEFAULT_BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = export_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """Serve /metrics on `port` from a daemon thread; safe to call on every Streamlit rerun."""
+    global _metrics_server
+    if not TELEMETRY_ENABLED or not port:
+        return
+    with _lock:
+        if _metrics_server is not None:
+            return
+        try:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as e:
+            print(f"Metrics server not started on port {port}: {e}")
+            return
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+
+
+if TELEMETRY_ENABLED and not logger.handlers:
+    _handler = logging.FileHandler(LOG_PATH) if LOG_PATH else logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
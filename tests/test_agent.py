@@ -0,0 +1,89 @@
+import json
+
+import pytest
+import requests
+
+import agent
+from groq_client import parse_usage
+from llm_scheduler import LLMScheduler
+from result_cache import ResultCache
+
+REPORT = "\n".join([
+    "Complete Blood Count",
+    "Hemoglobin 13.2 g/dL 13.0-17.0",
+    "WBC Count 7.5",
+    "Platelet Count 250000 /cumm",
+])
+
+ANALYSIS = json.dumps({
+    "metrics": [
+        {"name": "WBC Count", "value": 7.5, "unit": "x10^3/uL", "normal_range": [4.0, 11.0]},
+        {"name": "Platelet Count", "value": 250000, "unit": "/cumm", "normal_range": [150000, 450000]},
+    ],
+    "recommendations": "**Potential Health Concerns:** none.",
+})
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    """Queue of completion texts the fake Groq client answers with, in order; records every payload sent."""
+    queue = []
+    sent = []
+
+    def chat(payload):
+        sent.append(payload)
+        return {"content": queue.pop(0), "usage": parse_usage({}), "raw": {}, "elapsed": 0.1}
+
+    monkeypatch.setattr(agent, "result_cache", ResultCache(":memory:"))
+    monkeypatch.setattr(agent, "scheduler", LLMScheduler(rpm=0, tpm=0))
+    monkeypatch.setattr(agent.groq_client, "chat", chat)
+    return queue, sent
+
+
+def test_truncated_reply_is_not_cached_and_keeps_intact_metrics(replies):
+    queue, sent = replies
+    # Cut off by the token limit inside the second metric
+    queue.extend([ANALYSIS[:ANALYSIS.index('"unit": "/cumm"')], ANALYSIS])
+
+    first = agent.generate_analysis(REPORT)
+    assert first["recommendations"].startswith("Error: invalid structured response")
+    assert [metric["name"] for metric in first["metrics"]] == ["Hemoglobin", "WBC Count"]
+
+    second = agent.generate_analysis(REPORT)
+    assert len(sent) == 2
+    assert second["recommendations"] == "**Potential Health Concerns:** none."
+    assert [metric["name"] for metric in second["metrics"]] == ["Hemoglobin", "WBC Count", "Platelet Count"]
+
+    # The valid reply is cached
+    agent.generate_analysis(REPORT)
+    assert len(sent) == 2
+
+
+def test_reply_of_the_wrong_shape_is_rejected(replies):
+    queue, sent = replies
+    queue.extend([json.dumps({"metrics": []}), json.dumps({"metrics": [], "recommendations": 3})])
+    assert agent.generate_analysis(REPORT)["recommendations"].startswith("Error: invalid structured response")
+    assert agent.generate_analysis(REPORT)["recommendations"].startswith("Error: invalid structured response")
+    assert len(sent) == 2
+
+
+def test_response_log_carries_no_content(replies, monkeypatch):
+    queue, _ = replies
+    queue.append(ANALYSIS)
+    events = []
+    monkeypatch.setattr(agent.telemetry, "event", lambda name, **fields: events.append((name, fields)))
+    agent.generate_analysis(REPORT)
+    (name, fields), = [event for event in events if event[0] == "llm.analysis.response"]
+    assert set(fields) == {"id", "model", "usage", "finish_reason"}
+    assert "Platelet" not in json.dumps(fields)
+
+
+def test_generate_functions_report_failed_calls_as_error_text(replies, monkeypatch):
+    def fail(payload, **kwargs):
+        raise requests.ConnectionError("connection refused")
+
+    monkeypatch.setattr(agent.groq_client, "chat", fail)
+    monkeypatch.setattr(agent.groq_client, "stream_chat", fail)
+    assert agent.is_error_message(agent.generate_health_metrics(REPORT))
+    assert agent.is_error_message(agent.generate_recommendations(REPORT))
+    assert agent.is_error_message(agent.generate_analysis(REPORT)["recommendations"])
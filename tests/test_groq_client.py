@@ -0,0 +1,97 @@
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+import groq_client
+from groq_client import BACKOFF_MAX, GroqAPIError, GroqClient, _completion_content, _retry_delay
+
+COMPLETION = {"choices": [{"message": {"content": "advice"}}], "usage": {"total_tokens": 42}}
+
+
+class _Response:
+    def __init__(self, status_code, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = "error body"
+        self._body = body
+
+    def json(self):
+        return self._body
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(groq_client.time, "sleep", delays.append)
+    return delays
+
+
+def _client(monkeypatch, answers, max_retries=3):
+    """A GroqClient whose POSTs get `answers` in turn; an exception instance is raised instead of answered."""
+    client = GroqClient(api_key="test", url="http://groq.test", max_retries=max_retries)
+    answers = list(answers)
+    posts = []
+
+    def post(url, **kwargs):
+        posts.append(kwargs["json"])
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(client.session, "post", post)
+    return client, posts
+
+
+def test_429_is_retried_after_retry_after(monkeypatch, sleeps):
+    client, posts = _client(monkeypatch, [_Response(429, {"Retry-After": "2"}), _Response(200, body=COMPLETION)])
+    assert client.chat({"messages": []})["content"] == "advice"
+    assert len(posts) == 2
+    assert 2.0 <= sleeps[0] <= 2.0 + BACKOFF_MAX / 10
+
+
+def test_5xx_and_connection_errors_are_retried_up_to_max_retries(monkeypatch, sleeps):
+    client, posts = _client(
+        monkeypatch, [requests.ConnectionError("reset"), _Response(502), _Response(503), _Response(503)], max_retries=3,
+    )
+    with pytest.raises(GroqAPIError) as error:
+        client.chat({"messages": []})
+    assert error.value.status_code == 503
+    assert len(posts) == 4 and len(sleeps) == 3
+
+
+def test_client_errors_are_not_retried(monkeypatch, sleeps):
+    client, posts = _client(monkeypatch, [_Response(400)])
+    with pytest.raises(GroqAPIError):
+        client.chat({"messages": []})
+    assert len(posts) == 1 and sleeps == []
+
+
+@pytest.mark.parametrize("retry_after", ["3600", formatdate(time.time() + 3600, usegmt=True)], ids=["seconds", "date"])
+def test_retry_after_is_clamped_to_backoff_max(retry_after):
+    assert _retry_delay(0, retry_after) == BACKOFF_MAX
+
+
+def test_retry_after_date_gets_jitter(monkeypatch):
+    retry_after = formatdate(time.time() + 5, usegmt=True)
+    monkeypatch.setattr(groq_client.random, "uniform", lambda low, high: 0.0)
+    without_jitter = _retry_delay(3, retry_after)
+    monkeypatch.setattr(groq_client.random, "uniform", lambda low, high: high)
+    assert _retry_delay(3, retry_after) > without_jitter
+
+
+def test_past_or_unparsable_retry_after_falls_back_to_backoff():
+    assert 0.0 <= _retry_delay(0, formatdate(time.time() - 60, usegmt=True)) <= BACKOFF_MAX / 10
+    for attempt in range(10):
+        assert 0.0 <= _retry_delay(attempt, "soon") <= BACKOFF_MAX
+
+
+def test_completion_content_without_choices():
+    assert _completion_content({"choices": []}) is None
+    assert _completion_content({"choices": [{"message": None}]}, "") == ""
+    assert _completion_content(COMPLETION) == "advice"
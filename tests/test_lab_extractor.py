@@ -0,0 +1,42 @@
+import pytest
+
+from lab_extractor import extract_lab_metrics
+from report_index import index_report
+
+
+def _extract(rows, indexed):
+    return extract_lab_metrics(rows, index=index_report("\n".join(rows)) if indexed else None)
+
+
+@pytest.fixture(params=[False, True], ids=["scanned", "indexed"])
+def indexed(request):
+    return request.param
+
+
+def test_row_with_value_unit_and_range_is_parsed(indexed):
+    metrics, unparsed = _extract(["Hemoglobin 13.2 g/dL 13.0-17.0"], indexed)
+    assert metrics == [{"name": "Hemoglobin", "value": 13.2, "unit": "g/dL", "normal_range": [13.0, 17.0]}]
+    assert unparsed == []
+
+
+@pytest.mark.parametrize("row", [
+    "Hemoglobin 13.2 g/dL",           # no range
+    "Platelet Count 250000 /cumm",    # no range, dictionary unit differs
+    "RBC Count 4.8 4.5-5.5",          # no unit
+    "Total Cholesterol 180 mg/dL < 200",  # one-sided limit
+])
+def test_rows_without_range_or_unit_are_left_to_the_llm(row, indexed):
+    metrics, unparsed = _extract([row], indexed)
+    assert metrics == []
+    assert unparsed == [row]
+
+
+def test_qualified_analyte_keeps_its_printed_name(indexed):
+    rows = ["Absolute Neutrophil Count 4.2 10^3/uL 2.0-7.0", "Neutrophils 62 % 40-75"]
+    metrics, _ = _extract(rows, indexed)
+    assert [metric["name"] for metric in metrics] == ["Absolute Neutrophil Count", "Neutrophils"]
+
+
+def test_bare_glucose_is_not_relabelled(indexed):
+    metrics, _ = _extract(["Glucose 95 mg/dL 70-100"], indexed)
+    assert metrics[0]["name"] == "Glucose"
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import BATCH, INTERACTIVE, LLMScheduler, priority
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_follower_replays_chunks_then_gets_leader_error():
+    scheduler = LLMScheduler(rpm=0, tpm=0)
+    follower_entered = threading.Event()
+    received = []
+    errors = []
+
+    def follower():
+        with scheduler.single_flight("same-prompt") as (buffer, leader):
+            assert not leader
+            follower_entered.set()
+            try:
+                for chunk in buffer.iter_chunks():
+                    received.append(chunk)
+            except ConnectionError as e:
+                errors.append(e)
+
+    with pytest.raises(ConnectionError):
+        with scheduler.single_flight("same-prompt") as (buffer, leader):
+            assert leader
+            thread = threading.Thread(target=follower)
+            thread.start()
+            assert follower_entered.wait(5)
+            buffer.append("partial ")
+            raise ConnectionError("connection reset")
+    thread.join(5)
+
+    assert received == ["partial "]
+    assert len(errors) == 1 and str(errors[0]) == "connection reset"
+    assert scheduler.stats()["coalesced"] == 1
+    # The failed flight is gone, so the next identical call leads a fresh one
+    with scheduler.single_flight("same-prompt") as (_, leader):
+        assert leader
+
+
+def test_interactive_call_admitted_before_earlier_batch_call_when_bucket_is_empty():
+    scheduler = LLMScheduler(rpm=600, tpm=0)
+    # Empty the request bucket and go a few requests into debt (one request refills every 0.1 s)
+    scheduler.requests.adjust(-scheduler.requests.capacity - 3)
+    admitted = []
+
+    def call(level, name):
+        with priority(level), scheduler.admitted(tokens=100):
+            admitted.append(name)
+
+    batch = threading.Thread(target=call, args=(BATCH, "batch"))
+    batch.start()
+    _wait_until(lambda: scheduler.stats()["waiting"] == 1)
+    interactive = threading.Thread(target=call, args=(INTERACTIVE, "interactive"))
+    interactive.start()
+    batch.join(5)
+    interactive.join(5)
+
+    assert admitted == ["interactive", "batch"]
+    assert scheduler.stats()["admitted"] == {"interactive": 1, "batch": 1}
@@ -0,0 +1,69 @@
+import pytest
+
+from metrics_store import MetricsStore
+
+
+def _metric(name, value, low=13.0, high=17.0, unit="g/dL"):
+    return {"name": name, "value": value, "unit": unit, "normal_range": [low, high]}
+
+
+def _aggregate(store, patient_id="p1", analyte="Hemoglobin"):
+    (summary,) = [row for row in store.aggregates(patient_id) if row["analyte"] == analyte.lower()]
+    return summary
+
+
+@pytest.fixture
+def store():
+    return MetricsStore(":memory:")
+
+
+def test_aggregates_are_updated_as_reports_arrive_out_of_order(store):
+    store.save_report("r2", "p1", "2024-03-01", [_metric("Hemoglobin", 12.0)])
+    store.save_report("r1", "p1", "2024-01-01", [_metric("Hb", 14.0)])
+    store.save_report("r3", "p1", "2024-02-01", [_metric("Haemoglobin", 16.0)])
+
+    summary = _aggregate(store)
+    assert summary["count"] == 3
+    assert summary["mean"] == pytest.approx(14.0)
+    assert summary["std"] == pytest.approx((8 / 3) ** 0.5)
+    assert (summary["min_value"], summary["max_value"]) == (12.0, 16.0)
+    assert summary["abnormal"] == 1
+    assert (summary["first_date"], summary["last_date"], summary["last_value"]) == ("2024-01-01", "2024-03-01", 12.0)
+    # Synonyms share one series, oldest first
+    assert [(row["date"], row["value"]) for row in store.history("p1", ["hgb"])] == [
+        ("2024-01-01", 14.0), ("2024-02-01", 16.0), ("2024-03-01", 12.0),
+    ]
+
+
+def test_saving_a_report_again_rebuilds_the_series_it_touched(store):
+    store.save_report("r1", "p1", "2024-01-01", [_metric("Hemoglobin", 11.0), _metric("ESR", 30, 0, 20, "mm/hr")])
+    store.save_report("r2", "p1", "2024-02-01", [_metric("Hemoglobin", 15.0)])
+    # The same PDF again, now without ESR and with a corrected hemoglobin value
+    store.save_report("r1", "p1", "2024-01-01", [_metric("Hemoglobin", 13.0)])
+
+    fresh = MetricsStore(":memory:")
+    fresh.save_report("r1", "p1", "2024-01-01", [_metric("Hemoglobin", 13.0)])
+    fresh.save_report("r2", "p1", "2024-02-01", [_metric("Hemoglobin", 15.0)])
+    assert store.aggregates("p1") == fresh.aggregates("p1")
+    assert [row["analyte"] for row in store.aggregates("p1")] == ["hemoglobin"]
+    assert [row["value"] for row in store.history("p1")] == [13.0, 15.0]
+    assert [report["report_hash"] for report in store.reports("p1")] == ["r2", "r1"]
+
+
+def test_unusable_and_repeated_metrics_are_skipped(store):
+    stored = store.save_report("r1", "p1", "2024-01-01", [
+        _metric("Hemoglobin", "13,200"),
+        _metric("Hb", 99.0),
+        {"name": "Comment", "value": "see below"},
+        {"name": "", "value": 1},
+    ])
+    assert stored == 1
+    assert [(row["name"], row["value"]) for row in store.history("p1")] == [("Hemoglobin", 13200.0)]
+
+
+def test_patients_are_kept_apart(store):
+    store.save_report("r1", "p1", "2024-01-01", [_metric("Hemoglobin", 13.0)])
+    store.save_report("r2", "p2", "2024-01-01", [_metric("Hemoglobin", 9.0)])
+    assert _aggregate(store, "p1")["count"] == 1
+    assert _aggregate(store, "p2")["last_value"] == 9.0
+    assert store.history("p3") == [] and store.aggregates("p3") == []
@@ -0,0 +1,34 @@
+from metrics_stream import MetricsStreamParser, normalize_metric, parse_metrics
+
+RESPONSE = (
+    'Here are the metrics:\n```json\n{"metrics": [\n'
+    '  {"name": "Hemoglobin", "value": 13.2, "unit": "g/dL", "normal_range": [13.0, 17.0]},\n'
+    '  {"name": "Platelet Count", "value": "250,000", "unit": "/cumm", "normal_range": ["150,000", "450,000"]}\n'
+    ']}\n```\n'
+)
+
+
+def test_fenced_response_fed_in_small_deltas():
+    parser = MetricsStreamParser()
+    metrics = []
+    for start in range(0, len(RESPONSE), 7):
+        metrics.extend(parser.feed(RESPONSE[start:start + 7]))
+    assert [metric["name"] for metric in metrics] == ["Hemoglobin", "Platelet Count"]
+    assert metrics[1]["value"] == 250000.0
+    assert metrics[1]["normal_range"] == [150000.0, 450000.0]
+
+
+def test_object_cut_off_by_token_limit_is_not_emitted():
+    truncated = RESPONSE[:RESPONSE.index('"unit": "/cumm"')]
+    assert [metric["name"] for metric in parse_metrics(truncated)] == ["Hemoglobin"]
+
+
+def test_braces_inside_strings_do_not_end_an_object():
+    text = '{"metrics": [{"name": "Note {see}", "value": 1, "unit": "", "normal_range": [0, 2]}]}'
+    assert parse_metrics(text)[0]["name"] == "Note {see}"
+
+
+def test_unusable_metrics_are_dropped():
+    assert normalize_metric({"name": "Comment", "value": "see below"}) is None
+    assert normalize_metric({"value": 1}) is None
+    assert normalize_metric({"name": "ESR", "value": "12", "normal_range": None})["normal_range"] == [0.0, 0.0]
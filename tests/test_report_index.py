@@ -0,0 +1,71 @@
+import random
+import re
+
+import pytest
+
+from lab_extractor import ANALYTES, _find_analyte, is_lab_row
+from report_index import BLOOD_REPORT_KEYWORDS, ReportIndex, index_pages
+
+SYNONYMS = sorted({synonym for info in ANALYTES.values() for synonym in info["synonyms"]})
+FILLER = ["Patient", "Remarks:", "see", "note", "SERUM", "Result", "ref", "H", "L", "-", "(", ")", ":", "/"]
+
+
+def _old_is_blood_report(text: str) -> bool:
+    """validate_blood_report before the index: one whole-word regex per keyword."""
+    return any(re.search(rf"\b{keyword}\b", text, re.IGNORECASE) for keyword in BLOOD_REPORT_KEYWORDS)
+
+
+def _random_line(rng: random.Random) -> str:
+    words = []
+    for _ in range(rng.randint(1, 6)):
+        kind = rng.random()
+        if kind < 0.35:
+            words.append(rng.choice([str.lower, str.upper, str.title])(rng.choice(SYNONYMS)))
+        elif kind < 0.45:
+            words.append(rng.choice(BLOOD_REPORT_KEYWORDS))
+        elif kind < 0.75:
+            words.append(f"{rng.uniform(0, 500):.{rng.randint(0, 2)}f}")
+        else:
+            words.append(rng.choice(FILLER))
+    glue = rng.choice([" ", " ", "", "-", "/"])
+    return " ".join(words) if rng.random() < 0.8 else glue.join(words)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_index_agrees_with_the_per_line_regexes(seed):
+    rng = random.Random(seed)
+    text = "\n".join(_random_line(rng) for _ in range(60))
+    index = ReportIndex(text)
+
+    assert index.is_blood_report == _old_is_blood_report(text)
+    for line_number, line in enumerate(index.lines):
+        mention = index.first_mention(line_number)
+        found = _find_analyte(line)
+        assert (mention is None) == (found is None), line
+        if mention is not None:
+            line_start = index.line_starts[line_number]
+            assert (mention["analyte"], mention["start"] - line_start, mention["end"] - line_start) == found, line
+        assert index.is_lab_line(line_number) == is_lab_row(" ".join(line.split())), line
+
+
+def test_longest_synonym_wins():
+    index = ReportIndex("MCHC 33.1 g/dL\nHDL Cholesterol 45 mg/dL\nFasting Glucose 92 mg/dL")
+    assert [mention["analyte"] for mention in index.mentions] == ["MCHC", "HDL Cholesterol", "Fasting Glucose"]
+    # "glucose" and "cholesterol" inside the longer terms still count as keywords
+    assert {"glucose", "cholesterol"} <= index.keywords
+
+
+def test_words_inside_other_words_are_not_mentions():
+    index = ReportIndex("Thrombocytes 2.5\nALTITUDE 300 m\nPlateletcrit 0.2")
+    assert index.mentions == []
+    assert not index.is_blood_report
+
+
+def test_sections_and_pages():
+    index = index_pages(["COMPLETE BLOOD COUNT\nHemoglobin 13.2 g/dL", "LIPID PROFILE\nTriglycerides 140 mg/dL"])
+    assert [(section["title"], section["page"]) for section in index.sections] == [
+        ("COMPLETE BLOOD COUNT", 0), ("LIPID PROFILE", 1),
+    ]
+    assert [(mention["analyte"], mention["page"], mention["section"]) for mention in index.mentions] == [
+        ("Hemoglobin", 0, 0), ("Triglycerides", 1, 1),
+    ]
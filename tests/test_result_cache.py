@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+import result_cache
+from result_cache import ResultCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, "time", clock)
+    return clock
+
+
+@pytest.mark.parametrize("memory_entries", [0, 16], ids=["disk", "memory"])
+def test_entries_expire_after_ttl(clock, memory_entries):
+    cache = ResultCache(":memory:", memory_entries=memory_entries, ttl_seconds=60)
+    cache.set("report", "advice")
+    clock.now += 60
+    assert cache.get("report") == "advice"
+    clock.now += 1
+    assert cache.get("report") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entries_are_evicted_past_max_bytes(clock):
+    value = "x" * 98  # 100 bytes serialized
+    cache = ResultCache(":memory:", memory_entries=0, max_bytes=250)
+    cache.set("a", value)
+    clock.now += 1
+    cache.set("b", value)
+    clock.now += 1
+    assert cache.get("a") == value  # "a" is now more recently used than "b"
+    clock.now += 1
+    cache.set("c", value)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == value
+    assert cache.get("c") == value
+    assert cache.stats()["evictions"] == 1
+
+
+def test_memory_database_keeps_its_entries_across_calls_and_threads():
+    cache = ResultCache(":memory:", memory_entries=0)
+    threads = [threading.Thread(target=cache.set, args=(f"key{i}", i)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [cache.get(f"key{i}") for i in range(8)] == list(range(8))
+    assert cache.stats()["disk_hits"] == 8
+
+
+def test_namespaces_share_a_file_without_sharing_entries(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    ResultCache(path, namespace="llm").set("key", "llm value")
+    ocr = ResultCache(path, namespace="ocr", memory_entries=0)
+    assert ocr.get("key") is None
+    assert ResultCache(path, namespace="llm", memory_entries=0).get("key") == "llm value"
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+import service
+import service_client
+from service import JobQueue, JobStore
+
+PDF = b"%PDF-1.4 test"
+
+
+@pytest.fixture
+def blocked_queue(tmp_path, monkeypatch):
+    """A one-slot JobQueue installed in the app, whose jobs run until `release` is set."""
+    release = threading.Event()
+
+    def process_report(pdf_bytes, on_page=None, on_metrics=None):
+        release.wait(5)
+        return {"recommendations": "advice", "metrics": []}
+
+    monkeypatch.setattr(service, "process_report", process_report)
+    queue = JobQueue(JobStore(str(tmp_path / "jobs.sqlite3")), workers=1, max_pending=1)
+    monkeypatch.setattr(service, "jobs", queue)
+    yield queue, release
+    release.set()
+    queue._executor.shutdown(wait=True)
+
+
+def _wait_for_status(store, job_id, statuses=("done", "failed")):
+    deadline = time.monotonic() + 5
+    while store.get(job_id)["status"] not in statuses:
+        assert time.monotonic() < deadline, "job did not finish"
+        time.sleep(0.01)
+    return store.get(job_id)
+
+
+def test_full_queue_answers_429_until_a_slot_frees(blocked_queue):
+    queue, release = blocked_queue
+    client = TestClient(service.app)
+
+    first = client.post("/jobs", files={"file": ("a.pdf", PDF, "application/pdf")})
+    assert first.status_code == 202
+    rejected = client.post("/jobs", files={"file": ("b.pdf", PDF, "application/pdf")})
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == str(service.SERVICE_RETRY_AFTER_SECONDS)
+    assert queue.depth()["rejected"] == 1
+
+    release.set()
+    assert _wait_for_status(queue.store, first.json()["job_id"])["status"] == "done"
+    assert client.post("/jobs", files={"file": ("b.pdf", PDF, "application/pdf")}).status_code == 202
+
+
+def test_job_is_marked_failed_when_its_result_cannot_be_stored(blocked_queue, monkeypatch):
+    queue, release = blocked_queue
+    release.set()
+    finish = queue.store.finish
+
+    def finish_without_results(job_id, result=None, error=None):
+        if result is not None:
+            raise TypeError("result is not JSON serializable")
+        finish(job_id, error=error)
+
+    monkeypatch.setattr(queue.store, "finish", finish_without_results)
+    job = _wait_for_status(queue.store, queue.submit("a.pdf", PDF))
+    assert job["status"] == "failed"
+    assert "not JSON serializable" in job["error"]
+    assert queue.depth()["running"] == 0
+
+
+class _Response:
+    def __init__(self, job):
+        self.job = job
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.job
+
+
+def _serve(monkeypatch, jobs):
+    """Answer polls with each of `jobs` in turn, repeating the last one."""
+    jobs = list(jobs)
+    monkeypatch.setattr(service_client, "SERVICE_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(
+        requests.Session, "get", lambda self, url, timeout=None: _Response(jobs.pop(0) if len(jobs) > 1 else jobs[0])
+    )
+
+
+def _job(status, pages_done=0, **fields):
+    return dict({"status": status, "pages_done": pages_done, "page_count": 2, "result": None, "error": None}, **fields)
+
+
+def test_wait_for_job_gives_up_after_its_timeout(monkeypatch):
+    _serve(monkeypatch, [_job("running")])
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        service_client.wait_for_job("job", url="http://service", timeout=0.2)
+    assert time.monotonic() - started < 1
+
+
+def test_wait_for_job_reports_progress_and_returns_the_result(monkeypatch):
+    _serve(monkeypatch, [_job("running", 1), _job("running", 1), _job("done", 2, result={"text": "ok"})])
+    progress = []
+    result = service_client.wait_for_job("job", lambda done, total: progress.append(done), url="http://service")
+    assert result == {"text": "ok"}
+    assert progress == [1, 2]
+
+
+def test_wait_for_job_raises_the_job_error(monkeypatch):
+    _serve(monkeypatch, [_job("failed", error="PDFLimitError: too many pages")])
+    with pytest.raises(RuntimeError, match="too many pages"):
+        service_client.wait_for_job("job", url="http://service")